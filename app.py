@@ -1,17 +1,42 @@
+import time
+_rerun_start = time.perf_counter()
+
 import streamlit as st
-from google import genai
-from google.genai import types
 from PIL import Image
 import io
+import logging
 import os
 from dotenv import load_dotenv
 import base64
-import mimetypes
+import functools
+import hashlib
+import tempfile
+import uuid
 from datetime import datetime
-import time
+from tryon import DEFAULT_UPLOAD_FORMAT, UPLOAD_FORMATS, optimize_image_for_ai, stream_item_on_body
+from roi import DEFAULT_ROI_MODE, ROI_MODES
+from frame_select import (BURST_FRAMES, BestFrameSelector, FrameScorer, decode_frame, encode_frame, read_frames,
+                          select_best_frame)
+from async_engine import DEFAULT_CONCURRENCY, fan_out, variants_for_styles
+from result_cache import ResultCache
+from phash_index import PerceptualIndex
+from gemini_client import TIMINGS as CLIENT_TIMINGS, iterate_async
+from rate_limiter import RateLimitExceeded, get_rate_limiter
+from singleflight import get_single_flight
+from job_queue import get_job_queue
+from prompts import get_context_cache
+from key_pool import get_key_pool
+from model_registry import get_model_registry
+from request_policy import CircuitOpenError, get_request_policy
+import history_store
+from history_store import HistoryStore, blob_digest
+from output_images import DEFAULT_DOWNLOAD_QUALITY, DOWNLOAD_FORMATS, GeneratedImage, decode_outputs
+from telemetry import METRICS, configure_logging, span, start_metrics_server
 
 # Load environment variables
 load_dotenv()
+configure_logging()
+logger = logging.getLogger(__name__)
 
 # Configure page
 st.set_page_config(
@@ -21,11 +46,32 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+STYLE_OPTIONS = ["Casual", "Formal", "Business Casual", "Sporty", "Elegant", "Trendy", "Classic"]
+
+# Longest side of on-page photo previews, and how many uploads keep their decoded form
+PREVIEW_MAX_SIDE = int(os.getenv("VTRYON_PREVIEW_SIZE", 720))
+UPLOAD_MEMO_ENTRIES = 16
+OUTPUT_MEMO_ENTRIES = 16
+
+# How often the progress panel checks on a running try-on job
+JOB_POLL_SECONDS = 0.5
+
+# Ways to capture the photo; burst and clip keep only the best-scoring frame
+CAPTURE_MODES = {
+    "snapshot": "📸 Snapshot",
+    "burst": "🎞️ Burst (several shots)",
+    "clip": "🎬 Video clip",
+}
+CLIP_MAX_FRAMES = 300
+
+# Blob store and memory budget shared by every session's history
+@st.cache_resource
+def get_history_resources():
+    return history_store.from_env()
+
 # Initialize session state
 if 'history' not in st.session_state:
-    st.session_state.history = []
-if 'current_result' not in st.session_state:
-    st.session_state.current_result = None
+    st.session_state.history = HistoryStore(*get_history_resources())
 
 # Custom CSS for modern UI
 st.markdown("""
@@ -94,211 +140,552 @@ st.markdown("""
 
 # Initialize Gemini Client
 def initialize_gemini():
-    api_key = os.getenv('GEMINI_API_KEY')
-    if not api_key:
-        st.error("⚠️ Please set your GEMINI_API_KEY in the .env file")
+    pool = get_key_pool()
+    if not pool.keys:
+        st.error("⚠️ Please set your GEMINI_API_KEY (or GEMINI_API_KEYS for several keys) in the .env file")
         st.info("Get your API key from: https://makersuite.google.com/app/apikey")
         return None
     
-    # Using new google-genai package for image generation
-    return genai.Client(api_key=api_key)
+    # One pooled client per key for the whole process, reused across reruns; with
+    # several keys each request is routed to the least loaded one
+    return pool.keys[0].client
+
+# Process-wide result cache shared by all sessions
+@st.cache_resource
+def get_result_cache():
+    return ResultCache.from_env()
+
+# Process-wide perceptual-hash index of past captures
+@st.cache_resource
+def get_similar_index():
+    return PerceptualIndex.from_env()
+
+# Prometheus endpoint, started once per process when VTRYON_METRICS_PORT is set
+@st.cache_resource
+def get_metrics_port():
+    return start_metrics_server()
+
+# Decoded uploads, memoized by content hash so reruns and the generate path share one decode
+@st.cache_resource(max_entries=UPLOAD_MEMO_ENTRIES, show_spinner=False)
+def decode_upload(photo_digest, _photo_bytes):
+    """Decode an upload once at model input size; callers must treat the image as read-only"""
+    return optimize_image_for_ai(Image.open(io.BytesIO(_photo_bytes)))
+
+# Display-sized JPEG of an upload, so st.image does not re-encode the full frame on every rerun
+@st.cache_data(max_entries=UPLOAD_MEMO_ENTRIES, show_spinner=False)
+def preview_upload(photo_digest, _photo_bytes):
+    """Downscale and encode an upload for on-page display"""
+    preview = decode_upload(photo_digest, _photo_bytes).copy()
+    preview.thumbnail((PREVIEW_MAX_SIDE, PREVIEW_MAX_SIDE))
+    buffer = io.BytesIO()
+    preview.save(buffer, format="JPEG", quality=85)
+    return buffer.getvalue()
+
+# Decoded generated images shared by every session; session state keeps only their digests
+@st.cache_resource(max_entries=OUTPUT_MEMO_ENTRIES, show_spinner=False)
+def load_output(digest, _data=None):
+    """Generated image by blob digest, decoded at most once; None once pruned from disk"""
+    data = _data if _data is not None else get_history_resources()[0].get(digest)
+    return GeneratedImage(data) if data is not None else None
+
+# Keep the best frame of a burst or clip for later reruns, with how it was chosen
+def store_best_frame(selector, mode, source):
+    best = selector.best_score
+    st.session_state.best_frame = {
+        "mode": mode,
+        "source": source,
+        "photo": encode_frame(selector.best) if best is not None else None,
+        "frames": len(selector.scores),
+        "index": best.index if best is not None else None,
+        "sharpness": best.sharpness if best is not None else 0.0,
+        "rejected": selector.rejected(),
+        "ms_per_frame": selector.ms_per_frame,
+    }
+
+# Score one more browser camera shot of the current burst
+def add_burst_shot(data):
+    burst = st.session_state.burst
+    digest = hashlib.sha256(data).hexdigest()
+    if digest == burst["last"] or len(burst["selector"].scores) >= BURST_FRAMES:
+        return
+    burst["last"] = digest
+    try:
+        frame = decode_frame(data)
+    except ValueError as e:
+        st.error(f"❌ {e}")
+        return
+    with span("frame_select", frames=1):
+        burst["selector"].feed(frame)
+    store_best_frame(burst["selector"], "burst", burst["id"])
+
+# Capture a burst of browser shots or score an uploaded clip; returns the best frame's JPEG bytes
+def capture_best_frame(capture_mode):
+    """Burst and clip capture: score every frame and keep only the sharpest, steadiest one"""
+    if capture_mode == "burst":
+        if 'burst' not in st.session_state:
+            st.session_state.burst = {
+                "id": uuid.uuid4().hex,
+                # Shots seconds apart are different poses, not motion within one clip
+                "selector": BestFrameSelector(FrameScorer(max_motion=float("inf"))),
+                "last": None,
+            }
+        burst = st.session_state.burst
+        # Frames come from the user's browser, never from a camera on the server
+        shot = st.camera_input(
+            f"Take a few shots (up to {BURST_FRAMES}); the sharpest, best-lit one is kept",
+            key=f"burst_{burst['id']}",
+            help="Clear the photo and take another to add it to the burst"
+        )
+        if shot is not None:
+            add_burst_shot(shot.getvalue())
+        if burst["selector"].scores and st.button("🔄 Start a New Burst", use_container_width=True):
+            st.session_state.pop('burst')
+            st.session_state.pop('best_frame', None)
+            st.rerun()
+    else:
+        clip = st.file_uploader(
+            "Upload a short clip of yourself holding the item",
+            type=["mp4", "mov", "webm", "avi"],
+            key="clip_tryon"
+        )
+        if clip is not None:
+            clip_digest = hashlib.sha256(clip.getvalue()).hexdigest()
+            if st.session_state.get('best_frame', {}).get('source') != clip_digest:
+                with st.spinner("Finding the best frame..."), \
+                        tempfile.NamedTemporaryFile(suffix=os.path.splitext(clip.name)[1]) as f:
+                    f.write(clip.getvalue())
+                    f.flush()
+                    # The uploaded file only: read_frames never opens a camera here
+                    selector = select_best_frame(read_frames(f.name, max_frames=CLIP_MAX_FRAMES, max_seconds=None))
+                store_best_frame(selector, "clip", clip_digest)
+
+    capture = st.session_state.get('best_frame')
+    if capture is None or capture["mode"] != capture_mode:
+        return None
+    dropped = ", ".join(f"{count} {reason}" for reason, count in capture["rejected"].items()) or "none"
+    if capture["photo"] is None:
+        st.warning(f"⚠️ No usable frame among {capture['frames']} (dropped: {dropped}). "
+                   "Hold still in good light and try again.")
+        return None
+    st.caption(f"🎞️ Picked frame {capture['index'] + 1} of {capture['frames']} · sharpness "
+               f"{capture['sharpness']:.0f} · dropped: {dropped} · {capture['ms_per_frame']:.1f} ms/frame to score")
+    return capture["photo"]
+
+# Stable id for this browser session, used for fair scheduling on the job queue
+def session_owner():
+    return st.session_state.setdefault('owner_id', uuid.uuid4().hex)
+
+# Per-session rerun timings: full page runs and each fragment run separately
+def record_rerun(name, elapsed_ms):
+    """Keep the last 50 durations for a page or fragment run"""
+    rerun_times = st.session_state.setdefault('rerun_times_ms', {})
+    samples = rerun_times.setdefault(name, [])
+    samples.append(elapsed_ms)
+    del samples[:-50]
+
+def timed_fragment(name):
+    """Record how long each run of the decorated fragment takes"""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record_rerun(name, (time.perf_counter() - start) * 1000)
+        return wrapper
+    return decorate
 
 # Helper function to create download button for image
-def create_download_button(img_bytes, filename):
+def create_download_button(img_bytes, filename, mime="image/png"):
     """Create a download button for the generated image"""
     return st.download_button(
         label="💾 Download Image",
         data=img_bytes,
         file_name=filename,
-        mime="image/png",
+        mime=mime,
         use_container_width=True
     )
 
-# Helper function to optimize image for better AI processing
-def optimize_image_for_ai(photo):
-    """
-    Optimize image for better AI image generation results
-    """
-    # Convert to RGB if needed
-    if photo.mode != 'RGB':
-        photo = photo.convert('RGB')
+# Fan one photo out to several styles and render each result as it finishes
+def render_style_comparison(client, photo_image, photo_bytes, variants, concurrency, upload_format=None):
+    """Generate all variants concurrently and stream them into the page"""
+    status_text = st.empty()
+    status_text.info(f"🎭 Generating {len(variants)} styles...")
+    results_area = st.container()
+    start = time.perf_counter()
+    
+    done = 0
+    for result in iterate_async(fan_out(client, photo_image, variants, concurrency=concurrency,
+                                        cache=get_result_cache(), upload_format=upload_format)):
+        done += 1
+        status_text.info(f"🎭 {done}/{len(variants)} styles done...")
+        with results_area:
+            st.markdown(f"#### {result.variant.label}")
+            if result.error is not None:
+                st.error(f"❌ {result.variant.label} failed: {result.error}")
+                continue
+            outputs = decode_outputs(result.images)
+            if outputs:
+                source = "cache" if result.from_cache else f"{result.elapsed:.1f}s"
+                st.image(
+                    outputs[0].display(),
+                    caption=f"{result.variant.label} ({source})",
+                    use_container_width=True
+                )
+            else:
+                st.warning(f"⚠️ No image generated for {result.variant.label}")
+            if result.text:
+                with st.expander(f"📊 {result.variant.label} Analysis", expanded=False):
+                    st.markdown(result.text)
+            
+            st.session_state.history.add(
+                style=result.variant.label,
+                text=result.text,
+                images=[output.view for output in outputs],
+                original=photo_bytes,
+                thumbnail=outputs[0].thumbnail() if outputs else None
+            )
+    
+    status_text.success(f"✅ {len(variants)} styles generated in {time.perf_counter() - start:.1f}s")
+
+# Browse past results; full-resolution images are loaded only when opened
+@st.fragment
+@timed_fragment("history")
+def render_history(history):
+    """Show history thumbnails and reload the selected entry from disk"""
+    entries = history.entries()
+    latest = entries[0]
+    st.write(f"**Last generated:** {latest.timestamp}")
+    st.write(f"**Style:** {latest.style}")
+    if latest.image_digests:
+        st.write(f"**Images Generated:** {len(latest.image_digests)}")
     
-    # Resize if too large (max 2048px on longest side for better processing)
-    max_size = 2048
-    if max(photo.size) > max_size:
-        ratio = max_size / max(photo.size)
-        new_size = (int(photo.size[0] * ratio), int(photo.size[1] * ratio))
-        photo = photo.resize(new_size, Image.Resampling.LANCZOS)
-        print(f"📐 Resized image from {photo.size} to {new_size} for optimization")
+    thumb_cols = st.columns(4)
+    for i, entry in enumerate(entries[:8]):
+        with thumb_cols[i % 4]:
+            st.image(entry.thumbnail, caption=f"{entry.style} · {entry.timestamp[-8:]}", use_container_width=True)
     
-    return photo
-
-# Visualize item on body from single photo with retry logic
-def visualize_item_on_body(client, photo, style_preference, custom_prompt="", max_retries=3):
-    """
-    Generate virtual try-on visualization with enhanced image quality
-    """
-    # Optimize image for better generation
-    photo = optimize_image_for_ai(photo)
+    labels = {entry.entry_id: f"{entry.timestamp} · {entry.style}" for entry in entries}
+    selected = st.selectbox("Open a result:", list(labels), format_func=labels.get)
+    if st.button("🔍 Open Full Resolution"):
+        images = history.load_images(selected)
+        original = history.load_original(selected)
+        open_col1, open_col2 = st.columns(2)
+        with open_col1:
+            if original is not None:
+                st.image(original, caption="Original", use_container_width=True)
+        with open_col2:
+            for img_data in images:
+                st.image(img_data, caption="Virtual Try-On Result", use_container_width=True)
+        if not images and original is None:
+            st.warning("⚠️ This result has been removed from disk storage.")
+
+# Shared cache and capacity stats; the Clear Cache button reruns only this panel
+@st.fragment
+@timed_fragment("status")
+def render_service_status():
+    """Show result cache, rate limiter, API keys, single-flight, prompt cache, model health and request policy status"""
+    # Result cache section
+    cache_stats = get_result_cache().stats()
+    st.markdown("### ⚡ Result Cache")
+    st.write(f"**Hits:** {cache_stats['hits']} · **Misses:** {cache_stats['misses']}")
+    st.write(f"**Stored:** {cache_stats['entries']} results ({cache_stats['bytes'] / (1024 * 1024):.1f} MB)")
+    similar_stats = get_similar_index().stats()
+    st.write(f"**Near-duplicate reuses:** {similar_stats['hits']} ({similar_stats['entries']} captures indexed)")
+    if st.button("🧹 Clear Cache"):
+        get_result_cache().clear()
+        st.rerun(scope="fragment")
     
-    # Convert PIL Image to bytes
-    img_byte_arr = io.BytesIO()
-    photo.save(img_byte_arr, format='PNG', quality=95)
-    img_bytes = img_byte_arr.getvalue()
+    # Shared rate limiter status
+    limiter = get_rate_limiter()
+    st.markdown("### 🚦 API Capacity")
+    st.write(f"**Limit:** {limiter.rpm:g} requests/min · {limiter.tpm:,.0f} tokens/min")
+    st.write(f"**Current wait:** {limiter.current_wait():.1f}s · **Queued:** {limiter.queue_depth}")
+    pool = get_key_pool()
+    if pool.active:
+        st.write(f"**API keys:** {len(pool.keys)} · {pool.utilization():.0%} of combined quota in use")
+        for row in pool.stats():
+            status = "🟢" if row["healthy"] else f"🔴 resting {row['quarantined_for']:.0f}s ·"
+            st.caption(
+                f"{status} {row['key']} · {row['requests_last_minute']}/{row['rpm']:g} req/min · "
+                f"{row['in_flight']} in flight · {row['rate_limited']} × 429"
+            )
+        if pool.switches:
+            st.caption(f"🔑 {pool.switches} requests moved to another key after a 429")
+    job_stats = get_job_queue().stats()
+    st.write(
+        f"**Workers:** {job_stats['running']}/{job_stats['workers']} busy · "
+        f"**Jobs queued:** {job_stats['queued']}"
+    )
+    flight_stats = get_single_flight().stats()
+    st.write(
+        f"**In flight:** {flight_stats['in_flight']} · "
+        f"**Duplicate requests joined:** {flight_stats['joined']}"
+    )
+    prompt_stats = get_context_cache().stats()
+    if prompt_stats["cached_requests"]:
+        st.write(
+            f"**Prompt cache:** {prompt_stats['cached_requests']} requests · "
+            f"{prompt_stats['cached_tokens']:,} tokens reused"
+        )
+    elif prompt_stats["failures"]:
+        st.caption("Prompt prefix sent inline (context cache unavailable)")
+    
+    # Model routing: fastest healthy model first
+    registry = get_model_registry()
+    st.markdown("### 🧠 Models")
+    for row in registry.stats():
+        latency = f"{row['median_latency']:.1f}s" if row["median_latency"] is not None else "not measured"
+        st.write(
+            f"{'🟢' if row['healthy'] else '🔴'} **{row['model']}** · {latency} · "
+            f"{row['calls']} calls, {row['error_rate']:.0%} errors"
+        )
+    if registry.failovers:
+        st.caption(f"🔀 {registry.failovers} failovers to another model")
+    policy_stats = get_request_policy().stats()
+    breaker = policy_stats["breaker"]
+    if breaker["state"] != "closed":
+        st.warning(f"🔴 Circuit breaker {breaker['state'].replace('_', '-')}: {breaker['rejected']} requests failed fast")
+    if policy_stats["hedges"] or policy_stats["timeouts"]:
+        st.caption(
+            f"🪝 {policy_stats['hedges']} hedged requests ({policy_stats['hedge_wins']} won) · "
+            f"{policy_stats['timeouts']} timeouts"
+        )
+
+# Generate button and results; generation itself runs on the shared job queue
+@st.fragment
+@timed_fragment("tryon")
+def render_tryon(model, photo_digest, photo_bytes, style_preference, custom_prompt, upload_format, reuse_similar,
+                 roi_mode):
+    """Submit a try-on job for the captured photo and show its stored result"""
+    force_fresh = st.session_state.pop('force_fresh', False)
+    active = st.session_state.get('tryon_job')
+    if st.button("✨ Visualize Item ON My Body!", use_container_width=True, type="primary",
+                 disabled=active is not None) or force_fresh:
+        photo_image = decode_upload(photo_digest, photo_bytes)
+        # Resolve shared resources here; the worker thread has no Streamlit context
+        cache, similar_index = get_result_cache(), get_similar_index()
+        job_id = get_job_queue().submit(
+            session_owner(),
+            lambda: stream_item_on_body(
+                model,
+                photo_image,
+                style_preference,
+                custom_prompt,
+                cache=cache,
+                upload_format=upload_format,
+                similar_index=similar_index,
+                reuse_similar=reuse_similar and not force_fresh,
+                roi_mode=roi_mode
+            ),
+            label=style_preference
+        )
+        st.session_state.tryon_job = {"job_id": job_id, "photo_digest": photo_digest, "style": style_preference}
+        # Full rerun so the progress panel below starts polling
+        st.rerun()
+    
+    if st.session_state.pop('tryon_cancelled', False):
+        st.info("✖️ Generation cancelled.")
+    error = st.session_state.pop('tryon_error', None)
+    if error is not None:
+        if isinstance(error, RateLimitExceeded) and error.quota:
+            st.error("💳 API quota exceeded. Please check your API plan.")
+        elif isinstance(error, RateLimitExceeded):
+            st.error("⏳ Rate limit exceeded. Please wait a moment and try again.")
+        elif isinstance(error, CircuitOpenError):
+            st.error(f"🔴 The generation service is having trouble. Please try again in {error.retry_in:.0f}s.")
+        elif isinstance(error, TimeoutError):
+            st.error("⌛ The generation service did not respond in time. Please try again.")
+        else:
+            st.error(f"❌ Error: {error}")
+    
+    last_result = st.session_state.get('last_result')
+    if active is None and last_result is not None and last_result["photo_digest"] == photo_digest:
+        render_result(last_result, photo_bytes)
+        if st.session_state.pop('celebrate', False):
+            st.balloons()
+
+# Live progress of the session's try-on job; polls the queue until the job finishes
+@st.fragment(run_every=JOB_POLL_SECONDS)
+@timed_fragment("job")
+def render_job_progress(photo_bytes):
+    """Show queue position, streamed text and images, and collect the result when done"""
+    active = st.session_state.get('tryon_job')
+    job = get_job_queue().get(active["job_id"]) if active else None
+    if job is None:
+        st.session_state.pop('tryon_job', None)
+        st.rerun()
     
-    # Use custom prompt if provided, otherwise use enhanced default
-    if custom_prompt and custom_prompt.strip():
-        prompt = custom_prompt
-        print(f"\n🎨 Using CUSTOM prompt:\n{prompt}\n")
+    if job.finished_state:
+        collect_job(job, active, photo_bytes)
+        st.session_state.pop('tryon_job', None)
+        st.rerun()
+    
+    if job.state == "queued":
+        ahead = get_job_queue().position(job.job_id)
+        st.info(f"⏳ Waiting for a free worker ({ahead} request{'s' if ahead != 1 else ''} ahead)...")
+        st.progress(5)
+    elif job.attempt:
+        st.warning(f"🔁 Retrying (attempt {job.attempt + 1})...")
+        st.progress(20)
+    elif job.images:
+        st.info("🖼️ Image received, finishing up...")
+        st.progress(90)
+    elif job.text:
+        st.info("✍️ AI is describing the result...")
+        st.progress(max(30, min(80, 30 + len(job.text) // 20)))
     else:
-        # Enhanced prompt for better image generation
-        prompt = f"""
-You are a professional fashion AI photographer. I'm showing you a photo where a person is HOLDING a fashion item in their hand.
-
-CRITICAL TRANSFORMATION TASK:
-Generate a HIGH-QUALITY, REALISTIC image showing the SAME person with the SAME item now properly worn/carried on their body.
-
-DETAILED TRANSFORMATION INSTRUCTIONS:
-
-1. IDENTIFY THE ITEM FIRST:
-   - Look carefully at what they're holding
-   - Note the exact color, material, style, and design
-
-2. REMOVE FROM HAND:
-   - Make their hand completely empty and natural
-   - Hand should be in a relaxed position (not holding anything)
-
-3. PLACE ITEM ON BODY BASED ON TYPE:
-   
-   CLOTHING (shirt, top, dress, jacket, pants, etc.):
-   - Show them WEARING it naturally on their body
-   - Ensure proper fit and draping
-   - Match the exact same clothing item from their hand
-   - Keep realistic proportions and fit
-   
-   BAG/PURSE/BACKPACK:
-   - Position on their shoulder or across body
-   - Or hanging naturally from their arm/hand while walking
-   - Show realistic strap positioning
-   - Maintain the exact same bag design and color
-   
-   SHOES/FOOTWEAR:
-   - Show them wearing the shoes on their FEET
-   - Match their current outfit style
-   - Ensure realistic foot positioning and sizing
-   
-   JEWELRY (necklace, bracelet, watch, ring):
-   - Place on appropriate body part (wrist, neck, finger)
-   - Show natural, comfortable positioning
-   - Maintain exact design and style
-   
-   SUNGLASSES:
-   - Position on their face/nose naturally
-   - Match their face shape
-   - Keep realistic positioning
-   
-   HAT/CAP:
-   - Place on their head naturally
-   - Match their head size and style
-   - Show realistic angle and fit
-
-4. PHOTO REALISM REQUIREMENTS:
-   - Keep EXACT same person (face, body type, skin tone, hair)
-   - Maintain EXACT same background and environment
-   - Preserve lighting conditions and shadows
-   - Keep the same pose and angle
-   - Ensure seamless integration - item should look like it was always there
-   - No visible seams, artifacts, or distortions
-   - Natural shadows and reflections on the item
-
-5. STYLE MATCHING:
-   - Style preference: {style_preference}
-   - Ensure the item matches their {style_preference} aesthetic
-   - Coordinate with their existing outfit if applicable
-
-6. QUALITY STANDARDS:
-   - High resolution and sharp details
-   - Natural, professional photography look
-   - Realistic materials and textures
-   - Proper lighting on the item
-   - No AI artifacts or distortions
-
-Generate a photorealistic, seamless virtual try-on image that looks like a professional fashion photograph.
-"""
-        print(f"\n🎨 Using ENHANCED prompt with style: {style_preference}\n")
+        st.info("🎨 Generating virtual try-on with AI...")
+        st.progress(20)
     
-    model = "gemini-2.5-flash-image-preview"
+    # Render text deltas and images as they stream in
+    if job.images:
+        st.image(job.images[-1], caption="✨ Virtual Try-On Result", use_container_width=True)
+    if job.text:
+        st.markdown(job.text)
+    if st.button("✖️ Cancel", key="cancel_job"):
+        get_job_queue().cancel(job.job_id, owner=session_owner())
+
+# Move a finished job's result into the session: history, last result or error
+def collect_job(job, active, photo_bytes):
+    """Record a finished try-on job for this session"""
+    if job.state == "cancelled":
+        st.session_state.tryon_cancelled = True
+        return
+    if job.state == "failed":
+        st.session_state.tryon_error = job.error
+        return
     
-    contents = [
-        types.Content(
-            role="user",
-            parts=[
-                types.Part.from_bytes(data=img_bytes, mime_type="image/png"),
-                types.Part.from_text(text=prompt),
-            ],
-        ),
-    ]
+    done = job.result
+    text_response = done.text if done is not None else job.text
+    generated_images = done.images if done is not None else job.images
+    # Decode each image once; display, thumbnail and downloads all share it
+    digests = [blob_digest(data) for data in generated_images]
+    outputs = [load_output(digest, data) for digest, data in zip(digests, generated_images)]
     
-    # Enhanced configuration for better image quality
-    generate_content_config = types.GenerateContentConfig(
-        response_modalities=["IMAGE", "TEXT"],
-        temperature=0.7,  # Balance between creativity and accuracy
+    # Store result in history (full images are spilled to disk)
+    st.session_state.history.add(
+        style=active["style"],
+        text=text_response,
+        images=[output.view for output in outputs],
+        original=photo_bytes,
+        thumbnail=outputs[0].thumbnail() if outputs else None
     )
+    # Kept for this photo so reruns (e.g. picking a download format) still show it; the images
+    # themselves stay in the blob store and load_output, outside the session
+    st.session_state.last_result = {
+        "photo_digest": active["photo_digest"],
+        "text": text_response,
+        "image_digests": digests,
+        "timings": done.timings if done is not None else {},
+        "from_cache": done.from_cache if done is not None else False,
+        "similar_distance": done.similar_distance if done is not None else None,
+    }
+    st.session_state.celebrate = True
+
+# Comparison view, gallery and downloads for one finished try-on
+def render_result(result, photo_bytes):
+    """Show a stored try-on result; downloads are transcoded only for the chosen format"""
+    outputs = [output for output in map(load_output, result["image_digests"]) if output is not None]
+    text_response = result["text"]
+    st.markdown("---")
+    if len(outputs) < len(result["image_digests"]):
+        st.warning("⚠️ Some generated images have been removed from disk storage.")
     
-    # Retry logic for better reliability
-    for attempt in range(max_retries):
-        try:
-            print(f"\n🔄 Generating virtual try-on image... (Attempt {attempt + 1}/{max_retries})")
+    with span("render", payload_bytes=sum(len(output) for output in outputs)):
+        # Comparison view
+        if outputs:
+            st.markdown("### 📊 Before & After Comparison")
+            comp_col1, comp_col2 = st.columns(2)
+    
+            with comp_col1:
+                st.markdown("**📷 Original (Item in Hand)**")
+                st.image(preview_upload(result["photo_digest"], photo_bytes), use_container_width=True)
+    
+            with comp_col2:
+                st.markdown("**✨ Virtual Try-On Result**")
+                st.image(outputs[0].display(), use_container_width=True)
+    
+        # Show text analysis if available
+        if text_response:
+            with st.expander("📊 Detailed AI Analysis", expanded=False):
+                st.markdown(text_response)
+    
+        # Show all generated images with download buttons
+        if outputs:
+            st.markdown("### 🖼️ Generated Images")
+            fmt_col, quality_col = st.columns(2)
+            with fmt_col:
+                download_format = st.selectbox(
+                    "Download format:",
+                    ["original", *DOWNLOAD_FORMATS],
+                    format_func=str.upper,
+                    key="download_format",
+                    help="WebP and JPEG downloads are several times smaller than the original PNG"
+                )
+            with quality_col:
+                download_quality = st.slider(
+                    "Quality:",
+                    min_value=50,
+                    max_value=100,
+                    value=DEFAULT_DOWNLOAD_QUALITY,
+                    key="download_quality",
+                    disabled=download_format not in ("jpeg", "webp")
+                )
             
-            generated_images = []
-            text_response = ""
+            for i, output in enumerate(outputs):
+                try:
+                    img_col1, img_col2 = st.columns([3, 1])
             
-            for chunk in client.models.generate_content_stream(
-                model=model,
-                contents=contents,
-                config=generate_content_config,
-            ):
-                if (
-                    chunk.candidates is None
-                    or chunk.candidates[0].content is None
-                    or chunk.candidates[0].content.parts is None
-                ):
-                    continue
-                
-                # Check for image data
-                if chunk.candidates[0].content.parts[0].inline_data and chunk.candidates[0].content.parts[0].inline_data.data:
-                    inline_data = chunk.candidates[0].content.parts[0].inline_data
-                    data_buffer = inline_data.data
-                    file_extension = mimetypes.guess_extension(inline_data.mime_type)
-                    print(f"✅ Received image data: {len(data_buffer)} bytes, mime: {inline_data.mime_type}, ext: {file_extension}")
-                    generated_images.append(data_buffer)
-                else:
-                    # Text response
-                    if hasattr(chunk, 'text') and chunk.text:
-                        text_response += chunk.text
-                        print(chunk.text)
+                    with img_col1:
+                        st.image(output.display(), caption=f"Virtual Try-On Result {i+1}", use_container_width=True)
             
-            return text_response, generated_images
+                    with img_col2:
+                        download = output.download(download_format, download_quality)
+                        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                        filename = f"virtual_tryon_{timestamp}_{i+1}.{download.extension}"
+                        create_download_button(download.data, filename, download.mime_type)
+                        st.caption(f"{len(download.data) / 1024:.0f} KB")
             
-        except Exception as e:
-            error_str = str(e).lower()
-            # Check for rate limit or quota errors
-            if "rate limit" in error_str or "429" in error_str or "quota" in error_str or "resource exhausted" in error_str:
-                if attempt < max_retries - 1:
-                    wait_time = (attempt + 1) * 5
-                    print(f"⚠️ Rate limit hit. Waiting {wait_time}s before retry...")
-                    time.sleep(wait_time)
-                    continue
-                else:
-                    raise Exception("Rate limit exceeded. Please try again later.")
-            if attempt < max_retries - 1:
-                print(f"⚠️ Error occurred: {e}. Retrying...")
-                time.sleep(2)
-                continue
-            else:
-                raise
+                    logger.debug("✅ Displayed image %d", i + 1)
+                except Exception as img_err:
+                    st.error(f"Could not display image {i+1}: {img_err}")
+                    logger.error("❌ Error displaying image %d: %s", i + 1, img_err)
+        else:
+            st.warning("⚠️ No images were generated. Please try again or check your prompt.")
     
-    return "", []
+    st.success("✅ Visualization Complete!")
+    similar_distance, timings = result["similar_distance"], result["timings"]
+    if similar_distance is not None:
+        st.info(f"♻️ This capture looks just like an earlier one (distance {similar_distance}), so its result was reused.")
+        st.button(
+            "🔄 Generate Fresh Instead",
+            on_click=lambda: st.session_state.update(force_fresh=True)
+        )
+    elif result["from_cache"]:
+        st.caption("⚡ Served from cache")
+    elif timings.get("total") is not None:
+        st.caption(
+            f"⏱️ First response {timings['ttfb'] or 0:.1f}s · "
+            f"first image {timings['first_image'] or 0:.1f}s · "
+            f"total {timings['total']:.1f}s"
+        )
+
+# Multi-style comparison, isolated from the rest of the page like render_tryon
+@st.fragment
+@timed_fragment("compare")
+def render_comparison(model, photo_digest, photo_bytes, variants, concurrency, upload_format):
+    """Offer the side-by-side style comparison for the captured photo"""
+    if variants and st.button(f"🎭 Compare {len(variants)} Styles", use_container_width=True):
+        render_style_comparison(
+            model,
+            decode_upload(photo_digest, photo_bytes),
+            photo_bytes,
+            variants,
+            concurrency,
+            upload_format
+        )
 
 # Main app
 def main():
@@ -319,7 +706,31 @@ def main():
         
         style_preference = st.selectbox(
             "Style Preference:",
-            ["Casual", "Formal", "Business Casual", "Sporty", "Elegant", "Trendy", "Classic"]
+            STYLE_OPTIONS
+        )
+        
+        upload_format = st.selectbox(
+            "Upload Encoding:",
+            list(UPLOAD_FORMATS),
+            index=list(UPLOAD_FORMATS).index(DEFAULT_UPLOAD_FORMAT),
+            format_func=str.upper,
+            help="JPEG and WebP upload much faster than PNG with no visible difference to the model"
+        )
+        
+        roi_mode = st.selectbox(
+            "Subject Crop:",
+            ROI_MODES,
+            index=ROI_MODES.index(DEFAULT_ROI_MODE) if DEFAULT_ROI_MODE in ROI_MODES else 0,
+            format_func={"off": "Off (whole frame)", "crop": "Crop to subject",
+                         "composite": "Crop, then paste back into frame"}.get,
+            help="Send only the detected person and item to the model to cut upload size and input tokens"
+        )
+        
+        capture_mode = st.selectbox(
+            "Capture Mode:",
+            list(CAPTURE_MODES),
+            format_func=CAPTURE_MODES.get,
+            help="Burst and clip capture score every frame for sharpness, motion and exposure and keep the best one"
         )
         
         st.markdown("---")
@@ -336,17 +747,49 @@ def main():
                 help="Leave empty to use default prompt"
             )
         
+        reuse_similar = st.checkbox(
+            "♻️ Reuse results for near-identical captures",
+            value=True,
+            help="If you recapture the same pose and item with the same style, show the earlier result instantly"
+        )
+        
+        st.markdown("---")
+        st.markdown("### 🎭 Compare Styles")
+        
+        compare_styles = st.multiselect(
+            "Styles to compare side by side:",
+            STYLE_OPTIONS,
+            help="All selected styles are generated in parallel from the same photo"
+        )
+        compare_concurrency = st.slider(
+            "Parallel requests:",
+            min_value=1,
+            max_value=len(STYLE_OPTIONS),
+            value=DEFAULT_CONCURRENCY
+        )
+        
         st.markdown("---")
         
         # History section
-        if st.session_state.history:
+        if len(st.session_state.history):
             st.markdown("### 📜 History")
             st.write(f"**Total tries:** {len(st.session_state.history)}")
+            session_mem = st.session_state.history.memory_usage()
+            global_mem = get_history_resources()[1].memory_usage()
+            st.write(
+                f"**Memory:** {session_mem['total_bytes'] / 1024:.0f} KB this session · "
+                f"{global_mem['total_bytes'] / (1024 * 1024):.1f} MB across {global_mem['sessions']} sessions"
+            )
             if st.button("🗑️ Clear History"):
-                st.session_state.history = []
-                st.session_state.current_result = None
+                st.session_state.history.clear()
                 st.rerun()
         
+        render_service_status()
+        
+        # Filled in at the end of the run, once the rerun cost is known
+        st.markdown("### ⏱️ Performance")
+        perf_box = st.empty()
+
         st.markdown("---")
         st.markdown("### 💡 How It Works")
         st.markdown("""
@@ -387,138 +830,55 @@ def main():
     st.markdown("## 📸 Hold Item & Capture")
     st.info("💡 Stand facing the camera and hold the fashion item clearly in your hand, then click to capture!")
     
-    photo_file = st.camera_input(
-        "Capture yourself holding the item",
-        key="camera_tryon",
-        help="Hold the item (bag, clothing, shoes, accessory) clearly in your hand"
-    )
+    if capture_mode == "snapshot":
+        photo_file = st.camera_input(
+            "Capture yourself holding the item",
+            key="camera_tryon",
+            help="Hold the item (bag, clothing, shoes, accessory) clearly in your hand"
+        )
+        photo_bytes = photo_file.getvalue() if photo_file else None
+    else:
+        photo_bytes = capture_best_frame(capture_mode)
     
-    if photo_file:
+    if photo_bytes:
+        photo_digest = hashlib.sha256(photo_bytes).hexdigest()
         col1, col2 = st.columns([1, 1])
         
         with col1:
             st.markdown("### 📷 Your Photo")
-            photo_image = Image.open(photo_file)
             st.markdown('<div class="image-container">', unsafe_allow_html=True)
-            st.image(photo_image, use_container_width=True)
+            st.image(preview_upload(photo_digest, photo_bytes), use_container_width=True)
             st.markdown('</div>', unsafe_allow_html=True)
         
         with col2:
             st.markdown("### 🎨 AI Visualization")
             
-            # Generate button
-            if st.button("✨ Visualize Item ON My Body!", use_container_width=True, type="primary"):
-                progress_bar = st.progress(0)
-                status_text = st.empty()
-                
-                try:
-                    photo_image = Image.open(photo_file)
-                    
-                    status_text.info("🔄 Processing your photo...")
-                    progress_bar.progress(20)
-                    
-                    status_text.info("🎨 Generating virtual try-on with AI...")
-                    progress_bar.progress(50)
-                    
-                    text_response, generated_images = visualize_item_on_body(
-                        model, 
-                        photo_image, 
-                        style_preference,
-                        custom_prompt if use_custom_prompt else ""
-                    )
-                    
-                    progress_bar.progress(90)
-                    status_text.info("✨ Finalizing results...")
-                    
-                    # Store result in session state
-                    result_data = {
-                        'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                        'style': style_preference,
-                        'text': text_response,
-                        'images': generated_images,
-                        'original_image': photo_image
-                    }
-                    st.session_state.current_result = result_data
-                    st.session_state.history.append(result_data)
-                    
-                    progress_bar.progress(100)
-                    status_text.empty()
-                    progress_bar.empty()
-                    
-                    # Show results
-                    st.markdown("---")
-                    
-                    # Comparison view
-                    if generated_images and len(generated_images) > 0:
-                        st.markdown("### 📊 Before & After Comparison")
-                        comp_col1, comp_col2 = st.columns(2)
-                        
-                        with comp_col1:
-                            st.markdown("**📷 Original (Item in Hand)**")
-                            st.image(photo_image, use_container_width=True)
-                        
-                        with comp_col2:
-                            st.markdown("**✨ Virtual Try-On Result**")
-                            main_result_img = Image.open(io.BytesIO(generated_images[0]))
-                            st.image(main_result_img, use_container_width=True)
-                    
-                    # Show text analysis if available
-                    if text_response:
-                        with st.expander("📊 Detailed AI Analysis", expanded=False):
-                            st.markdown(text_response)
-                    
-                    # Show all generated images with download buttons
-                    if generated_images and len(generated_images) > 0:
-                        st.markdown("### 🖼️ Generated Images")
-                        for i, img_data in enumerate(generated_images):
-                            try:
-                                img = Image.open(io.BytesIO(img_data))
-                                
-                                img_col1, img_col2 = st.columns([3, 1])
-                                
-                                with img_col1:
-                                    st.image(img, caption=f"Virtual Try-On Result {i+1}", use_container_width=True)
-                                
-                                with img_col2:
-                                    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                                    filename = f"virtual_tryon_{timestamp}_{i+1}.png"
-                                    create_download_button(img_data, filename)
-                                
-                                print(f"✅ Successfully displayed image {i+1}")
-                            except Exception as img_err:
-                                st.error(f"Could not display image {i+1}: {img_err}")
-                                print(f"❌ Error displaying image {i+1}: {img_err}")
-                    else:
-                        st.warning("⚠️ No images were generated. Please try again or check your prompt.")
-                    
-                    st.success("✅ Visualization Complete!")
-                    st.balloons()
-                    
-                except Exception as e:
-                    progress_bar.empty()
-                    status_text.empty()
-                    error_msg = str(e)
-                    
-                    if "rate limit" in error_msg.lower() or "429" in error_msg:
-                        st.error("⏳ Rate limit exceeded. Please wait a moment and try again.")
-                    elif "quota" in error_msg.lower():
-                        st.error("💳 API quota exceeded. Please check your API plan.")
-                    else:
-                        st.error(f"❌ Error: {error_msg}")
-                    
-                    print(f"❌ Main error: {e}")
-                    import traceback
-                    traceback.print_exc()
+            render_tryon(
+                model,
+                photo_digest,
+                photo_bytes,
+                style_preference,
+                custom_prompt if use_custom_prompt else "",
+                upload_format,
+                reuse_similar,
+                roi_mode
+            )
+            if st.session_state.get('tryon_job') is not None:
+                render_job_progress(photo_bytes)
             
-            # Show current result if available
-            if st.session_state.current_result:
+            # Multi-style comparison
+            if compare_styles or use_custom_prompt:
+                variants = variants_for_styles(
+                    compare_styles,
+                    [custom_prompt] if use_custom_prompt else []
+                )
+                render_comparison(model, photo_digest, photo_bytes, variants, compare_concurrency, upload_format)
+            
+            # Show history if available
+            if len(st.session_state.history):
                 st.markdown("---")
-                with st.expander("📜 View Last Result", expanded=False):
-                    result = st.session_state.current_result
-                    st.write(f"**Generated:** {result['timestamp']}")
-                    st.write(f"**Style:** {result['style']}")
-                    if result['images']:
-                        st.write(f"**Images Generated:** {len(result['images'])}")
+                with st.expander("📜 View History", expanded=False):
+                    render_history(st.session_state.history)
     
     # Footer
     st.markdown("---")
@@ -528,6 +888,45 @@ def main():
             <p style='font-size: 12px;'>Note: This is an AI-powered styling assistant. For best results, consult with professional stylists.</p>
         </div>
     """, unsafe_allow_html=True)
+    
+    render_performance(perf_box)
+
+# Rerun and client timings, so the cost of each interaction is visible
+def render_performance(container):
+    """Record this rerun's duration and show recent page, fragment and client timings"""
+    elapsed_ms = (time.perf_counter() - _rerun_start) * 1000
+    record_rerun("page", elapsed_ms)
+    rerun_times = st.session_state.rerun_times_ms
+    recent = sorted(rerun_times["page"])
+    
+    lines = [
+        f"**This rerun:** {elapsed_ms:.0f} ms · **median:** {recent[len(recent) // 2]:.0f} ms over {len(recent)} runs",
+        f"**Gemini client:** {CLIENT_TIMINGS['clients_created']} created · {CLIENT_TIMINGS['client_reuses']} reuses",
+    ]
+    fragment_text = " · ".join(
+        f"{name} {sorted(samples)[len(samples) // 2]:.0f}"
+        for name, samples in rerun_times.items() if name != "page"
+    )
+    if fragment_text:
+        lines.append(f"**Fragment runs, median ms:** {fragment_text}")
+    if CLIENT_TIMINGS['genai_import_ms'] is not None:
+        lines.append(
+            f"**Startup:** google-genai import {CLIENT_TIMINGS['genai_import_ms']:.0f} ms · "
+            f"client build {CLIENT_TIMINGS['client_create_ms']:.0f} ms"
+        )
+    summary = METRICS.summary()
+    if summary["stages"]:
+        stage_text = " · ".join(
+            f"{stage} {stats['p50_ms']:.0f}/{stats['p95_ms']:.0f}"
+            for stage, stats in summary["stages"].items()
+        )
+        lines.append(f"**Stages p50/p95 (ms):** {stage_text}")
+        lines.append(f"**Retry rate:** {summary['retry_rate']:.0%} over {summary['requests']:g} requests")
+    metrics_port = get_metrics_port()
+    if metrics_port:
+        lines.append(f"**Metrics:** http://localhost:{metrics_port}/metrics")
+    container.markdown("  \n".join(lines))
+    logger.debug("⏱️ Rerun took %.0f ms", elapsed_ms)
 
 if __name__ == "__main__":
     main()
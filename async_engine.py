@@ -0,0 +1,302 @@
+"""
+Asyncio generation engine built on the google-genai async client.
+
+One captured photo is preprocessed once and fanned out to several styles or
+custom prompts, with at most ``concurrency`` requests in flight. Results are
+yielded as each request finishes, so wall-clock time for N variants is close
+to the slowest single call rather than the sum.
+"""
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+
+from key_pool import get_key_pool
+from model_registry import get_model_registry, is_model_fault
+from rate_limiter import (
+    FATAL,
+    RATE_LIMIT,
+    FailoverError,
+    call_with_retries_async,
+    classify_error,
+    estimate_tokens,
+    get_rate_limiter,
+)
+from prompts import ContextCacheExpired, get_context_cache
+from request_policy import CircuitOpenError, get_request_policy
+from result_cache import ResultCache
+from singleflight import get_single_flight
+from telemetry import count_attempt, count_request, record_stage, span, trace
+from tryon import (
+    MODEL_NAME,
+    build_generate_config,
+    build_prompt,
+    build_request,
+    encode_image,
+    optimize_image_for_ai,
+    parse_chunk,
+    with_timeout,
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENCY = 3
+
+
+@dataclass
+class Variant:
+    """One style or custom prompt to render from the shared photo"""
+    label: str
+    style_preference: str
+    custom_prompt: str = ""
+
+
+@dataclass
+class VariantResult:
+    """Outcome of one variant; ``error`` is set instead of raising"""
+    variant: Variant
+    text: str = ""
+    images: list = field(default_factory=list)
+    error: Exception = None
+    elapsed: float = 0.0
+    from_cache: bool = False
+
+
+def variants_for_styles(styles, custom_prompts=()):
+    """
+    Build Variant objects for a list of styles plus optional custom prompts
+    """
+    variants = [Variant(label=style, style_preference=style) for style in styles]
+    for i, prompt in enumerate(custom_prompts):
+        if prompt and prompt.strip():
+            variants.append(Variant(label=f"Custom {i + 1}", style_preference="", custom_prompt=prompt))
+    return variants
+
+
+async def generate_async(client, img_bytes, prompt, max_retries=3, cache=None, limiter=None, mime_type="image/png",
+                         coalesce=True):
+    """
+    Async counterpart of generate_try_on
+
+    Identical concurrent requests on the same event loop share one call
+    unless coalesce=False.
+    """
+    model = MODEL_NAME
+    generate_content_config = build_generate_config()
+
+    cache_key = None
+    if cache is not None:
+        cache_key = cache.make_key(img_bytes, prompt, model, generate_content_config)
+        cached = await asyncio.to_thread(cache.get, cache_key)
+        if cached is not None:
+            count_request("cache_hit", model=model)
+            return cached[0], cached[1], True
+
+    limiter = limiter or get_rate_limiter()
+    tokens = estimate_tokens(prompt)
+    context_cache = get_context_cache()
+    registry = get_model_registry()
+    policy = get_request_policy()
+    pool = get_key_pool()
+    tried = set()
+    tried_keys = set()
+    # choose() may list models over the network when the cached list is stale, so it
+    # always runs off the event loop
+    route = {
+        "model": await asyncio.to_thread(registry.choose, client),
+        "key": pool.choose(tokens) if pool.active else None,
+    }
+
+    async def attempt_once(attempt):
+        model, key = route["model"], route["key"]
+        labels = {"model": model, "attempt": attempt, "payload_bytes": len(img_bytes)}
+        generated_images = []
+        text_response = ""
+        total_tokens = None
+        usage = None
+        if key is not None:
+            try:
+                await key.limiter.acquire_async(tokens)
+            except asyncio.CancelledError:
+                limiter.refund(tokens)
+                raise
+        attempt_client = key.client if key is not None else client
+        # Creating a context cache is a blocking call on the sync client
+        request = await asyncio.to_thread(
+            build_request, attempt_client, img_bytes, prompt, mime_type, generate_content_config, context_cache, model
+        )
+        try:
+            policy.breaker.allow()
+        except CircuitOpenError:
+            # Nothing was sent: give the capacity taken for this attempt back
+            limiter.refund(tokens)
+            if key is not None:
+                key.limiter.refund(tokens)
+            count_request("rejected", model=model)
+            raise
+        if key is not None:
+            pool.begin(key, tokens)
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        started = loop.time()
+        first_chunk = None
+        try:
+            # Time-to-first-chunk timeout, then the attempt deadline (no hedging on this path)
+            try:
+                async with asyncio.timeout(policy.ttfc_timeout or policy.attempt_deadline or None) as timer:
+                    # The async SDK returns once response headers have arrived
+                    with span("send", **labels, cached_prefix=request.cache_handle is not None):
+                        stream = await attempt_client.aio.models.generate_content_stream(
+                            model=model,
+                            contents=request.contents,
+                            config=with_timeout(request.config, policy.attempt_deadline),
+                        )
+                    async for chunk in stream:
+                        if first_chunk is None:
+                            first_chunk = time.perf_counter() - start
+                            record_stage("first_chunk", first_chunk, **labels)
+                            policy.observe_first_chunk(first_chunk)
+                            timer.reschedule(started + policy.attempt_deadline if policy.attempt_deadline else None)
+                        if chunk.usage_metadata and chunk.usage_metadata.total_token_count:
+                            total_tokens = chunk.usage_metadata.total_token_count
+                            usage = chunk.usage_metadata
+                        text, data_buffer, _ = parse_chunk(chunk)
+                        if data_buffer:
+                            generated_images.append(data_buffer)
+                        elif text:
+                            text_response += text
+            except TimeoutError:
+                if not timer.expired():
+                    raise
+                raise policy.timeout_error(first_chunk is not None) from None
+        except asyncio.CancelledError as e:
+            policy.finish(e)
+            if key is not None:
+                pool.release(key)
+            raise
+        except Exception as e:
+            policy.finish(e)
+            if context_cache.recover(e, request.cache_handle):
+                e = ContextCacheExpired(str(e))
+            kind = classify_error(e)
+            next_key = None
+            if key is not None:
+                pool.finish(key, e)
+                if kind == RATE_LIMIT:
+                    tried_keys.add(key)
+                    next_key = pool.choose(tokens, exclude=tried_keys)
+            next_model = None
+            if next_key is None and is_model_fault(kind, e) and not isinstance(e, ContextCacheExpired):
+                registry.record(model, ok=False, error=e)
+                tried.add(model)
+                next_model = await asyncio.to_thread(registry.choose, client, exclude=tried)
+            if attempt >= max_retries - 1 or (kind == FATAL and next_model is None):
+                outcome = "failed"
+            else:
+                outcome = "failover" if next_model is not None or next_key is not None else "retry"
+            count_attempt(outcome, model=model, reason="rate_limit" if kind == RATE_LIMIT else "error")
+            if outcome == "failed":
+                count_request("error", model=model)
+            if next_key is not None:
+                # Quotas are per key: the same model goes out on another key straight away
+                pool.switch(key, next_key, e)
+                route["key"] = next_key
+                raise FailoverError(e, model, model) from e
+            route["key"] = pool.choose(tokens) if pool.active else None
+            if next_model is not None:
+                registry.failover(model, next_model, e)
+                route["model"] = next_model
+                raise FailoverError(e, model, next_model) from e
+            route["model"] = await asyncio.to_thread(registry.choose, client)
+            if isinstance(e, ContextCacheExpired):
+                raise e
+            raise
+        policy.finish()
+        registry.record(model, ok=True, latency=time.perf_counter() - start)
+        record_stage("stream", time.perf_counter() - start - (first_chunk or 0), **labels,
+                     output_bytes=sum(len(data) for data in generated_images))
+        count_attempt("ok", model=model)
+        count_request("generated", model=model)
+        limiter.settle(tokens, total_tokens)
+        if key is not None:
+            key.limiter.settle(tokens, total_tokens)
+            pool.finish(key, tokens=total_tokens or tokens)
+        if request.template is not None:
+            context_cache.record(request.cache_handle, request.template, usage)
+        return text_response, generated_images
+
+    async def generate():
+        result = await call_with_retries_async(attempt_once, tokens=tokens, max_retries=max_retries, limiter=limiter)
+        if result is None:
+            return "", []
+        text_response, generated_images = result
+        if cache is not None and generated_images:
+            await asyncio.to_thread(cache.put, cache_key, text_response, generated_images)
+        return text_response, generated_images
+
+    if coalesce:
+        flight_key = cache_key or ResultCache.make_key(img_bytes, prompt, model, generate_content_config)
+        text_response, generated_images = await get_single_flight().run_async(flight_key, generate)
+    else:
+        text_response, generated_images = await generate()
+    return text_response, generated_images, False
+
+
+async def fan_out(client, photo, variants, concurrency=DEFAULT_CONCURRENCY, max_retries=3, cache=None,
+                  upload_format=None, coalesce=True):
+    """
+    Render every variant of one photo concurrently, yielding VariantResult in completion order
+
+    Variants that resolve to the same prompt share one call unless
+    coalesce=False. Closing the generator (or cancelling the task iterating
+    it) cancels all outstanding requests.
+    """
+    # Keep CPU-bound preprocessing off the event loop
+    photo = await asyncio.to_thread(optimize_image_for_ai, photo)
+    with span("encode", format=upload_format) as encode_span:
+        img_bytes, mime_type = await asyncio.to_thread(encode_image, photo, upload_format)
+        encode_span.set(payload_bytes=len(img_bytes))
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def run(variant):
+        async with semaphore:
+            start = time.perf_counter()
+            prompt = build_prompt(variant.style_preference, variant.custom_prompt)
+            logger.info("🔄 Generating variant '%s'...", variant.label)
+            try:
+                # Each task runs in its own context, so the trace id stays with this variant
+                with trace():
+                    text, images, from_cache = await generate_async(
+                        client, img_bytes, prompt, max_retries=max_retries, cache=cache, mime_type=mime_type,
+                        coalesce=coalesce
+                    )
+                return VariantResult(variant, text, images, elapsed=time.perf_counter() - start, from_cache=from_cache)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("❌ Variant '%s' failed: %s", variant.label, e)
+                return VariantResult(variant, error=e, elapsed=time.perf_counter() - start)
+
+    tasks = [asyncio.create_task(run(variant)) for variant in variants]
+    try:
+        for finished in asyncio.as_completed(tasks):
+            yield await finished
+    finally:
+        pending = [task for task in tasks if not task.done()]
+        for task in pending:
+            task.cancel()
+        if pending:
+            logger.info("🛑 Cancelled %d outstanding variant(s)", len(pending))
+            await asyncio.gather(*pending, return_exceptions=True)
+
+
+async def collect(client, photo, variants, concurrency=DEFAULT_CONCURRENCY, max_retries=3, cache=None):
+    """
+    Run fan_out to completion and return the results in completion order
+    """
+    return [
+        result
+        async for result in fan_out(
+            client, photo, variants, concurrency=concurrency, max_retries=max_retries, cache=cache
+        )
+    ]
@@ -0,0 +1,374 @@
+"""
+Headless batch try-on over a directory of photos or a manifest.
+
+Usage:
+    python batch_tryon.py photos/ --output results/ --style Casual --style Formal
+    python batch_tryon.py manifest.csv --output results/ --concurrency 4
+
+A manifest is a CSV (columns: path, style, prompt) or JSONL file with the
+same keys; ``style`` and ``prompt`` are optional. Relative paths are
+resolved against the manifest's directory.
+
+Photos are decoded and optimized in a process pool, then handed through a
+bounded queue to a fixed number of API worker threads. Every finished item
+is written to the output directory immediately and appended to
+``journal.jsonl`` there, so re-running the same command skips finished work.
+"""
+import argparse
+import csv
+import hashlib
+import json
+import multiprocessing
+import os
+import queue
+import re
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from dotenv import load_dotenv
+from PIL import Image
+
+from key_pool import get_key_pool
+from output_images import DEFAULT_DOWNLOAD_QUALITY, DOWNLOAD_FORMATS, decode_outputs
+from result_cache import ResultCache
+from telemetry import METRICS, configure_logging, percentile, start_metrics_server, trace
+from tryon import UPLOAD_FORMATS, build_prompt, encode_image, generate_try_on, optimize_image_for_ai
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp"}
+JOURNAL_NAME = "journal.jsonl"
+_STOP = object()
+
+
+def slugify(text):
+    return re.sub(r"[^A-Za-z0-9]+", "-", text).strip("-").lower() or "item"
+
+
+def prompt_tag(prompt):
+    """
+    Readable, collision-safe tag for a custom prompt: its slug plus a hash of the full text
+    """
+    digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8]
+    return f"{slugify(prompt)[:40]}-{digest}"
+
+
+def guess_image_extension(data):
+    """
+    Pick a file extension from the leading bytes of generated image data
+    """
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return ".png"
+    if data[:3] == b"\xff\xd8\xff":
+        return ".jpg"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return ".webp"
+    return ".bin"
+
+
+def load_items(source, styles, prompt):
+    """
+    Expand a directory or manifest into a list of work items
+
+    Each item is a dict with id, path, style and prompt.
+    """
+    rows = []
+    if os.path.isdir(source):
+        for root, _, files in os.walk(source):
+            for name in sorted(files):
+                if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+                    rows.append({"path": os.path.join(root, name)})
+        rows.sort(key=lambda row: row["path"])
+        base = source
+    else:
+        base = os.path.dirname(os.path.abspath(source))
+        with open(source, newline="", encoding="utf-8") as f:
+            if source.lower().endswith(".csv"):
+                rows = list(csv.DictReader(f))
+            else:
+                rows = [json.loads(line) for line in f if line.strip()]
+        for row in rows:
+            if not os.path.isabs(row["path"]):
+                row["path"] = os.path.join(base, row["path"])
+
+    items = []
+    for row in rows:
+        rel = os.path.relpath(row["path"], base)
+        row_styles = [row["style"]] if row.get("style") else styles
+        row_prompt = row.get("prompt") or prompt
+        for style in row_styles:
+            # The extension stays in the id: shoot/a.jpg and shoot/a.png are different items
+            item_id = f"{rel.replace(os.sep, '/')}::{style}"
+            if row_prompt:
+                item_id += f"::{prompt_tag(row_prompt)}"
+            items.append({"id": item_id, "path": row["path"], "style": style, "prompt": row_prompt})
+    return items
+
+
+def read_journal(path):
+    """
+    Return the ids of items already completed successfully
+    """
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # Torn last line from an interrupted run
+                continue
+            if entry.get("status") == "ok":
+                done.add(entry["id"])
+    return done
+
+
+def preprocess(path, upload_format=None, max_size=None):
+    """
+    Decode, optimize and encode one photo; runs in a worker process
+
+    Returns (img_bytes, mime_type).
+    """
+    with Image.open(path) as photo:
+        return encode_image(optimize_image_for_ai(photo, max_size=max_size), upload_format)
+
+
+class BatchRunner:
+    """
+    Process pool for preprocessing feeding a bounded queue of API workers
+    """
+
+    def __init__(self, client, output_dir, workers=None, concurrency=4, max_retries=3, cache=None,
+                 upload_format=None, max_size=None, output_format="original", output_quality=DEFAULT_DOWNLOAD_QUALITY):
+        self.client = client
+        self.output_dir = output_dir
+        self.workers = workers
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.cache = cache
+        self.upload_format = upload_format
+        self.max_size = max_size
+        self.output_format = output_format
+        self.output_quality = output_quality
+        self.journal_path = os.path.join(output_dir, JOURNAL_NAME)
+        self._journal_lock = threading.Lock()
+        self.latencies = []
+        self.succeeded = 0
+        self.failed = 0
+
+    def _write_outputs(self, item, text_response, generated_images):
+        item_dir = os.path.join(self.output_dir, os.path.dirname(item["id"].split("::")[0]))
+        os.makedirs(item_dir, exist_ok=True)
+        stem = slugify(os.path.basename(item["id"].split("::")[0])) + "_" + slugify(item["style"])
+        if item["prompt"]:
+            stem += "_" + prompt_tag(item["prompt"])
+        outputs = []
+        for i, output in enumerate(decode_outputs(generated_images)):
+            if self.output_format == "original":
+                data, extension = output.view, guess_image_extension(output.data)
+            else:
+                download = output.download(self.output_format, self.output_quality)
+                data, extension = download.data, "." + download.extension
+            out_path = os.path.join(item_dir, f"{stem}_{i + 1}{extension}")
+            with open(out_path, "wb") as f:
+                f.write(data)
+            outputs.append(os.path.relpath(out_path, self.output_dir))
+        if text_response:
+            with open(os.path.join(item_dir, f"{stem}.txt"), "w", encoding="utf-8") as f:
+                f.write(text_response)
+        return outputs
+
+    def _record(self, entry):
+        with self._journal_lock:
+            with open(self.journal_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            if entry["status"] == "ok":
+                self.succeeded += 1
+                self.latencies.append(entry["latency"])
+            else:
+                self.failed += 1
+            done = self.succeeded + self.failed
+        symbol = "✅" if entry["status"] == "ok" else "❌"
+        print(f"{symbol} [{done}] {entry['id']} ({entry.get('latency', 0):.1f}s)")
+
+    def _api_worker(self, work_queue):
+        while True:
+            job = work_queue.get()
+            if job is _STOP:
+                return
+            item, (img_bytes, mime_type) = job
+            start = time.perf_counter()
+            try:
+                prompt = build_prompt(item["style"], item["prompt"])
+                with trace():
+                    text_response, generated_images = generate_try_on(
+                        self.client, img_bytes, prompt, max_retries=self.max_retries, cache=self.cache,
+                        mime_type=mime_type
+                    )
+                if not generated_images:
+                    raise RuntimeError("no image returned")
+                outputs = self._write_outputs(item, text_response, generated_images)
+                self._record({"id": item["id"], "status": "ok", "outputs": outputs,
+                              "latency": time.perf_counter() - start})
+            except Exception as e:
+                self._record({"id": item["id"], "status": "error", "error": str(e),
+                              "latency": time.perf_counter() - start})
+
+    def run(self, items):
+        """
+        Process every item not already recorded as done; returns a summary dict
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        done = read_journal(self.journal_path)
+        pending = [item for item in items if item["id"] not in done]
+        skipped = len(items) - len(pending)
+        if skipped:
+            print(f"⏭️ Skipping {skipped} item(s) already in {self.journal_path}")
+
+        start = time.perf_counter()
+        # Preprocess each distinct photo once even when it has several styles
+        by_path = {}
+        for item in pending:
+            by_path.setdefault(item["path"], []).append(item)
+        paths = iter(by_path)
+
+        # Bounded so preprocessing cannot run arbitrarily far ahead of the API:
+        # at most max_pending photos are being encoded or waiting in finished
+        # futures, and a full queue stops the next one being submitted
+        work_queue = queue.Queue(maxsize=self.concurrency * 2)
+        workers = self.workers or os.cpu_count() or 1
+        max_pending = workers * 2
+        # Worker processes must not be forked from a process that is already running threads
+        methods = multiprocessing.get_all_start_methods()
+        mp_context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+        threads = [
+            threading.Thread(target=self._api_worker, args=(work_queue,), daemon=True)
+            for _ in range(self.concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+
+        try:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=mp_context) as pool:
+                futures = {}
+
+                def submit_next():
+                    path = next(paths, None)
+                    if path is not None:
+                        futures[pool.submit(preprocess, path, self.upload_format, self.max_size)] = path
+
+                for _ in range(max_pending):
+                    submit_next()
+                while futures:
+                    finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        path = futures.pop(future)
+                        try:
+                            encoded = future.result()
+                        except Exception as e:
+                            for item in by_path[path]:
+                                self._record({"id": item["id"], "status": "error",
+                                              "error": f"preprocess: {e}", "latency": 0.0})
+                        else:
+                            for item in by_path[path]:
+                                work_queue.put((item, encoded))
+                        submit_next()
+        finally:
+            for _ in threads:
+                work_queue.put(_STOP)
+            for thread in threads:
+                thread.join()
+
+        wall = time.perf_counter() - start
+        return {
+            "items": len(items),
+            "skipped": skipped,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "wall_seconds": wall,
+            "throughput_per_min": (self.succeeded + self.failed) / wall * 60 if wall else 0.0,
+            "latency_p50": percentile(self.latencies, 50) or 0.0,
+            "latency_p95": percentile(self.latencies, 95) or 0.0,
+            "latency_max": max(self.latencies, default=0.0),
+        }
+
+
+def print_summary(summary):
+    print("\n📊 Batch summary")
+    print(f"  Items:       {summary['items']} ({summary['skipped']} skipped from journal)")
+    print(f"  Succeeded:   {summary['succeeded']}")
+    print(f"  Failed:      {summary['failed']}")
+    print(f"  Wall time:   {summary['wall_seconds']:.1f}s")
+    print(f"  Throughput:  {summary['throughput_per_min']:.1f} items/min")
+    print(f"  Latency:     p50 {summary['latency_p50']:.1f}s · p95 {summary['latency_p95']:.1f}s · max {summary['latency_max']:.1f}s")
+    metrics = METRICS.summary()
+    if metrics["stages"]:
+        print(f"  Retry rate:  {metrics['retry_rate']:.0%} ({metrics['retries']:g} retries, "
+              f"{metrics['rate_limited']:g} rate limited)")
+        print("  Stages (ms):    p50      p95      p99")
+        for stage, stats in metrics["stages"].items():
+            print(f"    {stage:<14} {stats['p50_ms']:6.0f}   {stats['p95_ms']:6.0f}   {stats['p99_ms']:6.0f}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run virtual try-on over a directory of photos or a manifest")
+    parser.add_argument("source", help="Directory of photos, or a .csv/.jsonl manifest")
+    parser.add_argument("--output", "-o", required=True, help="Directory for generated images and the journal")
+    parser.add_argument("--style", action="append", dest="styles",
+                        help="Style preference (repeatable); default: Casual")
+    parser.add_argument("--prompt", default="", help="Custom prompt used instead of the default")
+    parser.add_argument("--workers", type=int, default=None, help="Preprocessing processes (default: CPU count)")
+    parser.add_argument("--concurrency", type=int, default=4, help="Concurrent API requests")
+    parser.add_argument("--max-retries", type=int, default=3)
+    parser.add_argument("--limit", type=int, default=None, help="Only process the first N items")
+    parser.add_argument("--upload-format", choices=sorted(UPLOAD_FORMATS), default=None,
+                        help="Encoding of the photo sent to the model (default: VTRYON_UPLOAD_FORMAT or jpeg)")
+    parser.add_argument("--max-size", type=int, default=None,
+                        help="Longest side in pixels sent to the model (default: VTRYON_TARGET_SIZE or 1024)")
+    parser.add_argument("--output-format", choices=["original", *DOWNLOAD_FORMATS], default="original",
+                        help="Transcode generated images before writing them (default: keep the model's encoding)")
+    parser.add_argument("--output-quality", type=int, default=DEFAULT_DOWNLOAD_QUALITY,
+                        help="JPEG/WebP quality for --output-format")
+    parser.add_argument("--no-cache", action="store_true", help="Bypass the on-disk result cache")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    load_dotenv()
+    configure_logging()
+    start_metrics_server()
+    pool = get_key_pool()
+    if not pool.keys:
+        print("⚠️ Please set your GEMINI_API_KEY (or GEMINI_API_KEYS) in the .env file")
+        return 2
+    # Requests are spread over every key in GEMINI_API_KEYS; this client is the default
+    client = pool.keys[0].client
+
+    items = load_items(args.source, args.styles or ["Casual"], args.prompt)
+    if args.limit is not None:
+        items = items[:args.limit]
+    print(f"📦 {len(items)} item(s) from {args.source}")
+
+    runner = BatchRunner(
+        client,
+        args.output,
+        workers=args.workers,
+        concurrency=args.concurrency,
+        max_retries=args.max_retries,
+        cache=None if args.no_cache else ResultCache.from_env(),
+        upload_format=args.upload_format,
+        max_size=args.max_size,
+        output_format=args.output_format,
+        output_quality=args.output_quality,
+    )
+    summary = runner.run(items)
+    print_summary(summary)
+    return 0 if summary["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+"""
+Benchmark for burst best-frame scoring.
+
+Run from the project root:
+    python -m benchmarks.bench_frame_select
+    python -m benchmarks.bench_frame_select --width 1920 --height 1080 --fps 60
+    python -m benchmarks.bench_frame_select --video clip.mp4
+
+Scores a burst of frames and reports the per-frame scoring time against the
+camera frame interval, which frames were dropped and why, and which frame
+was picked. The default burst is synthetic: a textured scene that is first
+underexposed, then moving, then out of focus, with one clean frame, so the
+pick can be checked.
+"""
+import argparse
+import statistics
+import time
+
+import cv2
+import numpy as np
+
+from frame_select import FrameScorer, read_frames, select_best_frame
+
+
+def synthetic_burst(width=1280, height=720, frames=30, seed=0):
+    """
+    A burst as a camera sees it: exposure settling, the subject moving into
+    place, focus settling, one clean frame, then slight defocus again.
+    Returns (frames, index of the clean frame)
+    """
+    rng = np.random.default_rng(seed)
+    scene = np.full((height, width, 3), 170, np.uint8)
+    for _ in range(60):
+        x, y = int(rng.integers(0, width)), int(rng.integers(0, height))
+        color = tuple(int(c) for c in rng.integers(20, 235, 3))
+        cv2.rectangle(scene, (x, y), (x + int(rng.integers(20, 200)), y + int(rng.integers(20, 200))), color, -1)
+    clean_index = int(frames * 0.6)
+    burst = []
+    for index in range(frames):
+        noise = rng.normal(0, 3, scene.shape)
+        frame = np.clip(scene + noise, 0, 255).astype(np.uint8)
+        phase = index / frames
+        if phase < 0.15:
+            # Auto-exposure still settling
+            frame = (frame * (0.15 + phase * 2)).astype(np.uint8)
+        elif phase < 0.4:
+            # Moving into place: large shifts with horizontal motion streaks
+            frame = cv2.blur(np.roll(frame, 24 * index, axis=1), (21, 3))
+        elif index < clean_index:
+            # Holding still while focus settles
+            frame = cv2.GaussianBlur(np.roll(frame, 2 * index, axis=1), (0, 0), 1.0 + (clean_index - index) * 0.4)
+        elif index > clean_index:
+            frame = cv2.GaussianBlur(np.roll(frame, 2 * clean_index + (index % 2), axis=1), (0, 0), 1.2)
+        else:
+            frame = np.roll(frame, 2 * index, axis=1)
+        burst.append(frame)
+    return burst, clean_index
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--video", help="Score frames of a video file (or camera index) instead")
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--frames", type=int, default=30)
+    parser.add_argument("--fps", type=float, default=30.0, help="Camera frame rate scoring must keep up with")
+    args = parser.parse_args(argv)
+
+    if args.video:
+        frames = list(read_frames(args.video, max_frames=args.frames, max_seconds=None))
+        expected = None
+    else:
+        frames, expected = synthetic_burst(args.width, args.height, args.frames)
+    if not frames:
+        print("No frames to score.")
+        return 1
+
+    # Per-frame timing over a fresh scorer, then the full selection pass
+    scorer = FrameScorer()
+    times = []
+    for frame in frames:
+        start = time.perf_counter()
+        scorer.score(frame)
+        times.append(time.perf_counter() - start)
+    selector = select_best_frame(frames)
+
+    height, width = frames[0].shape[:2]
+    budget_ms = 1000 / args.fps
+    median_ms = statistics.median(times) * 1000
+    print(f"{len(frames)} frames at {width}x{height}")
+    print(f"Scoring: median {median_ms:.2f} ms, max {max(times) * 1000:.2f} ms per frame "
+          f"(frame interval at {args.fps:g} fps: {budget_ms:.1f} ms)")
+    print(f"Headroom: {budget_ms / median_ms:.0f}x real time")
+    print()
+    print(f"{'frame':>5} {'sharpness':>10} {'motion':>7} {'bright':>7} {'clipped':>8} {'score':>9}  result")
+    for result in selector.scores:
+        mark = "picked" if selector.best_score is not None and result.index == selector.best_score.index \
+            else (result.reason or "ok")
+        print(f"{result.index:5d} {result.sharpness:10.1f} {result.motion:7.1f} {result.brightness:7.1f} "
+              f"{result.clipped:8.1%} {result.score:9.1f}  {mark}")
+    print()
+    if selector.best_score is None:
+        print(f"No usable frame; dropped {selector.rejected()}")
+        return 1
+    print(f"Picked frame {selector.best_score.index}; dropped {selector.rejected()}")
+    if expected is not None and selector.best_score.index != expected:
+        print(f"Expected frame {expected}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,71 @@
+"""
+Lookup latency and near-duplicate matching of the perceptual-hash index.
+
+Run from the project root:
+    python -m benchmarks.bench_phash
+    python -m benchmarks.bench_phash --sizes 1000 10000 50000
+
+Fills an in-memory index with random hashes in one context, then times
+lookups. Also hashes a synthetic camera frame, a slightly shifted and
+re-encoded recapture of it, and an unrelated frame, and prints the Hamming
+distances so the threshold can be sanity-checked.
+"""
+import argparse
+import io
+import random
+import statistics
+import time
+
+import numpy as np
+from PIL import Image
+
+from phash_index import DEFAULT_MAX_DISTANCE, PerceptualIndex, hash_image_bytes
+
+
+def frame_bytes(seed, shift=0, quality=90):
+    rng = np.random.default_rng(seed)
+    blobs = rng.integers(0, 255, (12, 16, 3)).astype(np.uint8)
+    frame = Image.fromarray(blobs).resize((1280, 960), Image.Resampling.BICUBIC)
+    if shift:
+        frame = frame.crop((shift, shift, 1280, 960)).resize((1280, 960))
+    noisy = np.clip(np.asarray(frame, dtype=np.int16) + rng.normal(0, 4, (960, 1280, 3)), 0, 255)
+    buf = io.BytesIO()
+    Image.fromarray(noisy.astype(np.uint8)).save(buf, format="JPEG", quality=quality)
+    return buf.getvalue()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--lookups", type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    rng = random.Random(0)
+    print(f"{'entries':>8} {'p50 µs':>8} {'p99 µs':>8}")
+    for size in args.sizes:
+        index = PerceptualIndex(path=None)
+        for i in range(size):
+            index.add(rng.getrandbits(64), "ctx", f"key{i}")
+        times = []
+        for _ in range(args.lookups):
+            value = rng.getrandbits(64)
+            start = time.perf_counter()
+            index.lookup(value, "ctx")
+            times.append((time.perf_counter() - start) * 1e6)
+        times.sort()
+        print(f"{size:8d} {statistics.median(times):8.1f} {times[int(len(times) * 0.99)]:8.1f}")
+
+    print()
+    original = frame_bytes(1)
+    start = time.perf_counter()
+    base = hash_image_bytes(original)
+    print(f"Hashing one 1280x960 JPEG: {(time.perf_counter() - start) * 1000:.2f} ms")
+    for label, data in (("recapture (shifted, re-encoded)", frame_bytes(1, shift=12, quality=80)),
+                        ("different scene", frame_bytes(2))):
+        distance = bin(base ^ hash_image_bytes(data)).count("1")
+        verdict = "reuse" if distance <= DEFAULT_MAX_DISTANCE else "generate"
+        print(f"  {label:<32} distance {distance:2d} -> {verdict}")
+
+
+if __name__ == "__main__":
+    main()
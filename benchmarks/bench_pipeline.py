@@ -0,0 +1,310 @@
+"""
+End-to-end pipeline benchmark against the fake Gemini backend.
+
+Run from the project root:
+    python -m benchmarks.bench_pipeline
+    python -m benchmarks.bench_pipeline --transport http --json results.json
+    python -m benchmarks.bench_pipeline --rate-limit-rate 0.1 --compare results.json
+
+No API key or network access is needed. Requests go to fake_gemini, either
+in-process (FakeClient) or through a real genai.Client talking to the local
+FakeGeminiServer (--transport http), which adds the SDK's HTTP and JSON
+handling.
+
+Reports:
+  * per-stage timings: preprocess (decode + resize), encode, send to first
+    chunk, rest of the stream, and decoding the generated image
+  * Python heap (tracemalloc) and process RSS peaks for one request
+  * throughput and latency of the threaded sync path (visualize_item_on_body)
+    and the async engine (fan_out) at each concurrency level
+
+--json writes every number together with the git commit and the fake
+backend settings; --compare prints the change against an earlier file.
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from benchmarks.bench_preprocess import synthetic_frame
+from fake_gemini import FakeClient, FakeConfig, FakeGeminiServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def summarize(seconds):
+    """
+    p50 / p95 / mean in milliseconds
+    """
+    return {
+        "p50_ms": percentile(seconds, 50) * 1000,
+        "p95_ms": percentile(seconds, 95) * 1000,
+        "mean_ms": statistics.fmean(seconds) * 1000 if seconds else 0.0,
+    }
+
+
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True)
+        return out.stdout.strip() or None
+    except OSError:
+        return None
+
+
+@contextlib.contextmanager
+def fake_client(transport, config):
+    """
+    Yield (client, backend) for the chosen transport
+    """
+    if transport == "inprocess":
+        client = FakeClient(config)
+        yield client, client.backend
+        return
+
+    from google import genai
+    from google.genai import types
+
+    with FakeGeminiServer(config) as server:
+        client = genai.Client(api_key="fake-key", http_options=types.HttpOptions(base_url=server.url))
+        yield client, server.backend
+
+
+def stage_timings(client, data, iterations, upload_format):
+    from tryon import build_prompt, encode_image, optimize_image_for_ai, stream_try_on
+
+    stages = {name: [] for name in ("preprocess", "encode", "first_chunk", "stream", "output_decode", "total")}
+    prompt = build_prompt("Casual")
+    for _ in range(iterations):
+        start = time.perf_counter()
+        photo = optimize_image_for_ai(Image.open(io.BytesIO(data)))
+        photo.load()
+        prepared = time.perf_counter()
+        img_bytes, mime_type = encode_image(photo, upload_format)
+        encoded = time.perf_counter()
+
+        done = None
+        for event in stream_try_on(client, img_bytes, prompt, mime_type=mime_type):
+            if event.kind == "done":
+                done = event
+        streamed = time.perf_counter()
+        if done is None or not done.images:
+            raise RuntimeError("fake backend returned no image; lower --rate-limit-rate/--error-rate")
+
+        Image.open(io.BytesIO(done.images[0])).load()
+        finished = time.perf_counter()
+
+        stages["preprocess"].append(prepared - start)
+        stages["encode"].append(encoded - prepared)
+        stages["first_chunk"].append(done.timings["ttfb"])
+        stages["stream"].append(done.timings["total"] - done.timings["ttfb"])
+        stages["output_decode"].append(finished - streamed)
+        stages["total"].append(finished - start)
+    return {name: summarize(values) for name, values in stages.items()}
+
+
+def peak_memory(client, data, upload_format):
+    """
+    Python heap peak (tracemalloc) and process RSS high-water mark for one request
+
+    Pillow's pixel buffers are allocated outside the Python heap, so only
+    the RSS figure includes decoded images.
+    """
+    from tryon import visualize_item_on_body
+
+    tracemalloc.start()
+    try:
+        _, images = visualize_item_on_body(client, Image.open(io.BytesIO(data)), "Casual", upload_format=upload_format)
+        if images:
+            Image.open(io.BytesIO(images[0])).load()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {"traced_peak_mb": peak / 1024 / 1024, "traced_retained_mb": current / 1024 / 1024,
+            "rss_peak_mb": rss_kb / 1024}
+
+
+def throughput_sync(client, data, concurrency, requests, upload_format):
+    from tryon import visualize_item_on_body
+
+    def one(_):
+        start = time.perf_counter()
+        try:
+            # Every request is identical: without coalesce=False they would share one backend call
+            _, images = visualize_item_on_body(client, Image.open(io.BytesIO(data)), "Casual",
+                                               upload_format=upload_format, coalesce=False)
+            return time.perf_counter() - start, bool(images)
+        except Exception:
+            return time.perf_counter() - start, False
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(requests)))
+    return _throughput(results, time.perf_counter() - start)
+
+
+def throughput_async(client, data, concurrency, requests, upload_format):
+    from async_engine import Variant, fan_out
+    from gemini_client import run_coroutine
+
+    variants = [Variant(label=f"v{i}", style_preference="Casual") for i in range(requests)]
+
+    async def run():
+        return [result async for result in fan_out(client, Image.open(io.BytesIO(data)), variants,
+                                                   concurrency=concurrency, upload_format=upload_format,
+                                                   coalesce=False)]
+
+    start = time.perf_counter()
+    results = run_coroutine(run())
+    wall = time.perf_counter() - start
+    return _throughput([(r.elapsed, r.error is None and bool(r.images)) for r in results], wall)
+
+
+def _throughput(results, wall):
+    latencies = [elapsed for elapsed, ok in results if ok]
+    return {
+        "requests": len(results),
+        "failed": sum(1 for _, ok in results if not ok),
+        "wall_s": wall,
+        "req_per_s": len(results) / wall if wall else 0.0,
+        **{f"latency_{k}": v for k, v in summarize(latencies).items()},
+    }
+
+
+def flatten(value, prefix=""):
+    if isinstance(value, dict):
+        out = {}
+        for key, inner in value.items():
+            out.update(flatten(inner, f"{prefix}{key}."))
+        return out
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return {prefix.rstrip("."): value}
+    return {}
+
+
+def compare(old, new):
+    old_flat = flatten({k: old.get(k) for k in ("stages", "memory", "throughput")})
+    new_flat = flatten({k: new.get(k) for k in ("stages", "memory", "throughput")})
+    print(f"\nCompared with {old.get('meta', {}).get('commit') or 'baseline'}:")
+    print(f"{'metric':<46} {'before':>10} {'after':>10} {'change':>8}")
+    for key in sorted(new_flat):
+        if key not in old_flat:
+            continue
+        before, after = old_flat[key], new_flat[key]
+        change = f"{(after - before) / before * 100:+7.1f}%" if before else "    n/a"
+        print(f"{key:<46} {before:10.2f} {after:10.2f} {change:>8}")
+
+
+def print_report(results):
+    print(f"\nPer-stage timings ({results['meta']['iterations']} requests, ms)")
+    print(f"{'stage':<14} {'p50':>9} {'p95':>9} {'mean':>9}")
+    for name, stats in results["stages"].items():
+        print(f"{name:<14} {stats['p50_ms']:9.1f} {stats['p95_ms']:9.1f} {stats['mean_ms']:9.1f}")
+
+    memory = results["memory"]
+    print(f"\nOne request: Python heap peak {memory['traced_peak_mb']:.1f} MB "
+          f"(retained {memory['traced_retained_mb']:.1f} MB), process RSS peak {memory['rss_peak_mb']:.0f} MB")
+
+    print(f"\n{'path':<6} {'conc':>5} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'failed':>7}")
+    for path, levels in results["throughput"].items():
+        for level, stats in levels.items():
+            print(f"{path:<6} {level:>5} {stats['req_per_s']:8.2f} {stats['latency_p50_ms']:9.1f} "
+                  f"{stats['latency_p95_ms']:9.1f} {stats['failed']:7d}")
+
+    backend = results["backend"]
+    print(f"\nBackend: {backend['requests']} requests, {backend['rate_limited']} rate limited, "
+          f"{backend['errors']} errors, max {backend['max_in_flight']} in flight")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--image", help="Input photo (default: synthetic 1920x1080 camera frame)")
+    parser.add_argument("--transport", choices=["inprocess", "http"], default="inprocess")
+    parser.add_argument("--upload-format", default=None)
+    parser.add_argument("--iterations", type=int, default=10, help="Requests for the per-stage timings")
+    parser.add_argument("--concurrency", type=int, action="append", help="Concurrency levels (repeatable)")
+    parser.add_argument("--requests", type=int, default=24, help="Requests per concurrency level")
+    parser.add_argument("--time-scale", type=float, default=0.05,
+                        help="Multiplier on the fake backend's delays (1.0 = realistic latency)")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fraction of requests answered 429")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered 503")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Write results to this file")
+    parser.add_argument("--compare", help="Earlier --json output to compare against")
+    parser.add_argument("--verbose", action="store_true", help="Keep the pipeline's own log output")
+    args = parser.parse_args(argv)
+
+    # The benchmark measures the pipeline, not the shared request budget
+    os.environ.setdefault("VTRYON_RPM", "1000000")
+    os.environ.setdefault("VTRYON_TPM", "1000000000000")
+
+    if args.image:
+        with open(args.image, "rb") as f:
+            data = f.read()
+    else:
+        data = synthetic_frame()
+    config = FakeConfig.from_env(seed=args.seed, rate_limit_rate=args.rate_limit_rate,
+                                 error_rate=args.error_rate).scaled(args.time_scale)
+    levels = args.concurrency or [1, 4, 16]
+
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "transport": args.transport,
+            "iterations": args.iterations,
+            "requests_per_level": args.requests,
+            "input_bytes": len(data),
+            "fake_config": config.__dict__,
+        },
+        "throughput": {"sync": {}, "async": {}},
+    }
+
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, "w"))
+    with fake_client(args.transport, config) as (client, backend), quiet:
+        # Warm up lazy imports and connections; memory goes first so RSS is not inflated by later runs
+        stage_timings(client, data, 1, args.upload_format)
+        results["memory"] = peak_memory(client, data, args.upload_format)
+        results["stages"] = stage_timings(client, data, args.iterations, args.upload_format)
+        for level in levels:
+            results["throughput"]["sync"][str(level)] = throughput_sync(
+                client, data, level, args.requests, args.upload_format)
+            results["throughput"]["async"][str(level)] = throughput_async(
+                client, data, level, args.requests, args.upload_format)
+        results["backend"] = backend.stats()
+
+    print(f"Commit {results['meta']['commit']} · transport {args.transport} · "
+          f"TTFC median {config.ttfc_ms:.0f} ms · {config.rate_limit_rate:.0%} 429s")
+    print_report(results)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nWrote {args.json}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(json.load(f), results)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,140 @@
+"""
+Micro-benchmark for photo preprocessing and upload encoding.
+
+Run from the project root:
+    python -m benchmarks.bench_preprocess
+    python -m benchmarks.bench_preprocess --image me.jpg --uplink-mbps 5
+    python -m benchmarks.bench_preprocess --live     # also time real Gemini calls
+
+Compares the legacy path (full decode, 2048px LANCZOS, PNG) with draft-mode
+decoding at the configured target size and each upload encoding. For every
+option it reports preprocessing and encode time, payload bytes, estimated
+upload time at the given uplink, and the resulting end-to-end latency.
+"""
+import argparse
+import io
+import os
+import statistics
+import time
+
+import numpy as np
+from PIL import Image
+
+from tryon import DEFAULT_TARGET_SIZE, encode_image, optimize_image_for_ai
+
+LEGACY_MAX_SIZE = 2048
+
+
+def synthetic_frame(width=1920, height=1080):
+    """
+    A camera-like JPEG: smooth gradients plus sensor noise
+    """
+    y, x = np.mgrid[0:height, 0:width]
+    base = np.stack([x / width * 255, y / height * 255, (x + y) / (width + height) * 255], axis=-1)
+    noise = np.random.default_rng(0).normal(0, 8, base.shape)
+    frame = np.clip(base + noise, 0, 255).astype(np.uint8)
+    buf = io.BytesIO()
+    Image.fromarray(frame).save(buf, format="JPEG", quality=92)
+    return buf.getvalue()
+
+
+def timed(fn, repeat):
+    times = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), result
+
+
+def legacy_preprocess(data):
+    photo = Image.open(io.BytesIO(data)).convert("RGB")
+    if max(photo.size) > LEGACY_MAX_SIZE:
+        ratio = LEGACY_MAX_SIZE / max(photo.size)
+        photo = photo.resize((int(photo.size[0] * ratio), int(photo.size[1] * ratio)), Image.Resampling.LANCZOS)
+    return photo
+
+
+def fast_preprocess(data, target_size):
+    photo = optimize_image_for_ai(Image.open(io.BytesIO(data)), max_size=target_size)
+    # Decoding is lazy; force it so it is timed here and not in the encoder
+    photo.load()
+    return photo
+
+
+def legacy_encode(photo):
+    buf = io.BytesIO()
+    photo.save(buf, format="PNG")
+    return buf.getvalue(), "image/png"
+
+
+def options(qualities):
+    yield "png (legacy)", None, None
+    yield "png", "png", None
+    for fmt in ("jpeg", "webp"):
+        for quality in qualities:
+            yield f"{fmt} q{quality}", fmt, quality
+
+
+def live_latency(img_bytes, mime_type):
+    from dotenv import load_dotenv
+    from google import genai
+    from tryon import build_prompt, generate_try_on
+
+    load_dotenv()
+    client = genai.Client(api_key=os.environ["GEMINI_API_KEY"])
+    start = time.perf_counter()
+    generate_try_on(client, img_bytes, build_prompt("Casual"), max_retries=1, mime_type=mime_type)
+    return time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--image", help="Input photo (default: synthetic 1920x1080 camera frame)")
+    parser.add_argument("--target-size", type=int, default=DEFAULT_TARGET_SIZE)
+    parser.add_argument("--quality", type=int, action="append", help="JPEG/WebP qualities to try (repeatable)")
+    parser.add_argument("--uplink-mbps", type=float, default=10.0, help="Uplink bandwidth for the upload estimate")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--live", action="store_true", help="Also measure a real Gemini round trip per option")
+    args = parser.parse_args(argv)
+
+    if args.image:
+        with open(args.image, "rb") as f:
+            data = f.read()
+    else:
+        data = synthetic_frame()
+    with Image.open(io.BytesIO(data)) as probe:
+        print(f"Input: {probe.format} {probe.size[0]}x{probe.size[1]}, {len(data) / 1024:.0f} KB")
+
+    legacy_time, legacy_photo = timed(lambda: legacy_preprocess(data), args.repeat)
+    fast_time, fast_photo = timed(lambda: fast_preprocess(data, args.target_size), args.repeat)
+    print(f"Preprocess legacy (full decode, {LEGACY_MAX_SIZE}px): {legacy_time * 1000:7.1f} ms -> {legacy_photo.size}")
+    print(f"Preprocess draft  (reduced decode, {args.target_size}px): {fast_time * 1000:7.1f} ms -> {fast_photo.size}")
+    print()
+
+    header = f"{'option':<14} {'prep ms':>8} {'encode ms':>10} {'bytes':>10} {'upload ms':>10} {'total ms':>9}"
+    if args.live:
+        header += f" {'live s':>8}"
+    print(header)
+    print("-" * len(header))
+
+    bytes_per_second = args.uplink_mbps * 1_000_000 / 8
+    for label, fmt, quality in options(args.quality or [75, 85, 90]):
+        if fmt is None:
+            prep_time, photo = legacy_time, legacy_photo
+            encode_time, (payload, mime_type) = timed(lambda: legacy_encode(photo), args.repeat)
+        else:
+            prep_time, photo = fast_time, fast_photo
+            encode_time, (payload, mime_type) = timed(lambda: encode_image(photo, fmt, quality), args.repeat)
+        upload_time = len(payload) / bytes_per_second
+        total = prep_time + encode_time + upload_time
+        line = (f"{label:<14} {prep_time * 1000:8.1f} {encode_time * 1000:10.1f} {len(payload):10,d} "
+                f"{upload_time * 1000:10.1f} {total * 1000:9.1f}")
+        if args.live:
+            line += f" {live_latency(payload, mime_type):8.2f}"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Benchmark for region-of-interest cropping before upload.
+
+Run from the project root:
+    python -m benchmarks.bench_roi
+    python -m benchmarks.bench_roi --image me.jpg --uplink-mbps 5
+    python -m benchmarks.bench_roi --live      # also time real Gemini calls
+
+Compares sending the whole optimized frame with sending only the detected
+person-and-item crop. For each it reports the pixels sent, payload bytes,
+estimated input image tokens, estimated upload time at the given uplink,
+and the added cost of detection and of compositing the result back into
+the frame. The default input is a synthetic 1920x1080 frame with a figure
+holding a bag off-centre; pass --image for a real capture.
+"""
+import argparse
+import io
+import os
+import statistics
+import time
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from benchmarks.bench_preprocess import timed
+from roi import composite, crop_to_region, detect_region, estimate_image_tokens
+from tryon import DEFAULT_TARGET_SIZE, DEFAULT_UPLOAD_FORMAT, encode_image, optimize_image_for_ai
+
+
+def synthetic_subject_frame(width=1920, height=1080):
+    """
+    A room-like camera frame (soft-lit wall and floor) with a figure and a held bag drawn off-centre
+    """
+    y, x = np.mgrid[0:height, 0:width]
+    light = 1.0 - 0.15 * np.hypot(x / width - 0.3, y / height - 0.2)
+    wall = np.stack([206 * light, 198 * light, 186 * light], axis=-1)
+    wall[y > int(height * 0.82)] *= 0.92
+    frame = Image.fromarray(np.clip(wall, 0, 255).astype(np.uint8))
+    draw = ImageDraw.Draw(frame)
+    cx, head = int(width * 0.38), int(height * 0.12)
+    unit = height // 10
+    draw.ellipse((cx - unit // 2, head, cx + unit // 2, head + unit), fill=(224, 172, 140))
+    draw.rectangle((cx - unit, head + unit, cx + unit, height), fill=(40, 48, 70))
+    draw.rectangle((cx + unit, head + int(1.3 * unit), cx + int(2.2 * unit), head + int(1.7 * unit)),
+                   fill=(40, 48, 70))
+    draw.rectangle((cx + int(2 * unit), head + int(1.7 * unit), cx + int(3.2 * unit), head + int(3.2 * unit)),
+                   fill=(170, 30, 40))
+    noise = np.random.default_rng(1).normal(0, 6, (height, width, 3))
+    pixels = np.clip(np.asarray(frame, dtype=np.float32) + noise, 0, 255).astype(np.uint8)
+    buf = io.BytesIO()
+    Image.fromarray(pixels).save(buf, format="JPEG", quality=92)
+    return buf.getvalue()
+
+
+def fake_result(size):
+    """
+    A PNG the size of the crop, standing in for the generated image
+    """
+    buf = io.BytesIO()
+    Image.new("RGB", size, (90, 120, 150)).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def live_latency(img_bytes, mime_type):
+    from dotenv import load_dotenv
+    from google import genai
+    from tryon import build_prompt, generate_try_on
+
+    load_dotenv()
+    client = genai.Client(api_key=os.environ["GEMINI_API_KEY"])
+    start = time.perf_counter()
+    generate_try_on(client, img_bytes, build_prompt("Casual"), max_retries=1, mime_type=mime_type)
+    return time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--image", help="Input photo (default: synthetic frame with a figure and a bag)")
+    parser.add_argument("--target-size", type=int, default=DEFAULT_TARGET_SIZE)
+    parser.add_argument("--upload-format", default=DEFAULT_UPLOAD_FORMAT)
+    parser.add_argument("--uplink-mbps", type=float, default=10.0, help="Uplink bandwidth for the upload estimate")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--live", action="store_true", help="Also measure a real Gemini round trip for each")
+    args = parser.parse_args(argv)
+
+    if args.image:
+        with open(args.image, "rb") as f:
+            data = f.read()
+    else:
+        data = synthetic_subject_frame()
+
+    frame = optimize_image_for_ai(Image.open(io.BytesIO(data)), max_size=args.target_size)
+    frame.load()
+    detect_time, region = timed(lambda: detect_region(frame), args.repeat)
+    print(f"Frame {frame.size[0]}x{frame.size[1]} · detection {detect_time * 1000:.1f} ms")
+    if region is None:
+        print("No region worth cropping was found; the whole frame would be sent.")
+        return 0
+    print(f"Region {region.box} · {region.fraction:.0%} of the frame · found by {'+'.join(region.sources)}")
+    print()
+
+    crop = crop_to_region(frame, region)
+    bytes_per_second = args.uplink_mbps * 1_000_000 / 8
+    header = (f"{'sent':<7} {'pixels':>11} {'encode ms':>10} {'bytes':>10} {'tokens':>7} {'upload ms':>10}"
+              + (f" {'live s':>8}" if args.live else ""))
+    print(header)
+    print("-" * len(header))
+    rows = {}
+    for label, photo in (("frame", frame), ("crop", crop)):
+        encode_time, (payload, mime_type) = timed(lambda: encode_image(photo, args.upload_format), args.repeat)
+        tokens = estimate_image_tokens(*photo.size)
+        upload_time = len(payload) / bytes_per_second
+        rows[label] = (encode_time, len(payload), tokens, upload_time)
+        line = (f"{label:<7} {photo.size[0]:>5}x{photo.size[1]:<5} {encode_time * 1000:10.1f} {len(payload):10,d} "
+                f"{tokens:7d} {upload_time * 1000:10.1f}")
+        if args.live:
+            line += f" {live_latency(payload, mime_type):8.2f}"
+        print(line)
+
+    generated = fake_result(region.size)
+    composite_times = [timed(lambda: composite(frame, region, generated), 1)[0] for _ in range(args.repeat)]
+    composite_time = statistics.median(composite_times)
+
+    frame_row, crop_row = rows["frame"], rows["crop"]
+    saved_ms = ((frame_row[0] + frame_row[3]) - (crop_row[0] + crop_row[3])) * 1000
+    overhead_ms = (detect_time + composite_time) * 1000
+    print()
+    print(f"Payload saved:      {frame_row[1] - crop_row[1]:,d} bytes ({1 - crop_row[1] / frame_row[1]:.0%})")
+    print(f"Input tokens saved: {frame_row[2] - crop_row[2]} of {frame_row[2]}")
+    print(f"Encode + upload:    {saved_ms:.1f} ms faster")
+    print(f"Added work:         {overhead_ms:.1f} ms (detection {detect_time * 1000:.1f} + "
+          f"composite {composite_time * 1000:.1f})")
+    print(f"Net per request:    {saved_ms - overhead_ms:+.1f} ms at {args.uplink_mbps:g} Mbps")
+    return 0
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,363 @@
+"""
+Multi-session load test for the Streamlit app.
+
+Run from the project root:
+    python -m benchmarks.bench_sessions
+    python -m benchmarks.bench_sessions --sessions 1 --sessions 4 --sessions 16 --tries 3
+    python -m benchmarks.bench_sessions --time-scale 1.0 --json sessions.json
+
+Drives many simulated users through app.py at once, each in its own
+Streamlit AppTest session on its own thread, so they share the process
+exactly like browser sessions on one app instance do: the job queue,
+rate limiter, caches and history memory budget. Model calls go to the
+in-process fake backend (VTRYON_FAKE_GEMINI), and the burst shots are
+synthetic frames, so no API key, camera or network is needed.
+
+AppTest cannot drive the browser camera widget, so each session JPEG-encodes
+--shots synthetic frames as the browser would send them, decodes and scores
+them the way the page does for each shot (timed as capture), and seeds the
+session's burst and best frame with the result. For every try it then
+submits a generation with its own custom prompt (so results are not served
+from the cache), reruns the page every --poll seconds the way the browser's
+fragment timer does until the result is shown, and renders the download
+buttons.
+
+The number of concurrent sessions is ramped; each level reports:
+  * throughput (completed try-ons per second) and end-to-end latency
+    percentiles from clicking Visualize to the result being shown
+  * capture time and script rerun time percentiles
+  * history memory held in session_state per session, RSS growth while
+    the sessions are live, and RSS still held after they end
+  * the saturation point: the first level where adding sessions adds less
+    than --min-gain throughput (or p95 latency passes --max-p95)
+
+AppTest keeps one mock Streamlit runtime per process, so script runs are
+serialized here; on a real server they share the GIL instead. The job
+queue workers, model calls and image work run concurrently as in
+production. Reruns here run the whole script, where a browser would rerun
+only the polling fragment, so rerun cost is an upper bound.
+"""
+import argparse
+import contextlib
+import datetime
+import gc
+import json
+import logging
+import os
+import platform
+import resource
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.bench_pipeline import git_commit, percentile
+from fake_gemini import FakeConfig
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+VISUALIZE_LABEL = "✨ Visualize Item ON My Body!"
+DEFAULT_SHOTS = 5
+
+# AppTest installs and removes a process-wide mock runtime around every run
+_run_lock = threading.Lock()
+
+
+def rss_bytes():
+    """
+    Current resident set size (falls back to the peak where /proc is missing)
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def burst_shots(shots):
+    """
+    Synthetic burst frames JPEG-encoded, as the browser camera sends them
+    """
+    # Imported here: frame_select reads its settings from the environment on import
+    from benchmarks.bench_frame_select import synthetic_burst
+    from frame_select import encode_frame
+
+    burst, _ = synthetic_burst(frames=shots)
+    return [encode_frame(frame) for frame in burst]
+
+
+def capture_burst(shots):
+    """
+    Score the shots the way the page does and return the session state it would hold
+    """
+    import uuid
+
+    from frame_select import BestFrameSelector, FrameScorer, decode_frame, encode_frame
+
+    selector = BestFrameSelector(FrameScorer(max_motion=float("inf")))
+    for data in shots:
+        selector.feed(decode_frame(data))
+    best = selector.best_score
+    burst = {"id": uuid.uuid4().hex, "selector": selector, "last": None}
+    best_frame = {
+        "mode": "burst",
+        "source": burst["id"],
+        "photo": encode_frame(selector.best) if best is not None else None,
+        "frames": len(selector.scores),
+        "index": best.index if best is not None else None,
+        "sharpness": best.sharpness if best is not None else 0.0,
+        "rejected": selector.rejected(),
+        "ms_per_frame": selector.ms_per_frame,
+    }
+    return burst, best_frame
+
+
+def configure_env(workdir, time_scale, error_rate):
+    """
+    Point the app at the fake backend and throwaway storage
+    """
+    config = FakeConfig.from_env(error_rate=error_rate).scaled(time_scale)
+    env = {
+        "GEMINI_API_KEY": "bench-key",
+        "VTRYON_FAKE_GEMINI": "1",
+        "VTRYON_FAKE_TTFC_MS": str(config.ttfc_ms),
+        "VTRYON_FAKE_CHUNK_INTERVAL_MS": str(config.chunk_interval_ms),
+        "VTRYON_FAKE_IMAGE_DELAY_MS": str(config.image_delay_ms),
+        "VTRYON_FAKE_ERROR_RATE": str(config.error_rate),
+        "VTRYON_CACHE_DIR": os.path.join(workdir, "results"),
+        "VTRYON_BLOB_DIR": os.path.join(workdir, "history"),
+        "VTRYON_SIMILAR_INDEX": os.path.join(workdir, "phash.jsonl"),
+        "VTRYON_MODEL_REGISTRY": os.path.join(workdir, "models.json"),
+    }
+    os.environ.update(env)
+    # The harness measures one app instance, not the shared request budget
+    os.environ.setdefault("VTRYON_RPM", "1000000")
+    os.environ.setdefault("VTRYON_TPM", "1000000000000")
+    return config
+
+
+def find_button(at, label):
+    for button in at.button:
+        if button.label == label:
+            return button
+    raise LookupError(f"No button {label!r} on the page")
+
+
+def timed_run(at, rerun_ms):
+    with _run_lock:
+        start = time.perf_counter()
+        at.run()
+        rerun_ms.append((time.perf_counter() - start) * 1000)
+    if at.exception:
+        raise RuntimeError(at.exception[0].message)
+
+
+def run_session(session_id, tries, poll, timeout, shots):
+    """
+    One simulated user: open the page, take a burst, then generate and download `tries` times
+    """
+    from streamlit.testing.v1 import AppTest
+
+    result = {"latencies": [], "rerun_ms": [], "capture_ms": None, "completed": 0, "failed": 0,
+              "downloads": 0, "history_bytes": 0, "errors": []}
+    at = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=timeout)
+    try:
+        timed_run(at, result["rerun_ms"])
+        capture_mode = next(s for s in at.sidebar.selectbox if s.label == "Capture Mode:")
+        capture_mode.select("burst")
+        at.sidebar.checkbox[0].check()
+        timed_run(at, result["rerun_ms"])
+        reuse = next(c for c in at.sidebar.checkbox if c.label.startswith("♻️"))
+        reuse.uncheck()
+
+        start = time.perf_counter()
+        burst, best_frame = capture_burst(shots)
+        result["capture_ms"] = (time.perf_counter() - start) * 1000
+        if best_frame["photo"] is None:
+            raise RuntimeError("No usable frame in the burst")
+        at.session_state["burst"] = burst
+        at.session_state["best_frame"] = best_frame
+        timed_run(at, result["rerun_ms"])
+        if at.error:
+            raise RuntimeError(at.error[0].value)
+
+        for attempt in range(tries):
+            at.sidebar.text_area[0].input(f"Load test session {session_id}, try {attempt}: show the item worn.")
+            start = time.perf_counter()
+            find_button(at, VISUALIZE_LABEL).click()
+            timed_run(at, result["rerun_ms"])
+            deadline = start + timeout
+            while "tryon_job" in at.session_state and time.perf_counter() < deadline:
+                time.sleep(poll)
+                timed_run(at, result["rerun_ms"])
+            if "tryon_job" in at.session_state:
+                result["failed"] += 1
+                result["errors"].append("timed out")
+                continue
+            if not any(s.value.startswith("✅") for s in at.success):
+                result["failed"] += 1
+                result["errors"].append(at.error[0].value if at.error else "no result shown")
+                continue
+            result["latencies"].append(time.perf_counter() - start)
+            result["completed"] += 1
+            result["downloads"] += len(at.get("download_button"))
+        result["history_bytes"] = at.session_state.history.memory_usage()["total_bytes"]
+    except Exception as e:
+        result["failed"] += tries - result["completed"] - result["failed"]
+        result["errors"].append(str(e)[:200])
+    return result
+
+
+def run_level(sessions, tries, poll, timeout, shots):
+    """
+    Run `sessions` users at once; returns the level's summary
+    """
+    gc.collect()
+    rss_before = rss_bytes()
+    peak = {"rss": rss_before}
+    done = threading.Event()
+
+    def sample_rss():
+        while not done.wait(0.05):
+            peak["rss"] = max(peak["rss"], rss_bytes())
+
+    sampler = threading.Thread(target=sample_rss, daemon=True)
+    sampler.start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=sessions) as pool:
+        results = list(pool.map(lambda i: run_session(i, tries, poll, timeout, shots), range(sessions)))
+    elapsed = time.perf_counter() - start
+    rss_live = rss_bytes()
+    done.set()
+    sampler.join()
+    latencies = [s for r in results for s in r["latencies"]]
+    reruns = [ms for r in results for ms in r["rerun_ms"]]
+    captures = [r["capture_ms"] for r in results if r["capture_ms"] is not None]
+    completed = sum(r["completed"] for r in results)
+    summary = {
+        "sessions": sessions,
+        "completed": completed,
+        "failed": sum(r["failed"] for r in results),
+        "downloads": sum(r["downloads"] for r in results),
+        "elapsed_s": elapsed,
+        "tryons_per_s": completed / elapsed if elapsed else 0.0,
+        "latency_p50_ms": percentile(latencies, 50) * 1000,
+        "latency_p95_ms": percentile(latencies, 95) * 1000,
+        "latency_p99_ms": percentile(latencies, 99) * 1000,
+        "capture_p50_ms": percentile(captures, 50),
+        "rerun_p50_ms": percentile(reruns, 50),
+        "rerun_p95_ms": percentile(reruns, 95),
+        "history_kb_per_session": statistics.fmean(r["history_bytes"] for r in results) / 1024,
+        "rss_before_mb": rss_before / 2 ** 20,
+        "rss_peak_mb": peak["rss"] / 2 ** 20,
+        "rss_growth_per_session_mb": (rss_live - rss_before) / sessions / 2 ** 20,
+        "errors": sorted({e for r in results for e in r["errors"]})[:5],
+    }
+    # The sessions end here; whatever stays resident is held by the process (caches, leaks)
+    results.clear()
+    gc.collect()
+    summary["rss_retained_mb"] = (rss_bytes() - rss_before) / 2 ** 20
+    return summary
+
+
+def find_saturation(levels, min_gain, max_p95_ms):
+    """
+    The last level that still scaled: the next one added under min_gain throughput or broke max_p95_ms
+    """
+    best = levels[0]
+    for previous, level in zip(levels, levels[1:]):
+        gain = level["tryons_per_s"] / previous["tryons_per_s"] - 1 if previous["tryons_per_s"] else 0.0
+        too_slow = max_p95_ms is not None and level["latency_p95_ms"] > max_p95_ms
+        if gain < min_gain or too_slow or level["failed"]:
+            return previous, level, "latency" if too_slow else "errors" if level["failed"] else "throughput"
+        best = level
+    return best, None, None
+
+
+def print_report(levels, saturation):
+    print("\nhist KB and RSS +MB are per session; retained is RSS still held after the sessions ended")
+    print(f"{'sess':>4} {'done':>5} {'fail':>4} {'dl':>4} {'tryon/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'rerun p95':>9} {'hist KB':>9} {'RSS +MB':>9} {'RSS peak':>8} {'retained':>8}")
+    for level in levels:
+        print(f"{level['sessions']:4d} {level['completed']:5d} {level['failed']:4d} {level['downloads']:4d} {level['tryons_per_s']:8.2f} "
+              f"{level['latency_p50_ms']:8.0f} {level['latency_p95_ms']:8.0f} {level['latency_p99_ms']:8.0f} "
+              f"{level['rerun_p95_ms']:9.0f} {level['history_kb_per_session']:9.0f} "
+              f"{level['rss_growth_per_session_mb']:9.1f} {level['rss_peak_mb']:8.0f} {level['rss_retained_mb']:+8.1f}")
+        for error in level["errors"]:
+            print(f"     ! {error}")
+    last_good, first_bad, reason = saturation
+    print()
+    if first_bad is None:
+        print(f"No saturation up to {last_good['sessions']} sessions "
+              f"({last_good['tryons_per_s']:.2f} try-ons/s); ramp further with --sessions")
+    else:
+        print(f"Saturation: {last_good['sessions']} concurrent sessions "
+              f"({last_good['tryons_per_s']:.2f} try-ons/s, p95 {last_good['latency_p95_ms']:.0f} ms); "
+              f"at {first_bad['sessions']} the limit is {reason}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, action="append", help="Concurrent session levels (repeatable)")
+    parser.add_argument("--tries", type=int, default=2, help="Try-ons per session")
+    parser.add_argument("--shots", type=int, default=DEFAULT_SHOTS, help="Camera shots per burst")
+    parser.add_argument("--poll", type=float, default=0.1, help="Seconds between reruns while a job runs")
+    parser.add_argument("--time-scale", type=float, default=0.05,
+                        help="Multiplier on the fake backend's delays (1.0 = realistic latency)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of model calls answered 503")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Seconds a session may wait for one result")
+    parser.add_argument("--min-gain", type=float, default=0.1,
+                        help="Throughput gain below which the next level counts as saturated")
+    parser.add_argument("--max-p95", type=float, help="p95 latency in ms above which a level counts as saturated")
+    parser.add_argument("--json", help="Write results to this file")
+    parser.add_argument("--verbose", action="store_true", help="Keep the app's own log output")
+    args = parser.parse_args(argv)
+    levels = sorted(set(args.sessions or [1, 2, 4, 8, 16]))
+
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    workdir = tempfile.mkdtemp(prefix="vtryon-load-")
+    config = configure_env(workdir, args.time_scale, args.error_rate)
+    shots = burst_shots(args.shots)
+    if not args.verbose:
+        logging.disable(logging.WARNING)
+
+    print(f"Commit {git_commit()} · fake TTFC median {config.ttfc_ms:.0f} ms · "
+          f"{args.tries} try-ons per session · storage in {workdir}")
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, "w"))
+    # Warm up imports, the pooled client and the caches so the first level is not charged for them
+    with quiet:
+        run_session(-1, 1, args.poll, args.timeout, shots)
+    results = []
+    for sessions in levels:
+        with quiet:
+            summary = run_level(sessions, args.tries, args.poll, args.timeout, shots)
+        results.append(summary)
+        print(f"{sessions:4d} sessions: {summary['tryons_per_s']:.2f} try-ons/s, "
+              f"p95 {summary['latency_p95_ms']:.0f} ms, {summary['failed']} failed")
+    saturation = find_saturation(results, args.min_gain, args.max_p95)
+    print_report(results, saturation)
+
+    if args.json:
+        last_good, first_bad, reason = saturation
+        output = {
+            "meta": {
+                "commit": git_commit(),
+                "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "tries_per_session": args.tries,
+                "fake_config": config.__dict__,
+            },
+            "levels": results,
+            "saturation": {"sessions": last_good["sessions"], "limited_by": reason},
+        }
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(output, f, indent=2)
+        print(f"\nWrote {args.json}")
+    return 1 if any(level["failed"] for level in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
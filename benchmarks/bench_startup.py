@@ -0,0 +1,136 @@
+"""
+Startup and rerun timings for the Streamlit app.
+
+Run from the project root:
+    python -m benchmarks.bench_startup
+
+Reports:
+  * cold import time of the pipeline modules in a fresh interpreter, and of
+    google.genai on its own (which is now only imported on first model use)
+  * the cost of building a genai.Client per rerun versus the pooled one
+  * first-run and steady-state rerun times of app.py under Streamlit's
+    AppTest harness (no network calls are made)
+  * the cost of each sidebar interaction, and the page and fragment run
+    times the app records itself (the sidebar's Performance readout)
+
+--max-rerun-ms exits non-zero when the steady-state rerun median exceeds
+it, so the rerun cost can be checked for regressions.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PIPELINE_MODULES = "tryon, async_engine, result_cache, history_store, rate_limiter, gemini_client"
+
+
+def cold_import_ms(statement, repeat):
+    code = f"import time; s = time.perf_counter(); {statement}; print((time.perf_counter() - s) * 1000)"
+    times = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+        times.append(float(out.stdout.strip().splitlines()[-1]))
+    return statistics.median(times)
+
+
+def client_costs(repeat):
+    from gemini_client import create_client, get_client
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        create_client("bench-key")
+    per_rerun = (time.perf_counter() - start) / repeat * 1000
+
+    get_client("bench-key")
+    start = time.perf_counter()
+    for _ in range(repeat):
+        get_client("bench-key")
+    pooled = (time.perf_counter() - start) / repeat * 1000
+    return per_rerun, pooled
+
+
+def rerun_times(reruns):
+    from streamlit.testing.v1 import AppTest
+
+    os.environ.setdefault("GEMINI_API_KEY", "bench-key")
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    at = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=60)
+    start = time.perf_counter()
+    at.run()
+    first = (time.perf_counter() - start) * 1000
+    times = []
+    for _ in range(reruns):
+        start = time.perf_counter()
+        at.run()
+        times.append((time.perf_counter() - start) * 1000)
+    if at.exception:
+        raise RuntimeError(at.exception[0].message)
+    return first, statistics.median(times)
+
+
+def interaction_times(reruns):
+    """
+    Median wall time per sidebar interaction, plus the app's own page/fragment medians
+    """
+    from streamlit.testing.v1 import AppTest
+
+    os.environ.setdefault("GEMINI_API_KEY", "bench-key")
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    at = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=60)
+    at.run()
+    interactions = {
+        "style change": lambda i: at.sidebar.selectbox[0].select_index(i % 2 + 1),
+        "custom prompt toggle": lambda i: at.sidebar.checkbox[0].set_value(i % 2 == 0),
+    }
+    results = {}
+    for name, interact in interactions.items():
+        times = []
+        for i in range(reruns):
+            interact(i)
+            start = time.perf_counter()
+            at.run()
+            times.append((time.perf_counter() - start) * 1000)
+        if at.exception:
+            raise RuntimeError(at.exception[0].message)
+        results[name] = statistics.median(times)
+    recorded = {name: statistics.median(samples) for name, samples in at.session_state.rerun_times_ms.items()}
+    return results, recorded
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--reruns", type=int, default=10)
+    parser.add_argument("--max-rerun-ms", type=float, help="Fail if the rerun median exceeds this")
+    args = parser.parse_args(argv)
+
+    print(f"Cold import, pipeline modules:  {cold_import_ms(f'import {PIPELINE_MODULES}', args.repeat):8.1f} ms")
+    print(f"Cold import, google.genai:      {cold_import_ms('from google import genai', args.repeat):8.1f} ms")
+
+    per_rerun, pooled = client_costs(args.repeat)
+    print(f"genai.Client built per rerun:   {per_rerun:8.2f} ms")
+    print(f"Pooled get_client():            {pooled:8.4f} ms")
+
+    first, steady = rerun_times(args.reruns)
+    print(f"app.py first run (AppTest):     {first:8.1f} ms")
+    print(f"app.py rerun median (AppTest):  {steady:8.1f} ms")
+
+    interactions, recorded = interaction_times(args.reruns)
+    for name, median in interactions.items():
+        print(f"{'Rerun on ' + name + ':':<32}{median:8.1f} ms")
+    for name, median in recorded.items():
+        print(f"{'Recorded ' + name + ' run median:':<32}{median:8.1f} ms")
+
+    if args.max_rerun_ms is not None and steady > args.max_rerun_ms:
+        print(f"Rerun median {steady:.1f} ms exceeds --max-rerun-ms {args.max_rerun_ms:g}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
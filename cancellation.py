@@ -0,0 +1,69 @@
+"""
+Cooperative cancellation for code that waits on behalf of a job.
+
+A job queue worker runs each job inside ``cancel_scope(event)``. Anything
+the job waits on further down (rate limiter reservations, retry backoff
+sleeps, joining a single-flight generation) waits through sleep() or
+checks check_cancelled(), so setting the event stops the job within
+POLL_SECONDS instead of at its next stream event.
+
+The scope lives in a context variable, like trace ids, so it follows the
+job through generators and into threads started with a copied context.
+Outside any scope sleep() is a plain time.sleep.
+"""
+import contextlib
+import contextvars
+import time
+
+# Longest a cancellable wait that cannot use the event directly goes between checks
+POLL_SECONDS = 0.25
+
+_cancel_event = contextvars.ContextVar("vtryon_cancel_event", default=None)
+
+
+class Cancelled(BaseException):
+    """
+    The current job was cancelled while it waited
+
+    A BaseException, like asyncio.CancelledError, so retry loops and
+    ``except Exception`` handlers do not mistake it for a failed attempt.
+    """
+
+
+@contextlib.contextmanager
+def cancel_scope(event):
+    """
+    Make waits in this context stop with Cancelled once event is set
+    """
+    token = _cancel_event.set(event)
+    try:
+        yield event
+    finally:
+        _cancel_event.reset(token)
+
+
+def cancelled():
+    """
+    Whether the current scope's event has been set
+    """
+    event = _cancel_event.get()
+    return event is not None and event.is_set()
+
+
+def check_cancelled():
+    """
+    Raise Cancelled if the current scope's event has been set
+    """
+    if cancelled():
+        raise Cancelled()
+
+
+def sleep(seconds):
+    """
+    time.sleep that returns early with Cancelled when the current scope is cancelled
+    """
+    event = _cancel_event.get()
+    if event is None:
+        time.sleep(seconds)
+    elif event.wait(seconds):
+        raise Cancelled()
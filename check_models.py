@@ -1,22 +1,34 @@
-import google.generativeai as genai
+import argparse
 import os
+import time
+
 from dotenv import load_dotenv
 
+from gemini_client import create_client
+from model_registry import ModelRegistry
+
 load_dotenv()
 
+parser = argparse.ArgumentParser(description="List Gemini models from the model registry cache")
+parser.add_argument("--refresh", action="store_true", help="List models from the API now instead of the cached list")
+parser.add_argument("--all", action="store_true", help="Show every model, not only image-capable ones")
+args = parser.parse_args()
+
 api_key = os.getenv('GEMINI_API_KEY')
-if api_key:
-    genai.configure(api_key=api_key)
-    
-    print("Available Gemini models that support content generation:\n")
-    models = genai.list_models()
-    
+if api_key or os.getenv("VTRYON_FAKE_GEMINI"):
+    registry = ModelRegistry.from_env()
+    client = create_client(api_key)
+    models = registry.refresh(client) if args.refresh else registry.models(client)
+    age = time.time() - registry.fetched_at if registry.fetched_at else None
+
+    print(f"Models from {registry.path}" + (f" (fetched {age / 60:.0f} min ago)" if age is not None else "") + ":\n")
     for m in models:
-        if 'generateContent' in m.supported_generation_methods:
-            print(f"Model: {m.name}")
-            print(f"  Display Name: {m.display_name}")
-            print(f"  Supported methods: {', '.join(m.supported_generation_methods)}")
-            print()
+        if not (args.all or m.image_output):
+            continue
+        print(f"Model: {m.name}{'  [image]' if m.image_output else ''}")
+        print(f"  Display Name: {m.display_name}")
+        print(f"  Supported methods: {', '.join(m.actions)}")
+        print()
+    print("Routing order for try-on: " + " → ".join(registry.candidates(client)))
 else:
     print("No API key found in .env file")
-
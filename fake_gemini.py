@@ -0,0 +1,582 @@
+"""
+Local stand-in for the Gemini image model, for benchmarks and offline runs.
+
+FakeBackend decides what one request looks like: the time to first chunk
+is drawn from a log-normal distribution, a few text deltas follow at a
+fixed interval, then one generated image of a configurable size and
+format. A configurable fraction of requests fail with 429
+RESOURCE_EXHAUSTED (including a RetryInfo hint) or 503, raised as the same
+``google.genai.errors`` types the SDK produces, so the retry and rate
+limiting code paths run unchanged.
+
+There are two ways to use it:
+
+* FakeClient: an in-process object with the ``models`` / ``aio.models``
+  surface the pipeline calls. Selected by create_client() when
+  VTRYON_FAKE_GEMINI=1.
+* FakeGeminiServer: a local HTTP server speaking the REST streaming
+  protocol (server-sent events). Point a real ``genai.Client`` at it with
+  VTRYON_GEMINI_BASE_URL to include the SDK's HTTP and JSON handling in
+  measurements.
+"""
+import asyncio
+import base64
+import functools
+import io
+import json
+import logging
+import math
+import os
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass, field, fields, replace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+import numpy as np
+from PIL import Image
+
+from rate_limiter import IMAGE_TOKENS
+
+logger = logging.getLogger(__name__)
+
+FAKE_IMAGE_FORMATS = {"png": ("PNG", "image/png"), "jpeg": ("JPEG", "image/jpeg"), "webp": ("WEBP", "image/webp")}
+
+
+@dataclass
+class FakeConfig:
+    """
+    Timing, payload and failure settings for the fake model
+
+    Times are in milliseconds. ttfc_ms is the median time to first chunk
+    and ttfc_sigma the log-normal spread around it (0 for a fixed delay).
+    cache_min_tokens mirrors the minimum size the real API accepts for
+    explicit context caches (1024 on Flash models). models is the
+    comma-separated list served by models.list(); requests to a model in
+    failing_models always fail with 503, to exercise failover.
+    """
+    ttfc_ms: float = 1500.0
+    ttfc_sigma: float = 0.3
+    text_chunks: int = 3
+    chunk_interval_ms: float = 40.0
+    image_delay_ms: float = 2500.0
+    image_size: int = 1024
+    image_format: str = "png"
+    rate_limit_rate: float = 0.0
+    error_rate: float = 0.0
+    retry_after_s: float = 1.0
+    cache_min_tokens: int = 1024
+    models: str = "gemini-2.5-flash-image-preview,gemini-2.0-flash-preview-image-generation,gemini-2.5-flash"
+    failing_models: str = ""
+    seed: int = None
+
+    @classmethod
+    def from_env(cls, **overrides):
+        """
+        Read VTRYON_FAKE_<FIELD> variables (e.g. VTRYON_FAKE_TTFC_MS); keyword arguments win
+        """
+        values = {}
+        for f in fields(cls):
+            raw = os.getenv(f"VTRYON_FAKE_{f.name.upper()}")
+            if raw is not None:
+                values[f.name] = str(raw) if f.type is str else _number(raw)
+        values.update(overrides)
+        return cls(**values)
+
+    def scaled(self, factor):
+        """
+        Copy with every delay multiplied by factor (e.g. 0.01 for quick benchmarks)
+        """
+        return replace(
+            self,
+            ttfc_ms=self.ttfc_ms * factor,
+            chunk_interval_ms=self.chunk_interval_ms * factor,
+            image_delay_ms=self.image_delay_ms * factor,
+            retry_after_s=self.retry_after_s * factor,
+        )
+
+
+def _number(raw):
+    value = float(raw)
+    return int(value) if value.is_integer() and "." not in raw else value
+
+
+@functools.lru_cache(maxsize=8)
+def render_payload(size, image_format="png"):
+    """
+    Encoded camera-like image used as the generated output
+
+    Gradients plus noise, so its encoded size and decode cost resemble a
+    real photo rather than a flat test card.
+    """
+    pil_format, _ = FAKE_IMAGE_FORMATS[image_format]
+    height = size * 4 // 3
+    y, x = np.mgrid[0:height, 0:size]
+    base = np.stack([x / size * 255, y / height * 255, (x + y) / (size + height) * 255], axis=-1)
+    noise = np.random.default_rng(size).normal(0, 6, base.shape)
+    frame = np.clip(base + noise, 0, 255).astype(np.uint8)
+    buf = io.BytesIO()
+    Image.fromarray(frame).save(buf, format=pil_format, **({"compress_level": 1} if pil_format == "PNG" else {}))
+    return buf.getvalue()
+
+
+def _rate_limit_body(retry_after_s):
+    return {
+        "error": {
+            "code": 429,
+            "status": "RESOURCE_EXHAUSTED",
+            "message": "Resource has been exhausted (fake backend).",
+            "details": [
+                {"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": f"{retry_after_s:.3f}s"},
+            ],
+        }
+    }
+
+
+def _error_body(code, status, message):
+    return {"error": {"code": code, "status": status, "message": message}}
+
+
+def _unavailable_body():
+    return {"error": {"code": 503, "status": "UNAVAILABLE", "message": "The model is overloaded (fake backend)."}}
+
+
+def _request_bytes(contents):
+    total = 0
+    for content in contents or []:
+        for part in getattr(content, "parts", None) or []:
+            if part.inline_data is not None and part.inline_data.data:
+                total += len(part.inline_data.data)
+            elif part.text:
+                total += len(part.text)
+    return total
+
+
+@dataclass
+class Step:
+    """One scheduled piece of a fake response: wait ``delay`` seconds, then emit"""
+    delay: float
+    text: str = None
+    image: bytes = None
+    mime_type: str = None
+    total_tokens: int = None
+    cached_tokens: int = None
+
+
+@dataclass
+class Plan:
+    """Either an error (HTTP code and JSON body) after ``error_delay``, or a list of steps"""
+    steps: list = field(default_factory=list)
+    error_code: int = None
+    error_body: dict = None
+    error_delay: float = 0.0
+
+
+class FakeBackend:
+    """
+    Produces response plans and keeps request counters; shared by client and server
+    """
+
+    def __init__(self, config=None):
+        self.config = config or FakeConfig()
+        self._rng = random.Random(self.config.seed)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.rate_limited = 0
+        self.errors = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.caches = {}
+        self.cached_requests = 0
+        # Render the output image now so the first request is not slower than the rest
+        render_payload(self.config.image_size, self.config.image_format)
+
+    def create_cache(self, text_chars):
+        """
+        Register a context cache of the given prompt length; returns (name, None) or (None, (code, body))
+        """
+        tokens = text_chars // 4
+        if tokens < self.config.cache_min_tokens:
+            return None, (400, _error_body(
+                400, "INVALID_ARGUMENT",
+                f"Cached content is too small. total_token_count={tokens}, "
+                f"min_total_token_count={self.config.cache_min_tokens}"))
+        with self._lock:
+            name = f"cachedContents/fake-{len(self.caches) + 1}"
+            self.caches[name] = tokens
+        return name, None
+
+    def list_models(self):
+        """
+        Model entries in REST form; names containing "image" can generate images
+        """
+        entries = []
+        for name in filter(None, (n.strip() for n in self.config.models.split(","))):
+            actions = ["generateContent", "countTokens"] + ([] if "image" in name else ["createCachedContent"])
+            entries.append({"name": f"models/{name}", "displayName": name, "supportedGenerationMethods": actions})
+        return entries
+
+    def plan(self, request_bytes=0, prompt_chars=0, cached_content=None, model=None):
+        """
+        Decide the outcome and timing of one request
+        """
+        cfg = self.config
+        with self._lock:
+            self.requests += 1
+            self.bytes_in += request_bytes
+            if model is not None and model in cfg.failing_models.split(","):
+                self.errors += 1
+                return Plan(error_code=503, error_body=_unavailable_body(), error_delay=cfg.chunk_interval_ms / 1000)
+            cached_tokens = None
+            if cached_content:
+                if cached_content not in self.caches:
+                    return Plan(error_code=404, error_body=_error_body(
+                        404, "NOT_FOUND", f"CachedContent not found: {cached_content}"))
+                cached_tokens = self.caches[cached_content]
+                self.cached_requests += 1
+            roll = self._rng.random()
+            if cfg.ttfc_sigma > 0:
+                ttfc = self._rng.lognormvariate(math.log(max(cfg.ttfc_ms, 1e-3)), cfg.ttfc_sigma)
+            else:
+                ttfc = cfg.ttfc_ms
+            if roll < cfg.rate_limit_rate:
+                self.rate_limited += 1
+                # Rejections come back fast, before any generation happens
+                return Plan(error_code=429, error_body=_rate_limit_body(cfg.retry_after_s),
+                            error_delay=min(ttfc, cfg.chunk_interval_ms) / 1000)
+            if roll < cfg.rate_limit_rate + cfg.error_rate:
+                self.errors += 1
+                return Plan(error_code=503, error_body=_unavailable_body(), error_delay=ttfc / 1000)
+
+        image = render_payload(cfg.image_size, cfg.image_format)
+        with self._lock:
+            self.bytes_out += len(image)
+        steps = []
+        for i in range(cfg.text_chunks):
+            delay = ttfc if i == 0 else cfg.chunk_interval_ms
+            steps.append(Step(delay / 1000, text=f"Fake try-on description part {i + 1}. "))
+        # Usage metadata rides on the final chunk, as with the real API
+        steps.append(Step((cfg.image_delay_ms if steps else ttfc) / 1000, image=image,
+                          mime_type=FAKE_IMAGE_FORMATS[cfg.image_format][1],
+                          total_tokens=prompt_chars // 4 + (cached_tokens or 0) + 2 * IMAGE_TOKENS,
+                          cached_tokens=cached_tokens))
+        return Plan(steps=steps)
+
+    def _enter(self):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def _leave(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "rate_limited": self.rate_limited,
+                "errors": self.errors,
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "max_in_flight": self.max_in_flight,
+                "cached_requests": self.cached_requests,
+            }
+
+
+# Helper function to turn a plan step into an SDK response object
+def _to_response(step):
+    from google.genai import types
+
+    if step.image is not None:
+        part = types.Part(inline_data=types.Blob(data=step.image, mime_type=step.mime_type))
+    else:
+        part = types.Part(text=step.text)
+    usage = None
+    if step.total_tokens is not None:
+        usage = types.GenerateContentResponseUsageMetadata(total_token_count=step.total_tokens,
+                                                           cached_content_token_count=step.cached_tokens)
+    return types.GenerateContentResponse(
+        candidates=[types.Candidate(content=types.Content(role="model", parts=[part]))],
+        usage_metadata=usage,
+    )
+
+
+# Helper function to turn a plan step into the REST JSON form
+def _to_json(step):
+    if step.image is not None:
+        part = {"inlineData": {"mimeType": step.mime_type, "data": base64.b64encode(step.image).decode("ascii")}}
+    else:
+        part = {"text": step.text}
+    body = {"candidates": [{"content": {"role": "model", "parts": [part]}}]}
+    if step.total_tokens is not None:
+        body["usageMetadata"] = {"totalTokenCount": step.total_tokens}
+        if step.cached_tokens:
+            body["usageMetadata"]["cachedContentTokenCount"] = step.cached_tokens
+    return body
+
+
+def _raise_error(code, body):
+    from google.genai import errors
+
+    if code >= 500:
+        raise errors.ServerError(code, body)
+    raise errors.ClientError(code, body)
+
+
+def _raise_plan_error(plan):
+    _raise_error(plan.error_code, plan.error_body)
+
+
+def _prompt_chars(contents):
+    total = 0
+    for content in contents or []:
+        for part in getattr(content, "parts", None) or []:
+            total += len(part.text or "")
+    return total
+
+
+def _cached_content(config):
+    return getattr(config, "cached_content", None) if config is not None else None
+
+
+class _FakeCaches:
+    def __init__(self, backend):
+        self._backend = backend
+
+    def create(self, model, config=None):
+        from google.genai import types
+
+        name, error = self._backend.create_cache(_prompt_chars(getattr(config, "contents", None)))
+        if error is not None:
+            _raise_error(*error)
+        return types.CachedContent(name=name, model=model, display_name=getattr(config, "display_name", None))
+
+    def delete(self, name, config=None):
+        with self._backend._lock:
+            self._backend.caches.pop(name, None)
+
+
+class _FakeModels:
+    def __init__(self, backend):
+        self._backend = backend
+
+    def list(self, config=None):
+        from google.genai import types
+
+        return [types.Model(name=entry["name"], display_name=entry["displayName"],
+                            supported_actions=entry["supportedGenerationMethods"])
+                for entry in self._backend.list_models()]
+
+    def generate_content_stream(self, model, contents, config=None):
+        plan = self._backend.plan(_request_bytes(contents), _prompt_chars(contents), _cached_content(config), model)
+        # Like the SDK, nothing is sent until the stream is iterated
+        return self._stream(plan)
+
+    def _stream(self, plan):
+        self._backend._enter()
+        try:
+            if plan.error_code:
+                time.sleep(plan.error_delay)
+                _raise_plan_error(plan)
+            for step in plan.steps:
+                if step.delay:
+                    time.sleep(step.delay)
+                yield _to_response(step)
+        finally:
+            self._backend._leave()
+
+    def generate_content(self, model, contents, config=None):
+        from google.genai import types
+
+        chunks = list(self.generate_content_stream(model, contents, config))
+        parts = [part for chunk in chunks for part in (chunk.candidates[0].content.parts or [])]
+        return types.GenerateContentResponse(
+            candidates=[types.Candidate(content=types.Content(role="model", parts=parts))],
+            usage_metadata=chunks[-1].usage_metadata if chunks else None,
+        )
+
+
+class _FakeAsyncModels:
+    def __init__(self, backend):
+        self._backend = backend
+
+    async def generate_content_stream(self, model, contents, config=None):
+        plan = self._backend.plan(_request_bytes(contents), _prompt_chars(contents), _cached_content(config), model)
+        if plan.error_code:
+            # The async SDK raises HTTP errors when the call is awaited
+            await asyncio.sleep(plan.error_delay)
+            _raise_plan_error(plan)
+        return self._stream(plan)
+
+    async def _stream(self, plan):
+        self._backend._enter()
+        try:
+            for step in plan.steps:
+                if step.delay:
+                    await asyncio.sleep(step.delay)
+                yield _to_response(step)
+        finally:
+            self._backend._leave()
+
+
+class _FakeAio:
+    def __init__(self, backend):
+        self.models = _FakeAsyncModels(backend)
+
+
+class FakeClient:
+    """
+    In-process stand-in for ``genai.Client`` covering the calls the pipeline makes
+    """
+
+    def __init__(self, config=None, backend=None):
+        self.backend = backend or FakeBackend(config)
+        self.models = _FakeModels(self.backend)
+        self.caches = _FakeCaches(self.backend)
+        self.aio = _FakeAio(self.backend)
+
+    @classmethod
+    def from_env(cls):
+        return cls(FakeConfig.from_env())
+
+
+_STREAM_PATH = re.compile(r"/models/(?P<model>[^/:]+):(?P<method>streamGenerateContent|generateContent)")
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, code, body):
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        if urlsplit(self.path).path.endswith("/models"):
+            self._send_json(200, {"models": self.server.backend.list_models()})
+        else:
+            self._send_json(404, _error_body(404, "NOT_FOUND", self.path))
+
+    def do_POST(self):
+        backend = self.server.backend
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        try:
+            request = json.loads(body or b"{}")
+        except ValueError:
+            request = {}
+        prompt_chars = sum(len(part.get("text", "")) for content in request.get("contents", [])
+                           for part in content.get("parts", []))
+        if urlsplit(self.path).path.endswith("/cachedContents"):
+            name, error = backend.create_cache(prompt_chars)
+            if error is not None:
+                self._send_json(*error)
+            else:
+                self._send_json(200, {"name": name, "model": request.get("model")})
+            return
+        match = _STREAM_PATH.search(self.path)
+        if match is None:
+            self._send_json(404, _error_body(404, "NOT_FOUND", self.path))
+            return
+        plan = backend.plan(len(body), prompt_chars, request.get("cachedContent"), match.group("model"))
+        if plan.error_code:
+            time.sleep(plan.error_delay)
+            self._send_json(plan.error_code, plan.error_body)
+            return
+
+        backend._enter()
+        try:
+            if match.group("method") == "generateContent":
+                time.sleep(sum(step.delay for step in plan.steps))
+                parts = [part for step in plan.steps for part in _to_json(step)["candidates"][0]["content"]["parts"]]
+                self._send_json(200, {"candidates": [{"content": {"role": "model", "parts": parts}}],
+                                      "usageMetadata": _to_json(plan.steps[-1]).get("usageMetadata")})
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for step in plan.steps:
+                if step.delay:
+                    time.sleep(step.delay)
+                self._write_chunk(b"data: " + json.dumps(_to_json(step)).encode() + b"\r\n\r\n")
+            self._write_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            # Client cancelled the stream
+            self.close_connection = True
+        finally:
+            backend._leave()
+
+
+class FakeGeminiServer:
+    """
+    Local HTTP server emulating the Gemini REST streaming endpoint
+
+    Usable as a context manager; ``url`` is the base URL to hand to
+    ``types.HttpOptions(base_url=...)``.
+    """
+
+    def __init__(self, config=None, host="127.0.0.1", port=0, backend=None):
+        self.backend = backend or FakeBackend(config)
+        self._httpd = ThreadingHTTPServer((host, port), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.backend = self.backend
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="fake-gemini", daemon=True)
+        self._thread.start()
+        logger.info("🧪 Fake Gemini server listening on %s", self.url)
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serve the fake Gemini backend over HTTP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args(argv)
+
+    server = FakeGeminiServer(FakeConfig.from_env(), host=args.host, port=args.port)
+    server.start()
+    print(f"🧪 Fake Gemini server listening on {server.url}")
+    print(f"   Set VTRYON_GEMINI_BASE_URL={server.url} to use it")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
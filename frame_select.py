@@ -0,0 +1,228 @@
+"""
+Best-frame selection from a burst of camera frames.
+
+A single snapshot is often blurry or caught mid-motion, and every bad
+capture costs a full model round trip plus a manual retry. Burst capture
+takes a short run of frames instead, scores each one cheaply and keeps only
+the best for the try-on request. In the app the frames come from the
+user's browser (camera shots or an uploaded clip); read_frames opens a
+camera or video file on the machine running the code, for local and CLI
+use.
+
+Each frame is scored on a SCORE_WIDTH grayscale copy with vectorized OpenCV
+and numpy operations, a few milliseconds per frame on a CPU:
+
+* sharpness: variance of the Laplacian (focus and motion blur flatten it)
+* motion: mean absolute difference from the previous frame, after
+  removing each frame's mean brightness (only meaningful for consecutive
+  video frames; separate shots use max_motion=inf)
+* exposure: mean brightness and the fraction of clipped pixels
+
+Frames that are badly exposed, below MIN_SHARPNESS or above MAX_MOTION are dropped;
+the best remaining frame wins. Only the current best frame is copied and
+kept, so a burst of any length holds one full frame in memory.
+"""
+import logging
+import os
+import time
+from dataclasses import dataclass
+
+import cv2
+import numpy as np
+
+from telemetry import span
+
+logger = logging.getLogger(__name__)
+
+SCORE_WIDTH = 320
+MIN_SHARPNESS = float(os.getenv("VTRYON_MIN_SHARPNESS", 60.0))
+MAX_MOTION = float(os.getenv("VTRYON_MAX_MOTION", 3.0))
+MIN_BRIGHTNESS = 40.0
+MAX_BRIGHTNESS = 215.0
+MAX_CLIPPED = 0.25
+BURST_FRAMES = int(os.getenv("VTRYON_BURST_FRAMES", 30))
+BURST_SECONDS = float(os.getenv("VTRYON_BURST_SECONDS", 3.0))
+# Camera index for read_frames (the camera attached to this machine; local and CLI use only)
+CAMERA_SOURCE = os.getenv("VTRYON_CAMERA", "0")
+# Frames skipped while the camera adjusts exposure and focus after opening
+WARMUP_FRAMES = 5
+
+
+@dataclass
+class FrameScore:
+    """Quality measurements for one frame; reason says why it was dropped"""
+    index: int
+    sharpness: float
+    motion: float
+    brightness: float
+    clipped: float
+    score: float
+    reason: str = ""
+
+    @property
+    def accepted(self):
+        return not self.reason
+
+
+class FrameScorer:
+    """
+    Scores consecutive frames of one stream (motion needs the previous frame)
+    """
+
+    def __init__(self, width=SCORE_WIDTH, min_sharpness=MIN_SHARPNESS, max_motion=MAX_MOTION, rgb=False):
+        if not max_motion > 0:
+            # It divides the score; use inf, not 0, to turn the motion check off
+            raise ValueError(f"max_motion must be positive, got {max_motion!r} (VTRYON_MAX_MOTION)")
+        self.width = width
+        self.min_sharpness = min_sharpness
+        self.max_motion = max_motion
+        self.rgb = rgb
+        self._previous = None
+        self._index = 0
+
+    def _gray(self, frame):
+        height, width = frame.shape[:2]
+        if width > self.width:
+            # Downscale before the color conversion so it touches a fraction of the pixels
+            frame = cv2.resize(frame, (self.width, max(1, round(height * self.width / width))),
+                               interpolation=cv2.INTER_AREA)
+        if frame.ndim == 2:
+            return frame
+        return cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY if self.rgb else cv2.COLOR_BGR2GRAY)
+
+    def score(self, frame):
+        """
+        Score a uint8 frame (BGR from OpenCV by default, RGB if rgb=True)
+        """
+        gray = self._gray(frame)
+        sharpness = float(cv2.Laplacian(gray, cv2.CV_32F).var())
+        brightness = float(gray.mean())
+        # Compare mean-centred frames so an exposure change does not read as motion
+        centred = gray.astype(np.float32) - brightness
+        if self._previous is not None and self._previous.shape == centred.shape:
+            motion = float(cv2.absdiff(centred, self._previous).mean())
+        else:
+            motion = 0.0
+        self._previous = centred
+        clipped = np.count_nonzero((gray <= 5) | (gray >= 250)) / gray.size
+
+        # Exposure first: a dark frame also has little contrast for the Laplacian
+        if brightness < MIN_BRIGHTNESS:
+            reason = "dark"
+        elif brightness > MAX_BRIGHTNESS or clipped > MAX_CLIPPED:
+            reason = "overexposed"
+        elif sharpness < self.min_sharpness:
+            reason = "blurry"
+        elif motion > self.max_motion:
+            reason = "moving"
+        else:
+            reason = ""
+        # Sharpness dominates; motion and poor exposure scale it down
+        exposure = (1.0 - clipped) * (1.0 - abs(brightness - 128.0) / 256.0)
+        score = sharpness * exposure / (1.0 + motion / self.max_motion)
+
+        result = FrameScore(self._index, sharpness, motion, brightness, clipped, score, reason)
+        self._index += 1
+        return result
+
+
+class BestFrameSelector:
+    """
+    Feed frames one at a time; keeps a copy of the best accepted frame only
+    """
+
+    def __init__(self, scorer=None):
+        self.scorer = scorer or FrameScorer()
+        self.best = None
+        self.best_score = None
+        self.scores = []
+        self.score_seconds = 0.0
+
+    def feed(self, frame):
+        start = time.perf_counter()
+        result = self.scorer.score(frame)
+        self.score_seconds += time.perf_counter() - start
+        self.scores.append(result)
+        if result.accepted and (self.best_score is None or result.score > self.best_score.score):
+            self.best, self.best_score = frame.copy(), result
+        return result
+
+    def rejected(self):
+        """
+        Count of dropped frames by reason
+        """
+        counts = {}
+        for result in self.scores:
+            if not result.accepted:
+                counts[result.reason] = counts.get(result.reason, 0) + 1
+        return counts
+
+    @property
+    def ms_per_frame(self):
+        return self.score_seconds * 1000 / len(self.scores) if self.scores else 0.0
+
+
+def read_frames(source=None, max_frames=BURST_FRAMES, max_seconds=BURST_SECONDS, warmup=WARMUP_FRAMES):
+    """
+    Yield BGR frames from a camera index or video file via cv2.VideoCapture
+
+    A camera index opens a camera attached to this machine, so only local
+    and CLI tools use one; the app reads uploaded clip files only.
+    """
+    source = CAMERA_SOURCE if source is None else source
+    if isinstance(source, str) and source.isdigit():
+        source = int(source)
+    capture = cv2.VideoCapture(source)
+    if not capture.isOpened():
+        raise RuntimeError(f"Could not open video source {source!r}")
+    try:
+        for _ in range(warmup if isinstance(source, int) else 0):
+            capture.grab()
+        deadline = time.monotonic() + max_seconds if max_seconds else None
+        for _ in range(max_frames):
+            if deadline is not None and time.monotonic() > deadline:
+                break
+            ok, frame = capture.read()
+            if not ok:
+                break
+            yield frame
+    finally:
+        capture.release()
+
+
+def select_best_frame(frames, scorer=None):
+    """
+    Score an iterable of frames; returns the BestFrameSelector (best is None if every frame was dropped)
+    """
+    selector = BestFrameSelector(scorer)
+    with span("frame_select") as select_span:
+        for frame in frames:
+            selector.feed(frame)
+        select_span.set(frames=len(selector.scores), accepted=sum(1 for s in selector.scores if s.accepted))
+    if selector.best is None:
+        logger.info("🎞️ No usable frame in %d (%s)", len(selector.scores), selector.rejected())
+    else:
+        logger.info("🎞️ Picked frame %d of %d (sharpness %.0f, motion %.1f, %.1f ms/frame)",
+                    selector.best_score.index, len(selector.scores), selector.best_score.sharpness,
+                    selector.best_score.motion, selector.ms_per_frame)
+    return selector
+
+
+def decode_frame(data):
+    """
+    BGR frame from encoded image bytes (e.g. a browser camera shot)
+    """
+    frame = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if frame is None:
+        raise ValueError("Could not decode camera image")
+    return frame
+
+
+def encode_frame(frame, quality=95):
+    """
+    JPEG bytes for a BGR frame, ready to use like a camera_input capture
+    """
+    ok, buffer = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise ValueError("Could not encode frame as JPEG")
+    return buffer.tobytes()
@@ -0,0 +1,170 @@
+"""
+Process-wide pooled Gemini clients and a shared asyncio loop.
+
+Streamlit reruns the whole script on every widget interaction; creating a
+``genai.Client`` each time throws away its HTTP connection pool and TLS
+sessions. get_client() returns one client per API key for the life of the
+process, configured with a keep-alive connection pool, and imports
+``google.genai`` only the first time a client is actually needed.
+
+The async half of a client (``client.aio``) owns an httpx.AsyncClient that
+is bound to the event loop it first ran on, so all async work goes through
+one background loop (run_coroutine / iterate_async) instead of a fresh
+``asyncio.run`` per call.
+
+For offline runs and benchmarks, VTRYON_FAKE_GEMINI=1 swaps in the
+in-process fake_gemini.FakeClient, and VTRYON_GEMINI_BASE_URL points real
+clients at another endpoint such as fake_gemini.FakeGeminiServer.
+"""
+import asyncio
+import logging
+import os
+import queue
+import threading
+import time
+
+DEFAULT_MAX_CONNECTIONS = 20
+DEFAULT_MAX_KEEPALIVE = 20
+DEFAULT_KEEPALIVE_EXPIRY = 120.0
+
+# Startup / reuse measurements shown in the UI
+TIMINGS = {
+    "genai_import_ms": None,
+    "client_create_ms": None,
+    "clients_created": 0,
+    "client_reuses": 0,
+}
+
+logger = logging.getLogger(__name__)
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def _import_genai():
+    start = time.perf_counter()
+    from google import genai
+    from google.genai import types
+    if TIMINGS["genai_import_ms"] is None:
+        TIMINGS["genai_import_ms"] = (time.perf_counter() - start) * 1000
+    return genai, types
+
+
+def _pool_args():
+    import httpx
+
+    limits = httpx.Limits(
+        max_connections=int(os.getenv("VTRYON_HTTP_MAX_CONNECTIONS", DEFAULT_MAX_CONNECTIONS)),
+        max_keepalive_connections=int(os.getenv("VTRYON_HTTP_MAX_KEEPALIVE", DEFAULT_MAX_KEEPALIVE)),
+        keepalive_expiry=float(os.getenv("VTRYON_HTTP_KEEPALIVE_EXPIRY", DEFAULT_KEEPALIVE_EXPIRY)),
+    )
+    return {"limits": limits}
+
+
+def create_client(api_key):
+    """
+    Build a new genai.Client with a tuned keep-alive connection pool
+    """
+    if os.getenv("VTRYON_FAKE_GEMINI", "").lower() in ("1", "true", "yes"):
+        from fake_gemini import FakeClient
+        logger.info("🧪 Using the fake Gemini backend (VTRYON_FAKE_GEMINI)")
+        TIMINGS["clients_created"] += 1
+        return FakeClient.from_env()
+
+    genai, types = _import_genai()
+    start = time.perf_counter()
+    client = genai.Client(
+        api_key=api_key,
+        http_options=types.HttpOptions(
+            base_url=os.getenv("VTRYON_GEMINI_BASE_URL") or None,
+            client_args=_pool_args(),
+            async_client_args=_pool_args(),
+        ),
+    )
+    TIMINGS["client_create_ms"] = (time.perf_counter() - start) * 1000
+    TIMINGS["clients_created"] += 1
+    return client
+
+
+def get_client(api_key):
+    """
+    Return the shared client for an API key, creating it on first use
+    """
+    with _clients_lock:
+        client = _clients.get(api_key)
+        if client is None:
+            client = create_client(api_key)
+            _clients[api_key] = client
+        else:
+            TIMINGS["client_reuses"] += 1
+        return client
+
+
+def _run_loop(loop):
+    asyncio.set_event_loop(loop)
+    loop.run_forever()
+
+
+def get_loop():
+    """
+    Return the background event loop used for all async Gemini calls
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_run_loop, args=(_loop,), name="gemini-async-loop", daemon=True).start()
+        return _loop
+
+
+def run_coroutine(coro, timeout=None):
+    """
+    Run a coroutine on the background loop and block for its result
+    """
+    future = asyncio.run_coroutine_threadsafe(coro, get_loop())
+    try:
+        return future.result(timeout)
+    except BaseException:
+        future.cancel()
+        raise
+
+
+_END = object()
+
+
+def iterate_async(agen):
+    """
+    Drive an async generator on the background loop and yield its items here
+
+    Leaving the loop early (break, exception, Streamlit stopping the script)
+    cancels the generator, which in turn cancels any work it started.
+    """
+    items = queue.Queue()
+
+    async def pump():
+        try:
+            async for item in agen:
+                items.put((item, None))
+        except BaseException as e:
+            items.put((None, e))
+            raise
+        finally:
+            items.put((_END, None))
+
+    future = asyncio.run_coroutine_threadsafe(pump(), get_loop())
+    try:
+        while True:
+            item, error = items.get()
+            if item is _END:
+                break
+            if error is not None:
+                if isinstance(error, asyncio.CancelledError):
+                    break
+                raise error
+            yield item
+    finally:
+        if not future.done():
+            future.cancel()
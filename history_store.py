@@ -0,0 +1,393 @@
+"""
+Bounded-memory try-on history.
+
+Each session keeps only metadata and a small JPEG thumbnail per entry in
+memory. Full-resolution originals and generated images are written to a
+content-addressed blob store on disk and reloaded lazily when an entry is
+opened. Reloaded payloads sit in a per-session LRU that is bounded both per
+session and across all sessions in the process. The entries themselves
+count against the session budget too, and the oldest are dropped once a
+session holds more than max_entries or goes over it.
+"""
+import hashlib
+import io
+import os
+import tempfile
+import threading
+import time
+import uuid
+import weakref
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+from PIL import Image
+
+DEFAULT_BLOB_DIR = os.path.join(".cache", "blobs")
+DEFAULT_BLOB_MAX_BYTES = 2 * 1024 * 1024 * 1024
+DEFAULT_SESSION_BUDGET = 32 * 1024 * 1024
+DEFAULT_GLOBAL_BUDGET = 256 * 1024 * 1024
+DEFAULT_MAX_ENTRIES = 50
+THUMBNAIL_SIZE = (256, 256)
+THUMBNAIL_QUALITY = 80
+
+
+def blob_digest(data):
+    """
+    Content address of a payload in a BlobStore
+    """
+    return hashlib.sha256(data).hexdigest()
+
+
+class BlobStore:
+    """
+    Content-addressed files named by the SHA-256 of their bytes
+
+    Identical payloads are stored once. When the directory grows past
+    max_bytes the least recently written blobs are removed.
+    """
+
+    def __init__(self, blob_dir=DEFAULT_BLOB_DIR, max_bytes=DEFAULT_BLOB_MAX_BYTES):
+        self.blob_dir = blob_dir
+        self.max_bytes = max_bytes
+        # Bumped on every prune, so holders of digests know when to check them again
+        self.prunes = 0
+        self._lock = threading.Lock()
+        os.makedirs(blob_dir, exist_ok=True)
+        self._total_bytes = sum(
+            os.path.getsize(os.path.join(root, name))
+            for root, _, files in os.walk(blob_dir)
+            for name in files
+        )
+
+    def _path(self, digest):
+        return os.path.join(self.blob_dir, digest[:2], digest)
+
+    def put(self, data):
+        """
+        Store bytes and return their digest
+        """
+        digest = blob_digest(data)
+        path = self._path(digest)
+        with self._lock:
+            if os.path.exists(path):
+                os.utime(path)
+                return digest
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            self._total_bytes += len(data)
+            if self._total_bytes > self.max_bytes:
+                self._prune()
+        return digest
+
+    def get(self, digest):
+        """
+        Return the stored bytes, or None if the blob was pruned
+        """
+        try:
+            with open(self._path(digest), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def exists(self, digest):
+        return os.path.exists(self._path(digest))
+
+    def _prune(self):
+        blobs = []
+        for root, _, files in os.walk(self.blob_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                blobs.append((st.st_mtime, st.st_size, path))
+        blobs.sort()
+        self._total_bytes = sum(size for _, size, _ in blobs)
+        for _, size, path in blobs:
+            if self._total_bytes <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+                self._total_bytes -= size
+            except FileNotFoundError:
+                pass
+        self.prunes += 1
+
+    @property
+    def total_bytes(self):
+        return self._total_bytes
+
+
+@dataclass
+class HistoryEntry:
+    """In-memory record of one try-on; full payloads live in the blob store"""
+    entry_id: str
+    timestamp: str
+    style: str
+    text: str
+    thumbnail: bytes
+    original_digest: str
+    image_digests: list = field(default_factory=list)
+    image_sizes: list = field(default_factory=list)
+
+    @property
+    def memory_bytes(self):
+        return len(self.thumbnail) + len(self.text) + 64 * (2 + len(self.image_digests))
+
+    @property
+    def digests(self):
+        return [self.original_digest, *self.image_digests]
+
+
+def make_thumbnail(image):
+    """
+    Return a small JPEG thumbnail of a PIL image or encoded image bytes
+    """
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        image = Image.open(io.BytesIO(image))
+        if image.format == "JPEG":
+            # Let the JPEG decoder downscale instead of decoding full size
+            image.draft("RGB", THUMBNAIL_SIZE)
+    thumb = image.copy()
+    thumb.thumbnail(THUMBNAIL_SIZE)
+    if thumb.mode != "RGB":
+        thumb = thumb.convert("RGB")
+    buf = io.BytesIO()
+    thumb.save(buf, format="JPEG", quality=THUMBNAIL_QUALITY)
+    return buf.getvalue()
+
+
+class HistoryStore:
+    """
+    One session's history: thumbnails in memory, full payloads on disk
+
+    Entries (thumbnail and text) and the payloads reloaded by
+    load_original/load_images share session_budget. Reloaded payloads are
+    evicted first, then the oldest entries; at most max_entries are kept,
+    and entries whose blobs were pruned from disk are dropped. The shared
+    MemoryBudget evicts reloaded payloads across sessions when the
+    process-wide total goes over its limit.
+    """
+
+    def __init__(self, blob_store, budget, session_budget=DEFAULT_SESSION_BUDGET, max_entries=DEFAULT_MAX_ENTRIES):
+        self.blob_store = blob_store
+        self.budget = budget
+        self.session_budget = session_budget
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._entry_bytes = 0
+        self._hot = OrderedDict()
+        self._hot_bytes = 0
+        self._seen_prunes = blob_store.prunes
+        self._lock = threading.Lock()
+        budget.register(self)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, style, text, images, original, timestamp=None, thumbnail=None):
+        """
+        Spill a result to disk and keep its thumbnail; returns the entry id
+
+        ``original`` may be encoded bytes (preferred, stored as-is) or a PIL image.
+        Images and original may be any bytes-like object, e.g. a memoryview;
+        they are written out without copying. Pass ``thumbnail`` when the
+        caller already has one, so the first image is not decoded again.
+        """
+        if isinstance(original, Image.Image):
+            buf = io.BytesIO()
+            original.save(buf, format="PNG")
+            original_bytes = buf.getvalue()
+        else:
+            original_bytes = original
+
+        if thumbnail is None:
+            thumbnail = make_thumbnail(images[0] if images else original_bytes)
+        entry = HistoryEntry(
+            entry_id=uuid.uuid4().hex,
+            timestamp=timestamp or time.strftime("%Y-%m-%d %H:%M:%S"),
+            style=style,
+            text=text,
+            thumbnail=thumbnail,
+            original_digest=self.blob_store.put(original_bytes),
+            image_digests=[self.blob_store.put(img) for img in images],
+            image_sizes=[len(img) for img in images],
+        )
+        with self._lock:
+            self._entries[entry.entry_id] = entry
+            self._entry_bytes += entry.memory_bytes
+            # The newest entry is always kept, even when it alone is over budget
+            while len(self._entries) > 1 and (len(self._entries) > self.max_entries or
+                                              self._entry_bytes > self.session_budget):
+                self._remove_locked(next(iter(self._entries)))
+            self._enforce_session_budget_locked()
+        return entry.entry_id
+
+    def _remove_locked(self, entry_id):
+        entry = self._entries.pop(entry_id)
+        self._entry_bytes -= entry.memory_bytes
+
+    def _drop_pruned_locked(self):
+        # Only look at the disk again after the blob store has pruned something
+        prunes = self.blob_store.prunes
+        if prunes == self._seen_prunes:
+            return
+        self._seen_prunes = prunes
+        for entry_id, entry in list(self._entries.items()):
+            if not all(self.blob_store.exists(digest) for digest in entry.digests):
+                self._remove_locked(entry_id)
+
+    def entries(self):
+        """
+        Entries newest first (metadata and thumbnails only)
+        """
+        with self._lock:
+            self._drop_pruned_locked()
+            return list(reversed(self._entries.values()))
+
+    def get(self, entry_id):
+        with self._lock:
+            return self._entries.get(entry_id)
+
+    @property
+    def latest(self):
+        with self._lock:
+            self._drop_pruned_locked()
+            return next(reversed(self._entries.values()), None)
+
+    def _load(self, digest):
+        with self._lock:
+            if digest in self._hot:
+                self._hot.move_to_end(digest)
+                return self._hot[digest]
+        data = self.blob_store.get(digest)
+        if data is None:
+            return None
+        with self._lock:
+            if digest not in self._hot:
+                self._hot[digest] = data
+                self._hot_bytes += len(data)
+            self._enforce_session_budget_locked()
+        self.budget.enforce()
+        return data
+
+    def _evict_locked(self, limit):
+        while self._hot and self._hot_bytes > limit:
+            _, data = self._hot.popitem(last=False)
+            self._hot_bytes -= len(data)
+
+    def _enforce_session_budget_locked(self):
+        # Entries stay for the whole session, so reloaded payloads get what they leave of the budget
+        self._evict_locked(max(0, self.session_budget - self._entry_bytes))
+
+    def evict_to(self, limit):
+        with self._lock:
+            self._evict_locked(limit)
+
+    def load_original(self, entry_id):
+        """
+        Reload the full-resolution original as a PIL image, or None if gone
+        """
+        entry = self.get(entry_id)
+        if entry is None:
+            return None
+        data = self._load(entry.original_digest)
+        return Image.open(io.BytesIO(data)) if data is not None else None
+
+    def load_images(self, entry_id):
+        """
+        Reload the generated image bytes for an entry, skipping pruned blobs
+        """
+        entry = self.get(entry_id)
+        if entry is None:
+            return []
+        return [data for data in (self._load(d) for d in entry.image_digests) if data is not None]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._entry_bytes = 0
+            self._hot.clear()
+            self._hot_bytes = 0
+
+    @property
+    def hot_bytes(self):
+        return self._hot_bytes
+
+    def memory_usage(self):
+        """
+        Bytes held in memory by this session's history
+        """
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "metadata_bytes": self._entry_bytes,
+                "hot_bytes": self._hot_bytes,
+                "total_bytes": self._entry_bytes + self._hot_bytes,
+                "session_budget": self.session_budget,
+                "max_entries": self.max_entries,
+            }
+
+
+class MemoryBudget:
+    """
+    Process-wide cap on reloaded payloads across every live HistoryStore
+
+    Stores are tracked weakly so ended sessions drop out automatically.
+    When over budget the store holding the most bytes is trimmed first.
+    """
+
+    def __init__(self, global_budget=DEFAULT_GLOBAL_BUDGET):
+        self.global_budget = global_budget
+        self._stores = weakref.WeakSet()
+        self._lock = threading.Lock()
+
+    def register(self, store):
+        with self._lock:
+            self._stores.add(store)
+
+    def enforce(self):
+        with self._lock:
+            stores = list(self._stores)
+        total = sum(store.hot_bytes for store in stores)
+        for store in sorted(stores, key=lambda s: s.hot_bytes, reverse=True):
+            if total <= self.global_budget:
+                break
+            before = store.hot_bytes
+            store.evict_to(max(0, before - (total - self.global_budget)))
+            total -= before - store.hot_bytes
+
+    def memory_usage(self):
+        """
+        Totals across all live sessions
+        """
+        with self._lock:
+            stores = list(self._stores)
+        usage = [store.memory_usage() for store in stores]
+        return {
+            "sessions": len(stores),
+            "entries": sum(u["entries"] for u in usage),
+            "metadata_bytes": sum(u["metadata_bytes"] for u in usage),
+            "hot_bytes": sum(u["hot_bytes"] for u in usage),
+            "total_bytes": sum(u["total_bytes"] for u in usage),
+            "global_budget": self.global_budget,
+        }
+
+
+def from_env():
+    """
+    Build the shared (BlobStore, MemoryBudget, session_budget, max_entries) from VTRYON_* variables
+    """
+    mb = 1024 * 1024
+    blob_store = BlobStore(
+        blob_dir=os.getenv("VTRYON_BLOB_DIR", DEFAULT_BLOB_DIR),
+        max_bytes=int(float(os.getenv("VTRYON_BLOB_MAX_MB", DEFAULT_BLOB_MAX_BYTES / mb)) * mb),
+    )
+    budget = MemoryBudget(int(float(os.getenv("VTRYON_HISTORY_GLOBAL_MB", DEFAULT_GLOBAL_BUDGET / mb)) * mb))
+    session_budget = int(float(os.getenv("VTRYON_HISTORY_SESSION_MB", DEFAULT_SESSION_BUDGET / mb)) * mb)
+    max_entries = int(os.getenv("VTRYON_HISTORY_MAX_ENTRIES", DEFAULT_MAX_ENTRIES))
+    return blob_store, budget, session_budget, max_entries
@@ -0,0 +1,343 @@
+"""
+Background job queue for try-on generations.
+
+Generations run on a shared pool of worker threads instead of inside the
+Streamlit script run, so retries and backoff sleeps no longer hold up the
+page, and widget interactions cannot interrupt a request half way. Server
+throughput is set by the worker count, not by the number of open tabs.
+
+Each submitted job gets an id. Pages poll get(job_id) for progress (text so
+far, images received, retry attempt) and the final result.
+
+Scheduling is fair across owners (one owner per browser session): among
+the queued jobs with the highest priority, owners take turns, so one user
+submitting many jobs cannot starve another. Within an owner, jobs run by
+priority, then in submission order.
+
+A queued job can be cancelled outright. A running job runs in a
+cancellation scope (see cancellation): it stops at its next progress event,
+or within a fraction of a second while it waits for rate limit capacity,
+a retry backoff or a shared single-flight generation. Its stream is closed,
+which also releases a single-flight generation once nobody else is waiting
+for it.
+
+Finished jobs are kept for retention_seconds (and at most max_retained of
+them), then dropped.
+"""
+import itertools
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+
+import cancellation
+from telemetry import METRICS, record_stage, trace
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 4
+DEFAULT_RETENTION_SECONDS = 600
+DEFAULT_MAX_RETAINED = 256
+
+JOB_METRIC = "vtryon_jobs_total"
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+
+@dataclass
+class Job:
+    """
+    One queued generation and its progress
+
+    run is a zero-argument callable returning an iterator of StreamEvent
+    objects (e.g. a stream_item_on_body call). text, images and attempt
+    follow the stream as it runs; result holds the final "done" event.
+    """
+    job_id: str
+    owner: str
+    run: object
+    priority: int = 0
+    label: str = ""
+    seq: int = 0
+    state: str = QUEUED
+    submitted: float = field(default_factory=time.time)
+    started: float = None
+    finished: float = None
+    text: str = ""
+    images: list = field(default_factory=list)
+    attempt: int = 0
+    result: object = None
+    error: BaseException = None
+    cancel_event: threading.Event = field(default_factory=threading.Event)
+
+    @property
+    def cancel_requested(self):
+        return self.cancel_event.is_set()
+
+    @property
+    def finished_state(self):
+        return self.state in FINISHED_STATES
+
+    @property
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+
+
+class JobQueue:
+    """
+    Shared worker pool with per-owner fair, priority-ordered scheduling
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS, retention_seconds=DEFAULT_RETENTION_SECONDS,
+                 max_retained=DEFAULT_MAX_RETAINED):
+        self.workers = workers
+        self.retention_seconds = retention_seconds
+        self.max_retained = max_retained
+        self._lock = threading.Lock()
+        # Workers wait on _work; callers of wait() on _changed
+        self._work = threading.Condition(self._lock)
+        self._changed = threading.Condition(self._lock)
+        self._jobs = {}
+        # owner -> deque of queued jobs; order of keys is the round-robin order
+        self._queues = OrderedDict()
+        self._finished = deque()
+        self._seq = itertools.count()
+        self._threads = []
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+
+    @classmethod
+    def from_env(cls):
+        """
+        Build a queue configured from VTRYON_WORKERS, VTRYON_JOB_RETENTION and VTRYON_JOB_MAX_RETAINED
+        """
+        return cls(
+            workers=int(os.getenv("VTRYON_WORKERS", DEFAULT_WORKERS)),
+            retention_seconds=float(os.getenv("VTRYON_JOB_RETENTION", DEFAULT_RETENTION_SECONDS)),
+            max_retained=int(os.getenv("VTRYON_JOB_MAX_RETAINED", DEFAULT_MAX_RETAINED)),
+        )
+
+    def _start_workers_locked(self):
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._worker, name=f"tryon-worker-{len(self._threads)}", daemon=True)
+            self._threads.append(thread)
+            thread.start()
+
+    def submit(self, owner, run, priority=0, label=""):
+        """
+        Queue run() for owner and return the job id; higher priority runs first
+        """
+        job = Job(job_id=uuid.uuid4().hex[:16], owner=owner, run=run, priority=priority, label=label)
+        with self._lock:
+            job.seq = next(self._seq)
+            self._jobs[job.job_id] = job
+            queue = self._queues.setdefault(owner, deque())
+            queue.append(job)
+            if len(queue) > 1:
+                # Keep each owner's queue ordered by priority, then submission
+                ordered = sorted(queue, key=lambda j: (-j.priority, j.seq))
+                queue.clear()
+                queue.extend(ordered)
+            self._start_workers_locked()
+            self._work.notify()
+        METRICS.inc(JOB_METRIC, state="submitted")
+        logger.info("📥 Queued job %s (%s) for %s", job.job_id, label, owner[:8])
+        return job.job_id
+
+    @staticmethod
+    def _pop_next(queues):
+        """Pop the job to run next from queues: highest priority first, owners served in turn"""
+        best_owner, best_priority = None, None
+        for owner, queue in queues.items():
+            if queue and (best_priority is None or queue[0].priority > best_priority):
+                best_owner, best_priority = owner, queue[0].priority
+        if best_owner is None:
+            return None
+        queue = queues.pop(best_owner)
+        job = queue.popleft()
+        if queue:
+            # Back of the line for this owner's next job
+            queues[best_owner] = queue
+        return job
+
+    def _next_locked(self):
+        return self._pop_next(self._queues)
+
+    def _worker(self):
+        while True:
+            with self._lock:
+                job = self._next_locked()
+                while job is None:
+                    self._work.wait()
+                    job = self._next_locked()
+                job.state = RUNNING
+                job.started = time.time()
+                self.running += 1
+            self._run(job)
+
+    def _run(self, job):
+        state, error = DONE, None
+        events = None
+        with trace(job.job_id), cancellation.cancel_scope(job.cancel_event):
+            record_stage("queue_wait", job.started - job.submitted, job=job.job_id)
+            try:
+                events = job.run()
+                for event in events:
+                    if job.cancel_requested:
+                        state = CANCELLED
+                        break
+                    self._apply(job, event)
+            except cancellation.Cancelled:
+                state = CANCELLED
+            except Exception as e:
+                state, error = FAILED, e
+                logger.warning("❌ Job %s failed: %s", job.job_id, e)
+            finally:
+                close = getattr(events, "close", None)
+                if close is not None:
+                    close()
+        self._finish(job, state, error)
+
+    def _apply(self, job, event):
+        with self._lock:
+            if event.kind == "text":
+                job.text += event.text
+            elif event.kind == "image":
+                job.images.append(event.image)
+            elif event.kind == "retry":
+                job.text, job.images, job.attempt = "", [], event.attempt
+            elif event.kind == "done":
+                job.result = event
+                job.text, job.images = event.text, list(event.images)
+
+    def _finish(self, job, state, error=None):
+        with self._lock:
+            if job.state == RUNNING:
+                self.running -= 1
+            job.state = state
+            job.error = error
+            job.finished = time.time()
+            if state == DONE:
+                self.completed += 1
+            elif state == FAILED:
+                self.failed += 1
+            else:
+                self.cancelled += 1
+            self._finished.append(job)
+            self._prune_locked()
+            self._changed.notify_all()
+        METRICS.inc(JOB_METRIC, state=state)
+        logger.info("🏁 Job %s %s after %.1fs", job.job_id, state, job.elapsed)
+
+    def cancel(self, job_id, owner=None):
+        """
+        Cancel a queued or running job; returns False if it is unknown or already finished
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.finished_state or (owner is not None and job.owner != owner):
+                return False
+            if job.state == RUNNING:
+                job.cancel_event.set()
+                return True
+            queue = self._queues.get(job.owner)
+            if queue is not None:
+                queue.remove(job)
+                if not queue:
+                    del self._queues[job.owner]
+        self._finish(job, CANCELLED)
+        return True
+
+    def get(self, job_id):
+        """
+        The Job for job_id, or None once it has been dropped after retention
+        """
+        with self._lock:
+            self._prune_locked()
+            return self._jobs.get(job_id)
+
+    def wait(self, job_id, timeout=None):
+        """
+        Block until the job finishes (or timeout); returns the Job
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            job = self._jobs.get(job_id)
+            while job is not None and not job.finished_state:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._changed.wait(remaining)
+            return job
+
+    def position(self, job_id):
+        """
+        Queued jobs that will be dispatched before this one (0 once running)
+
+        Replays the scheduler on a copy of the queues, so the count follows
+        the per-owner round robin as well as priority.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.state != QUEUED:
+                return 0
+            queues = OrderedDict((owner, deque(queue)) for owner, queue in self._queues.items())
+            ahead = 0
+            while True:
+                other = self._pop_next(queues)
+                if other is None or other is job:
+                    return ahead
+                ahead += 1
+
+    def jobs_for(self, owner):
+        """
+        This owner's retained jobs, newest first
+        """
+        with self._lock:
+            return sorted((job for job in self._jobs.values() if job.owner == owner), key=lambda j: -j.seq)
+
+    def _prune_locked(self):
+        cutoff = time.time() - self.retention_seconds
+        while self._finished and (self._finished[0].finished < cutoff or len(self._finished) > self.max_retained):
+            job = self._finished.popleft()
+            self._jobs.pop(job.job_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "queued": sum(len(queue) for queue in self._queues.values()),
+                "running": self.running,
+                "completed": self.completed,
+                "failed": self.failed,
+                "cancelled": self.cancelled,
+                "owners_waiting": sum(1 for queue in self._queues.values() if queue),
+            }
+
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    """
+    Return the process-wide JobQueue configured from the environment
+    """
+    global _job_queue
+    with _job_queue_lock:
+        if _job_queue is None:
+            _job_queue = JobQueue.from_env()
+        return _job_queue
@@ -0,0 +1,330 @@
+"""
+API-key pool with per-key usage accounting and quota-aware load balancing.
+
+With a single GEMINI_API_KEY the whole deployment shares one key's
+per-minute quota. GEMINI_API_KEYS lists several keys, from one project or
+many, so throughput grows with the number of keys:
+
+    GEMINI_API_KEYS=team-a=AIza...@60,team-b=AIza...@15,AIza...
+
+Each entry is ``[label=]key[@rpm]``. The label names the key in the UI and
+metrics (the key itself is never shown); rpm overrides VTRYON_RPM for that
+key. Every key gets its own pooled client and its own RateLimiter, so
+requests and tokens per minute are accounted per key.
+
+choose() sends each attempt to the least loaded healthy key: keys that can
+send right away come first, then the lowest share of their per-minute
+capacity used (requests in flight plus requests in the last minute,
+divided by the key's rpm), so a key with twice the quota takes twice the
+traffic. A key that answers 429 is quarantined for the server's
+retry-after hint (or quarantine_seconds), and for quota_quarantine_seconds
+when its quota is exhausted; the attempt moves to another key straight
+away instead of pausing every caller. When every key is quarantined,
+requests wait for the first one back only up to max_wait_seconds and
+otherwise fail fast with KeysExhausted.
+"""
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from rate_limiter import (
+    DEFAULT_RPM,
+    DEFAULT_TPM,
+    RATE_LIMIT,
+    RateLimitExceeded,
+    RateLimiter,
+    classify_error,
+    is_quota_error,
+    retry_after_seconds,
+)
+from telemetry import METRICS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUARANTINE_SECONDS = 60.0
+DEFAULT_QUOTA_QUARANTINE_SECONDS = 600.0
+# Longest a request waits for a quarantined key when no key is healthy
+DEFAULT_MAX_WAIT_SECONDS = 10.0
+USAGE_WINDOW_SECONDS = 60.0
+
+REQUESTS_METRIC = "vtryon_key_requests_total"
+TOKENS_METRIC = "vtryon_key_tokens_total"
+SWITCH_METRIC = "vtryon_key_switches_total"
+IN_FLIGHT_METRIC = "vtryon_key_in_flight"
+UTILIZATION_METRIC = "vtryon_key_utilization"
+QUARANTINED_METRIC = "vtryon_key_quarantined"
+
+
+class KeysExhausted(RateLimitExceeded):
+    """Every API key is quarantined for longer than a request may wait"""
+
+    def __init__(self, retry_in, quota=False):
+        if quota:
+            message = "API quota exceeded on every key. Please check your API plan."
+        else:
+            message = f"Every API key is rate limited. Please try again in {retry_in:.0f}s."
+        super().__init__(message, quota=quota)
+        self.retry_in = retry_in
+
+
+class ApiKey:
+    """
+    One credential with its own client, limiter and rolling one-minute usage
+    """
+
+    def __init__(self, api_key, label=None, rpm=DEFAULT_RPM, tpm=DEFAULT_TPM):
+        self.api_key = api_key
+        self.label = label or f"key-…{api_key[-4:]}"
+        self.rpm = rpm
+        self.tpm = tpm
+        self.limiter = RateLimiter(rpm=rpm, tpm=tpm)
+        self.in_flight = 0
+        self.quarantined_until = 0.0
+        self.quota_exhausted = False
+        self.requests = 0
+        self.tokens = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.last_error = None
+        # (monotonic time, tokens) per request sent in the last USAGE_WINDOW_SECONDS
+        self._usage = deque()
+
+    @property
+    def client(self):
+        # Imported here so the pool can be built before google.genai is loaded
+        from gemini_client import get_client
+        return get_client(self.api_key)
+
+    def record(self, now, tokens):
+        self._usage.append((now, tokens))
+
+    def _trim(self, now):
+        while self._usage and self._usage[0][0] <= now - USAGE_WINDOW_SECONDS:
+            self._usage.popleft()
+
+    def usage(self, now):
+        """
+        (requests, tokens) sent in the last minute
+        """
+        self._trim(now)
+        return len(self._usage), sum(tokens for _, tokens in self._usage)
+
+    def load(self, now):
+        """
+        Share of this key's per-minute capacity in use, in flight included
+        """
+        requests, tokens = self.usage(now)
+        return max((requests + self.in_flight) / self.rpm, tokens / self.tpm)
+
+
+def parse_keys(raw, rpm=DEFAULT_RPM, tpm=DEFAULT_TPM):
+    """
+    Parse comma-separated ``[label=]key[@rpm]`` entries into ApiKey objects
+    """
+    keys = []
+    for entry in (part.strip() for part in raw.split(",")):
+        if not entry:
+            continue
+        label, _, key = entry.rpartition("=")
+        key, _, key_rpm = key.partition("@")
+        keys.append(ApiKey(key.strip(), label.strip() or None, float(key_rpm) if key_rpm else rpm, tpm))
+    return keys
+
+
+class KeyPool:
+    """
+    Weighted least-loaded routing over API keys, with 429 quarantine
+    """
+
+    def __init__(self, keys, quarantine_seconds=DEFAULT_QUARANTINE_SECONDS,
+                 quota_quarantine_seconds=DEFAULT_QUOTA_QUARANTINE_SECONDS, max_wait_seconds=DEFAULT_MAX_WAIT_SECONDS):
+        self.keys = list(keys)
+        self.quarantine_seconds = quarantine_seconds
+        self.quota_quarantine_seconds = quota_quarantine_seconds
+        self.max_wait_seconds = max_wait_seconds
+        self.switches = 0
+        self._lock = threading.Lock()
+        METRICS.add_collector(self._gauges)
+
+    @classmethod
+    def from_env(cls):
+        """
+        Build from GEMINI_API_KEYS (or the single GEMINI_API_KEY), VTRYON_RPM and VTRYON_TPM per key,
+        VTRYON_KEY_QUARANTINE, VTRYON_KEY_QUOTA_QUARANTINE and VTRYON_KEY_MAX_WAIT
+        """
+        rpm = float(os.getenv("VTRYON_RPM", DEFAULT_RPM))
+        tpm = float(os.getenv("VTRYON_TPM", DEFAULT_TPM))
+        raw = os.getenv("GEMINI_API_KEYS") or os.getenv("GEMINI_API_KEY") or ""
+        return cls(
+            parse_keys(raw, rpm, tpm),
+            quarantine_seconds=float(os.getenv("VTRYON_KEY_QUARANTINE", DEFAULT_QUARANTINE_SECONDS)),
+            quota_quarantine_seconds=float(os.getenv("VTRYON_KEY_QUOTA_QUARANTINE",
+                                                     DEFAULT_QUOTA_QUARANTINE_SECONDS)),
+            max_wait_seconds=float(os.getenv("VTRYON_KEY_MAX_WAIT", DEFAULT_MAX_WAIT_SECONDS)),
+        )
+
+    @property
+    def active(self):
+        """Whether requests are balanced over several keys (one key keeps the shared limiter only)"""
+        return len(self.keys) > 1
+
+    @property
+    def total_rpm(self):
+        return sum(key.rpm for key in self.keys)
+
+    @property
+    def total_tpm(self):
+        return sum(key.tpm for key in self.keys)
+
+    def choose(self, tokens=0, exclude=()):
+        """
+        The key for the next attempt
+
+        Healthy keys outside exclude come first, least loaded by weight. With
+        none left, None is returned when exclude was given (the caller has
+        another way to go on). Otherwise the key released from quarantine
+        soonest is returned if that is within max_wait_seconds (its limiter
+        holds the request until then), and KeysExhausted is raised if not.
+        """
+        now = time.monotonic()
+        with self._lock:
+            healthy = [key for key in self.keys if key.quarantined_until <= now and key not in exclude]
+            if healthy:
+                return min(healthy, key=lambda key: (key.limiter.current_wait(tokens) > 0, key.load(now)))
+            if exclude or not self.keys:
+                return None
+            soonest = min(self.keys, key=lambda key: key.quarantined_until)
+            wait = soonest.quarantined_until - now
+            quota = all(key.quota_exhausted for key in self.keys)
+        if wait > self.max_wait_seconds:
+            logger.warning("🔑 All %d API keys are rate limited; the first is back in %.0fs", len(self.keys), wait)
+            raise KeysExhausted(wait, quota=quota)
+        logger.info("🔑 All API keys are rate limited; waiting %.1fs for %s", wait, soonest.label)
+        return soonest
+
+    def begin(self, key, tokens=0):
+        """
+        Count a request about to be sent with key
+        """
+        with self._lock:
+            key.in_flight += 1
+            key.requests += 1
+            key.record(time.monotonic(), tokens)
+
+    def finish(self, key, error=None, tokens=None):
+        """
+        Account the end of a request started with begin(); quarantines the key on 429
+        """
+        kind = classify_error(error) if error is not None else None
+        with self._lock:
+            key.in_flight = max(0, key.in_flight - 1)
+            if tokens:
+                key.tokens += tokens
+            if error is not None:
+                key.errors += 1
+                key.last_error = str(error)[:200]
+        if tokens:
+            METRICS.inc(TOKENS_METRIC, tokens, key=key.label)
+        METRICS.inc(REQUESTS_METRIC, key=key.label,
+                    outcome="ok" if error is None else "rate_limited" if kind == RATE_LIMIT else "error")
+        if kind == RATE_LIMIT:
+            self.quarantine(key, error)
+
+    def release(self, key):
+        """
+        A request started with begin() ended without an outcome (cancelled, or never sent)
+        """
+        with self._lock:
+            key.in_flight = max(0, key.in_flight - 1)
+
+    def quarantine(self, key, error=None):
+        """
+        Take key out of rotation after a 429; its limiter holds back anyone still routed to it
+        """
+        quota = error is not None and is_quota_error(error)
+        if quota:
+            seconds = self.quota_quarantine_seconds
+        else:
+            hint = retry_after_seconds(error) if error is not None else None
+            seconds = hint if hint is not None else self.quarantine_seconds
+        with self._lock:
+            key.rate_limited += 1
+            now = time.monotonic()
+            if key.quarantined_until <= now:
+                key.quota_exhausted = quota
+            else:
+                key.quota_exhausted = key.quota_exhausted or quota
+            key.quarantined_until = max(key.quarantined_until, now + seconds)
+        key.limiter.pause(seconds)
+        logger.warning("🔑 API key %s rate limited, out of rotation for %.0fs: %s", key.label, seconds, error)
+
+    def switch(self, key, next_key, error):
+        """
+        Count moving an attempt from key to next_key after a 429
+        """
+        with self._lock:
+            self.switches += 1
+        METRICS.inc(SWITCH_METRIC, **{"from": key.label, "to": next_key.label})
+        logger.info("🔑 Switching from %s to %s after %s", key.label, next_key.label, error)
+
+    def stats(self):
+        """
+        Per-key usage and health for display, in configured order
+        """
+        now = time.monotonic()
+        with self._lock:
+            rows = []
+            for key in self.keys:
+                requests, tokens = key.usage(now)
+                rows.append({
+                    "key": key.label,
+                    "healthy": key.quarantined_until <= now,
+                    "quarantined_for": max(0.0, key.quarantined_until - now),
+                    "in_flight": key.in_flight,
+                    "rpm": key.rpm,
+                    "tpm": key.tpm,
+                    "requests_last_minute": requests,
+                    "tokens_last_minute": tokens,
+                    "utilization": key.load(now),
+                    "requests": key.requests,
+                    "errors": key.errors,
+                    "rate_limited": key.rate_limited,
+                })
+            return rows
+
+    def utilization(self):
+        """
+        Requests in the last minute plus in flight, over the healthy keys' combined rpm
+        """
+        rows = self.stats()
+        capacity = sum(row["rpm"] for row in rows if row["healthy"])
+        used = sum(row["requests_last_minute"] + row["in_flight"] for row in rows)
+        return used / capacity if capacity else 1.0
+
+    def _gauges(self):
+        if not self.active:
+            return []
+        samples = []
+        for row in self.stats():
+            labels = {"key": row["key"]}
+            samples.append((IN_FLIGHT_METRIC, labels, row["in_flight"]))
+            samples.append((UTILIZATION_METRIC, labels, row["utilization"]))
+            samples.append((QUARANTINED_METRIC, labels, 0 if row["healthy"] else 1))
+        return samples
+
+
+_key_pool = None
+_key_pool_lock = threading.Lock()
+
+
+def get_key_pool():
+    """
+    Return the process-wide KeyPool configured from the environment
+    """
+    global _key_pool
+    with _key_pool_lock:
+        if _key_pool is None:
+            _key_pool = KeyPool.from_env()
+        return _key_pool
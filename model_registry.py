@@ -0,0 +1,350 @@
+"""
+Model registry with cached discovery, live health stats and failover.
+
+Listing models is a network round trip, so the discovered models and their
+capabilities are cached on disk (DEFAULT_REGISTRY_PATH) and only refreshed
+after ttl_seconds. If discovery fails, the last cached list is used, or the
+preferred models when there is none.
+
+Every real call records its outcome and latency per model in a rolling
+window. A model is degraded after failure_threshold consecutive failures,
+or when its error rate over the window reaches error_rate_threshold; it is
+then skipped for cooldown_seconds and tried again after that.
+
+choose() routes a request to the fastest healthy image-capable model by
+median latency. Models without samples yet rank after measured ones, in
+preference order, so the preferred model takes traffic first. Other
+models are measured after a failover, and every explore_every-th request
+goes to a healthy model without samples, so a recovered model can win
+its traffic back. A failed attempt moves on to the next model instead of
+retrying the same one.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import asdict, dataclass, field
+
+from rate_limiter import FATAL, RETRYABLE
+from telemetry import METRICS, percentile
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = "gemini-2.5-flash-image-preview"
+DEFAULT_REGISTRY_PATH = os.path.join(".cache", "models.json")
+DEFAULT_TTL_SECONDS = 24 * 3600
+DEFAULT_WINDOW = 50
+DEFAULT_FAILURE_THRESHOLD = 3
+DEFAULT_ERROR_RATE_THRESHOLD = 0.5
+DEFAULT_COOLDOWN_SECONDS = 60.0
+# Fewest samples before the error rate alone can degrade a model
+MIN_SAMPLES = 4
+# How long to wait before retrying discovery after it failed
+DISCOVERY_RETRY_SECONDS = 300
+# Every Nth request goes to a healthy model with no latency samples, so it gets measured
+DEFAULT_EXPLORE_EVERY = 20
+
+FAILOVER_METRIC = "vtryon_model_failovers_total"
+
+
+@dataclass
+class ModelInfo:
+    """One discovered model and what it can do"""
+    name: str
+    display_name: str = ""
+    actions: list = field(default_factory=list)
+    image_output: bool = False
+
+
+def supports_image_output(name, actions):
+    """
+    Whether a model can return images from generateContent
+
+    The list API does not report output modalities, so this goes by the
+    naming of Gemini's image models (e.g. gemini-2.5-flash-image-preview,
+    gemini-2.0-flash-preview-image-generation); Imagen uses predict instead.
+    """
+    return "generateContent" in actions and "image" in name and not name.startswith("imagen")
+
+
+class ModelStats:
+    """
+    Rolling outcome and latency window for one model
+    """
+
+    def __init__(self, window=DEFAULT_WINDOW):
+        self.window = deque(maxlen=window)
+        self.consecutive_failures = 0
+        self.degraded_until = 0.0
+        self.calls = 0
+        self.failures = 0
+        self.last_error = None
+
+    def record(self, ok, latency=None, error=None):
+        self.calls += 1
+        self.window.append((ok, latency))
+        if ok:
+            self.consecutive_failures = 0
+        else:
+            self.failures += 1
+            self.consecutive_failures += 1
+            self.last_error = str(error)[:200] if error is not None else None
+
+    @property
+    def error_rate(self):
+        if not self.window:
+            return 0.0
+        return sum(1 for ok, _ in self.window if not ok) / len(self.window)
+
+    @property
+    def median_latency(self):
+        latencies = [latency for ok, latency in self.window if ok and latency is not None]
+        return percentile(latencies, 50) if latencies else None
+
+
+class ModelRegistry:
+    """
+    Cached model discovery plus per-model health for routing and failover
+    """
+
+    def __init__(self, path=DEFAULT_REGISTRY_PATH, ttl_seconds=DEFAULT_TTL_SECONDS, preferred=(DEFAULT_MODEL,),
+                 pinned=None, window=DEFAULT_WINDOW, failure_threshold=DEFAULT_FAILURE_THRESHOLD,
+                 error_rate_threshold=DEFAULT_ERROR_RATE_THRESHOLD, cooldown_seconds=DEFAULT_COOLDOWN_SECONDS,
+                 explore_every=DEFAULT_EXPLORE_EVERY):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.preferred = list(preferred)
+        # With pinned models, discovery is skipped and only these are used
+        self.pinned = list(pinned) if pinned else None
+        self.window = window
+        self.failure_threshold = failure_threshold
+        self.error_rate_threshold = error_rate_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.explore_every = explore_every
+        self._chosen = 0
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._models = None
+        self._fetched = 0.0
+        self._retry_after = 0.0
+        self._stats = {}
+        self.failovers = 0
+
+    @classmethod
+    def from_env(cls):
+        """
+        Build from VTRYON_MODELS (pinned, comma-separated, in preference order), VTRYON_MODEL_REGISTRY,
+        VTRYON_MODEL_TTL and VTRYON_MODEL_COOLDOWN
+        """
+        pinned = [name.strip() for name in os.getenv("VTRYON_MODELS", "").split(",") if name.strip()]
+        return cls(
+            path=os.getenv("VTRYON_MODEL_REGISTRY", DEFAULT_REGISTRY_PATH),
+            ttl_seconds=float(os.getenv("VTRYON_MODEL_TTL", DEFAULT_TTL_SECONDS)),
+            preferred=pinned or (DEFAULT_MODEL,),
+            pinned=pinned,
+            cooldown_seconds=float(os.getenv("VTRYON_MODEL_COOLDOWN", DEFAULT_COOLDOWN_SECONDS)),
+        )
+
+    # Discovery
+
+    def _load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+            return [ModelInfo(**entry) for entry in data["models"]], data["fetched"]
+        except (OSError, ValueError, KeyError, TypeError):
+            return None, 0.0
+
+    def _save(self, models, fetched):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"fetched": fetched, "models": [asdict(m) for m in models]}, f, indent=1)
+        os.replace(tmp, self.path)
+
+    def _fallback(self):
+        return [ModelInfo(name, actions=["generateContent"], image_output=True) for name in self.preferred]
+
+    def refresh(self, client):
+        """
+        List models from the API now and rewrite the disk cache; returns the models
+        """
+        models = []
+        for model in client.models.list():
+            name = model.name.removeprefix("models/")
+            actions = list(model.supported_actions or [])
+            models.append(ModelInfo(name, model.display_name or "", actions, supports_image_output(name, actions)))
+        fetched = time.time()
+        self._save(models, fetched)
+        with self._lock:
+            self._models, self._fetched = models, fetched
+        logger.info("📋 Discovered %d models (%d image-capable)", len(models), sum(m.image_output for m in models))
+        return models
+
+    def models(self, client=None):
+        """
+        Known models: from memory, else the disk cache, refreshed through client once older than the TTL
+        """
+        if self.pinned:
+            return self._fallback()
+        with self._lock:
+            models, fetched = self._models, self._fetched
+        if models is None:
+            models, fetched = self._load()
+            with self._lock:
+                # An empty list marks "nothing on disk" so the file is not re-read every call
+                self._models, self._fetched = models or [], fetched
+        if time.time() - fetched < self.ttl_seconds or client is None:
+            return models or self._fallback()
+        # One caller refreshes; the rest keep using the stale list meanwhile
+        if time.monotonic() < self._retry_after or not self._refresh_lock.acquire(blocking=False):
+            return models or self._fallback()
+        try:
+            return self.refresh(client)
+        except Exception as e:
+            self._retry_after = time.monotonic() + DISCOVERY_RETRY_SECONDS
+            logger.warning("⚠️ Model discovery failed, using %s: %s", "cached list" if models else "defaults", e)
+            return models or self._fallback()
+        finally:
+            self._refresh_lock.release()
+
+    def image_models(self, client=None):
+        """
+        Names of image-capable models, preferred ones first
+        """
+        names = [m.name for m in self.models(client) if m.image_output]
+        rank = {name: i for i, name in enumerate(self.preferred)}
+        names.sort(key=lambda name: rank.get(name, len(rank)))
+        return names or list(self.preferred)
+
+    @property
+    def fetched_at(self):
+        """Wall-clock time the model list was last fetched (0 if never)"""
+        return self._fetched
+
+    # Health and routing
+
+    def _stats_for(self, model):
+        stats = self._stats.get(model)
+        if stats is None:
+            stats = self._stats[model] = ModelStats(self.window)
+        return stats
+
+    def record(self, model, ok, latency=None, error=None):
+        """
+        Record one real call's outcome and, on success, its latency in seconds
+        """
+        with self._lock:
+            stats = self._stats_for(model)
+            stats.record(ok, latency, error)
+            if ok:
+                stats.degraded_until = 0.0
+                return
+            degraded = stats.consecutive_failures >= self.failure_threshold or (
+                len(stats.window) >= MIN_SAMPLES and stats.error_rate >= self.error_rate_threshold)
+            if degraded:
+                stats.degraded_until = time.monotonic() + self.cooldown_seconds
+        if degraded:
+            logger.warning("🩺 Model %s degraded for %.0fs (error rate %.0f%%): %s",
+                           model, self.cooldown_seconds, stats.error_rate * 100, error)
+
+    def healthy(self, model):
+        with self._lock:
+            stats = self._stats.get(model)
+            return stats is None or stats.degraded_until <= time.monotonic()
+
+    def candidates(self, client=None):
+        """
+        Image-capable models in routing order: healthy by median latency, then degraded
+        """
+        names = self.image_models(client)
+        now = time.monotonic()
+        with self._lock:
+            def key(item):
+                rank, name = item
+                stats = self._stats.get(name)
+                degraded = stats is not None and stats.degraded_until > now
+                latency = stats.median_latency if stats is not None else None
+                return degraded, latency is None, latency or 0.0, rank
+            return [name for _, name in sorted(enumerate(names), key=key)]
+
+    def choose(self, client=None, exclude=()):
+        """
+        The model for the next attempt, skipping models in exclude; None if every model is excluded
+        """
+        ordered = self.candidates(client)
+        if not exclude and self.explore_every:
+            with self._lock:
+                self._chosen += 1
+                explore = self._chosen % self.explore_every == 0
+            if explore:
+                for name in ordered:
+                    stats = self._stats.get(name)
+                    if self.healthy(name) and (stats is None or stats.median_latency is None):
+                        return name
+        for name in ordered:
+            if name not in exclude:
+                return name
+        return None
+
+    def failover(self, model, next_model, error):
+        """
+        Count a switch from model to next_model after a failed attempt
+        """
+        with self._lock:
+            self.failovers += 1
+        METRICS.inc(FAILOVER_METRIC, **{"from": model, "to": next_model})
+        logger.warning("🔀 %s failed (%s), failing over to %s", model, error, next_model)
+
+    def stats(self):
+        """
+        Per-model health for display, in routing order
+        """
+        now = time.monotonic()
+        order = self.candidates()
+        with self._lock:
+            rows = []
+            for name in order:
+                stats = self._stats.get(name) or ModelStats(self.window)
+                rows.append({
+                    "model": name,
+                    "healthy": stats.degraded_until <= now,
+                    "calls": stats.calls,
+                    "failures": stats.failures,
+                    "error_rate": stats.error_rate,
+                    "median_latency": stats.median_latency,
+                    "last_error": stats.last_error,
+                })
+            return rows
+
+
+def is_model_fault(kind, exc):
+    """
+    Whether a failed attempt says something about the model rather than the request
+
+    Server errors and timeouts count against the model. Rate limits do
+    not: the quota is per key or project, so switching models only burns
+    through them; they go through key failover or the shared limiter
+    pause instead. Client errors (bad image, bad prompt) would fail on
+    every model, except a 404, which means the model itself is gone.
+    """
+    if kind == RETRYABLE:
+        return True
+    return kind == FATAL and getattr(exc, "code", None) == 404
+
+
+_model_registry = None
+_model_registry_lock = threading.Lock()
+
+
+def get_model_registry():
+    """
+    Return the process-wide ModelRegistry configured from the environment
+    """
+    global _model_registry
+    with _model_registry_lock:
+        if _model_registry is None:
+            _model_registry = ModelRegistry.from_env()
+        return _model_registry
@@ -0,0 +1,175 @@
+"""
+Decode-once output stage for generated images.
+
+The model returns each image as encoded bytes (usually PNG). The page needs
+it several ways: a display-size version, a history thumbnail and a download
+file. GeneratedImage decodes the payload at most once and derives every
+other form from that one decoded image, lazily and memoized per form:
+
+* display(): JPEG no larger than DISPLAY_MAX_SIDE, or the original bytes
+  when they are already small enough and in a browser format
+* thumbnail(): the history thumbnail (history_store.make_thumbnail)
+* download(fmt, quality): the original bytes, or a WebP/JPEG/PNG transcode
+  computed only when that format is first requested
+
+The encoded payload is kept as given and exposed as a memoryview, so
+hashing, writing to disk and slicing it never copy the buffer.
+"""
+import io
+import os
+import threading
+from dataclasses import dataclass
+
+from PIL import Image
+
+from history_store import make_thumbnail
+from telemetry import span
+
+DISPLAY_MAX_SIDE = int(os.getenv("VTRYON_DISPLAY_SIZE", 1024))
+DISPLAY_QUALITY = 90
+
+# Download choices: Pillow format, MIME type, file extension, lossy
+DOWNLOAD_FORMATS = {
+    "png": ("PNG", "image/png", "png", False),
+    "jpeg": ("JPEG", "image/jpeg", "jpg", True),
+    "webp": ("WEBP", "image/webp", "webp", True),
+}
+DEFAULT_DOWNLOAD_QUALITY = 90
+
+_MAGIC = (
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"\xff\xd8\xff", "jpeg"),
+)
+
+
+def sniff_format(data):
+    """
+    Format of encoded image bytes from their header (png, jpeg, webp), or None
+    """
+    head = bytes(memoryview(data)[:12])
+    for magic, name in _MAGIC:
+        if head.startswith(magic):
+            return name
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+@dataclass
+class Download:
+    """One download file: the bytes, their MIME type and a file extension"""
+    data: bytes
+    mime_type: str
+    extension: str
+
+
+class GeneratedImage:
+    """
+    One generated image, decoded at most once, with memoized derived forms
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.format = sniff_format(data)
+        self._image = None
+        self._display = {}
+        self._thumbnail = None
+        self._downloads = {}
+        self._lock = threading.Lock()
+
+    @property
+    def view(self):
+        """The encoded payload as a zero-copy memoryview"""
+        return memoryview(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def image(self):
+        """
+        Decoded PIL image, shared by every derived form; treat it as read-only
+        """
+        with self._lock:
+            if self._image is None:
+                with span("output_decode", payload_bytes=len(self.data)):
+                    image = Image.open(io.BytesIO(self.data))
+                    image.load()
+                self._image = image
+            return self._image
+
+    @property
+    def size(self):
+        return self.image().size
+
+    def display(self, max_side=DISPLAY_MAX_SIDE):
+        """
+        Encoded bytes to show on the page, at most max_side pixels on the long edge
+        """
+        with self._lock:
+            cached = self._display.get(max_side)
+        if cached is not None:
+            return cached
+        image = self.image()
+        if max(image.size) <= max_side and self.format in DOWNLOAD_FORMATS:
+            data = self.data
+        else:
+            preview = image.copy()
+            preview.thumbnail((max_side, max_side))
+            if preview.mode != "RGB":
+                preview = preview.convert("RGB")
+            data = _encode(preview, "JPEG", DISPLAY_QUALITY)
+        with self._lock:
+            self._display[max_side] = data
+        return data
+
+    def thumbnail(self):
+        """
+        Small JPEG for the history list, made from the shared decoded image
+        """
+        if self._thumbnail is None:
+            self._thumbnail = make_thumbnail(self.image())
+        return self._thumbnail
+
+    def download(self, fmt="original", quality=DEFAULT_DOWNLOAD_QUALITY):
+        """
+        Download for fmt ("original" or a DOWNLOAD_FORMATS key), transcoded on first request
+        """
+        if fmt == "original" or (fmt == self.format and not DOWNLOAD_FORMATS[fmt][3]):
+            name = self.format or "png"
+            _, mime_type, extension, _ = DOWNLOAD_FORMATS.get(name, DOWNLOAD_FORMATS["png"])
+            return Download(self.data, mime_type, extension)
+        if fmt not in DOWNLOAD_FORMATS:
+            raise ValueError(f"Unknown download format {fmt!r}; choose from original, {', '.join(DOWNLOAD_FORMATS)}")
+        pil_format, mime_type, extension, lossy = DOWNLOAD_FORMATS[fmt]
+        key = (fmt, quality if lossy else None)
+        with self._lock:
+            cached = self._downloads.get(key)
+        if cached is not None:
+            return cached
+        image = self.image()
+        if pil_format == "JPEG" and image.mode != "RGB":
+            image = image.convert("RGB")
+        with span("transcode", payload_bytes=len(self.data), format=fmt):
+            data = _encode(image, pil_format, quality if lossy else None)
+        download = Download(data, mime_type, extension)
+        with self._lock:
+            self._downloads[key] = download
+        return download
+
+
+def _encode(image, pil_format, quality=None):
+    buffer = io.BytesIO()
+    if pil_format == "PNG":
+        image.save(buffer, format="PNG", optimize=False)
+    elif pil_format == "WEBP":
+        image.save(buffer, format="WEBP", quality=quality, method=4)
+    else:
+        image.save(buffer, format=pil_format, quality=quality, optimize=True)
+    return buffer.getvalue()
+
+
+def decode_outputs(images):
+    """
+    Wrap generated image bytes as GeneratedImage objects (decoding stays lazy)
+    """
+    return [GeneratedImage(data) for data in images]
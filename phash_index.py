@@ -0,0 +1,270 @@
+"""
+Perceptual-hash index for reusing results of near-duplicate captures.
+
+Camera frames of the same pose and item are almost never byte-identical, so
+the exact-hash ResultCache misses on a recapture. This index stores a 64-bit
+perceptual hash of every photo that produced a result, partitioned by
+request context (model, prompt and config, so style and custom prompt must
+match). A new capture within ``max_distance`` bits of an earlier one maps to
+that earlier result's cache key. find() confirms the result is still in the
+cache before counting a hit; entries whose result has been evicted or has
+expired are dropped (and a tombstone appended) so they cannot shadow a
+valid match further away.
+
+Each context keeps its hashes in a contiguous numpy uint64 array; a lookup
+is one vectorized XOR + popcount over that array, which stays well under a
+millisecond at tens of thousands of entries and needs no tree rebalancing.
+Entries are appended to a JSONL file so the index survives restarts.
+"""
+import hashlib
+import json
+import os
+import threading
+from dataclasses import dataclass
+
+import cv2
+import numpy as np
+
+DEFAULT_INDEX_PATH = os.path.join(".cache", "phash_index.jsonl")
+DEFAULT_MAX_DISTANCE = 4
+HASH_METHODS = ("phash", "dhash")
+
+if hasattr(np, "bitwise_count"):
+    def _popcount(values):
+        return np.bitwise_count(values)
+else:
+    _POPCOUNT_16 = np.array([bin(i).count("1") for i in range(1 << 16)], dtype=np.uint8)
+
+    def _popcount(values):
+        return _POPCOUNT_16[values.view(np.uint16)].reshape(-1, 4).sum(axis=1)
+
+
+def _bits_to_int(bits):
+    return int(np.packbits(bits.astype(np.uint8).ravel()).view(">u8")[0])
+
+
+def _decode_gray(img_bytes):
+    # Decode at 1/8 scale where the codec supports it; the hash only needs 32x32
+    buf = np.frombuffer(img_bytes, dtype=np.uint8)
+    gray = cv2.imdecode(buf, cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if gray is None:
+        raise ValueError("could not decode image for perceptual hashing")
+    return gray
+
+
+def phash(gray):
+    """
+    64-bit DCT perceptual hash of a grayscale uint8 array
+    """
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8]
+    # Ignore the DC term when choosing the threshold
+    median = np.median(low.ravel()[1:])
+    return _bits_to_int(low > median)
+
+
+def dhash(gray):
+    """
+    64-bit difference hash of a grayscale uint8 array
+    """
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    return _bits_to_int(small[:, 1:] > small[:, :-1])
+
+
+def hash_image_bytes(img_bytes, method="phash"):
+    """
+    Perceptual hash of encoded image bytes (JPEG/PNG/WebP)
+    """
+    if method not in HASH_METHODS:
+        raise ValueError(f"Unknown hash method {method!r}; choose from {', '.join(HASH_METHODS)}")
+    gray = _decode_gray(img_bytes)
+    return phash(gray) if method == "phash" else dhash(gray)
+
+
+def context_key(prompt, model, config):
+    """
+    Hash of everything except the photo that determines the model output
+    """
+    h = hashlib.sha256()
+    config_json = config.model_dump_json(exclude_none=True) if config is not None else ""
+    for part in (model, prompt, config_json):
+        data = part.encode()
+        h.update(len(data).to_bytes(8, "big"))
+        h.update(data)
+    return h.hexdigest()
+
+
+@dataclass
+class Match:
+    """Nearest earlier capture found for a lookup"""
+    key: str
+    distance: int
+
+
+class _Bucket:
+    """Growable uint64 array of hashes with their result keys"""
+
+    def __init__(self):
+        self.hashes = np.empty(64, dtype=np.uint64)
+        self.keys = []
+
+    def add(self, value, key):
+        n = len(self.keys)
+        if n == len(self.hashes):
+            self.hashes = np.resize(self.hashes, n * 2)
+        self.hashes[n] = value
+        self.keys.append(key)
+
+    def remove(self, key):
+        keep = [i for i, existing in enumerate(self.keys) if existing != key]
+        if len(keep) == len(self.keys):
+            return False
+        self.hashes[:len(keep)] = self.hashes[keep]
+        self.keys = [self.keys[i] for i in keep]
+        return True
+
+    def nearest(self, value):
+        n = len(self.keys)
+        if n == 0:
+            return None
+        distances = _popcount(self.hashes[:n] ^ np.uint64(value))
+        i = int(distances.argmin())
+        return Match(self.keys[i], int(distances[i]))
+
+
+class PerceptualIndex:
+    """
+    Context-partitioned perceptual-hash index persisted as append-only JSONL
+    """
+
+    def __init__(self, path=DEFAULT_INDEX_PATH, max_distance=DEFAULT_MAX_DISTANCE, method="phash"):
+        self.path = path
+        self.max_distance = max_distance
+        self.method = method
+        self.hits = 0
+        self.misses = 0
+        self._buckets = {}
+        self._seen = set()
+        self._lock = threading.Lock()
+        if path:
+            self._load()
+
+    @classmethod
+    def from_env(cls):
+        """
+        Build an index configured from VTRYON_SIMILAR_* environment variables
+        """
+        return cls(
+            path=os.getenv("VTRYON_SIMILAR_INDEX", DEFAULT_INDEX_PATH),
+            max_distance=int(os.getenv("VTRYON_SIMILAR_MAX_DISTANCE", DEFAULT_MAX_DISTANCE)),
+            method=os.getenv("VTRYON_SIMILAR_METHOD", "phash"),
+        )
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    if entry.get("removed"):
+                        self._remove_locked(entry["key"])
+                    elif entry.get("method", "phash") == self.method:
+                        self._add_locked(int(entry["hash"], 16), entry["context"], entry["key"])
+                except (ValueError, KeyError, TypeError, AttributeError):
+                    # Torn or hand-edited line: skip it rather than fail at startup
+                    continue
+
+    def _add_locked(self, value, context, key):
+        marker = (value, context, key)
+        if marker in self._seen:
+            return False
+        self._seen.add(marker)
+        self._buckets.setdefault(context, _Bucket()).add(value, key)
+        return True
+
+    def _remove_locked(self, key):
+        removed = False
+        for context, bucket in list(self._buckets.items()):
+            if bucket.remove(key):
+                removed = True
+                if not bucket.keys:
+                    del self._buckets[context]
+        self._seen = {marker for marker in self._seen if marker[2] != key}
+        return removed
+
+    def _append(self, entry):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+
+    def hash_bytes(self, img_bytes):
+        return hash_image_bytes(img_bytes, self.method)
+
+    @staticmethod
+    def context_key(prompt, model, config):
+        return context_key(prompt, model, config)
+
+    def add(self, value, context, key):
+        """
+        Record that the photo with this hash produced the result stored under key
+        """
+        with self._lock:
+            if not self._add_locked(value, context, key) or not self.path:
+                return
+            self._append({"hash": f"{value:016x}", "context": context, "key": key, "method": self.method})
+
+    def remove(self, key):
+        """
+        Forget every photo mapped to the result stored under key (it is no longer cached)
+        """
+        with self._lock:
+            if not self._remove_locked(key) or not self.path:
+                return
+            self._append({"key": key, "removed": True})
+
+    def lookup(self, value, context, max_distance=None):
+        """
+        Return the nearest Match within max_distance bits in the same context, or None
+        """
+        limit = self.max_distance if max_distance is None else max_distance
+        with self._lock:
+            bucket = self._buckets.get(context)
+            match = bucket.nearest(value) if bucket is not None else None
+        if match is None or match.distance > limit:
+            return None
+        return match
+
+    def find(self, value, context, fetch, max_distance=None):
+        """
+        Return (Match, data) for the nearest match whose result fetch(key) still returns, else (None, None)
+
+        Matches whose result is gone are removed and the search goes on, and
+        only a match with data counts as a hit.
+        """
+        while True:
+            match = self.lookup(value, context, max_distance)
+            data = fetch(match.key) if match is not None else None
+            if data is not None:
+                with self._lock:
+                    self.hits += 1
+                return match, data
+            if match is None:
+                with self._lock:
+                    self.misses += 1
+                return None, None
+            self.remove(match.key)
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(bucket.keys) for bucket in self._buckets.values())
+
+    def stats(self):
+        return {
+            "entries": len(self),
+            "contexts": len(self._buckets),
+            "hits": self.hits,
+            "misses": self.misses,
+            "max_distance": self.max_distance,
+            "method": self.method,
+        }
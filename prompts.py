@@ -0,0 +1,354 @@
+"""
+Versioned prompt templates and server-side context caching of their fixed prefix.
+
+Each PromptTemplate is split once, at registration, into an instruction
+prefix that never changes and a short suffix holding the per-call fields
+(the style preference). Rendering is a single format of the suffix.
+
+For templates marked cacheable, ContextCache uploads the prefix once per
+client and model with ``client.caches.create`` and hands back the cache
+name. Requests then send only the photo and the suffix and reference the
+prefix through ``cached_content``. Explicit caching has a minimum size
+(about 1k tokens on Flash models), so prefixes estimated below min_tokens
+are never uploaded. It is not offered for every model either, so failures
+are remembered for a while and requests fall back to sending the full
+prompt inline, exactly as before.
+"""
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+
+from rate_limiter import estimate_tokens
+from telemetry import METRICS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TEMPLATE = "tryon"
+DEFAULT_CACHE_TTL_SECONDS = 3600
+# Refresh a cache handle this long before the server expires it
+CACHE_REFRESH_MARGIN_SECONDS = 120
+# After a failed create, wait this long before trying again
+CACHE_RETRY_SECONDS = 1800
+# Smallest prefix the API accepts as cached content (Flash models)
+MIN_CACHE_TOKENS = 1024
+
+CACHED_TOKENS_METRIC = "vtryon_cached_prompt_tokens_total"
+
+
+@dataclass(frozen=True)
+class PromptTemplate:
+    """
+    A named, versioned prompt: fixed prefix plus a suffix format string
+
+    The suffix may use ``{style}``; the prefix is sent verbatim.
+    """
+    name: str
+    version: str
+    prefix: str
+    suffix: str
+    cacheable: bool = True
+
+    @property
+    def key(self):
+        return f"{self.name}@{self.version}"
+
+    def render_suffix(self, style_preference):
+        return self.suffix.format(style=style_preference)
+
+    def render(self, style_preference):
+        return self.prefix + self.render_suffix(style_preference)
+
+
+class PromptRegistry:
+    """
+    Templates by name and version; the active version per name comes from
+    VTRYON_PROMPT_VERSION or the latest registered
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._templates = {}
+        self._prefixes = {}
+
+    def register(self, template):
+        with self._lock:
+            self._templates.setdefault(template.name, {})[template.version] = template
+            self._prefixes[template.prefix] = template
+        return template
+
+    def versions(self, name):
+        with self._lock:
+            return sorted(self._templates.get(name, {}))
+
+    def get(self, name=DEFAULT_TEMPLATE, version=None):
+        with self._lock:
+            versions = self._templates.get(name)
+            if not versions:
+                raise KeyError(f"Unknown prompt template {name!r}")
+            version = version or os.getenv("VTRYON_PROMPT_VERSION") or max(versions)
+            if version not in versions:
+                raise KeyError(f"Unknown version {version!r} of prompt {name!r}; have {', '.join(sorted(versions))}")
+            return versions[version]
+
+    def match(self, prompt):
+        """
+        Return (template, suffix) if prompt was rendered from a registered template, else None
+        """
+        with self._lock:
+            candidates = list(self._prefixes.items())
+        for prefix, template in candidates:
+            if prompt.startswith(prefix):
+                return template, prompt[len(prefix):]
+        return None
+
+
+REGISTRY = PromptRegistry()
+
+# Original try-on prompt. Sections 1-4 are fixed; only the style section varies.
+# The text, including the whitespace-only lines in section 3, must match the
+# original prompt byte for byte: it is part of every result cache key.
+TRYON_PREFIX_V1 = """
+You are a professional fashion AI photographer. I'm showing you a photo where a person is HOLDING a fashion item in their hand.
+
+CRITICAL TRANSFORMATION TASK:
+Generate a HIGH-QUALITY, REALISTIC image showing the SAME person with the SAME item now properly worn/carried on their body.
+
+DETAILED TRANSFORMATION INSTRUCTIONS:
+
+1. IDENTIFY THE ITEM FIRST:
+   - Look carefully at what they're holding
+   - Note the exact color, material, style, and design
+
+2. REMOVE FROM HAND:
+   - Make their hand completely empty and natural
+   - Hand should be in a relaxed position (not holding anything)
+
+3. PLACE ITEM ON BODY BASED ON TYPE:
+   
+   CLOTHING (shirt, top, dress, jacket, pants, etc.):
+   - Show them WEARING it naturally on their body
+   - Ensure proper fit and draping
+   - Match the exact same clothing item from their hand
+   - Keep realistic proportions and fit
+   
+   BAG/PURSE/BACKPACK:
+   - Position on their shoulder or across body
+   - Or hanging naturally from their arm/hand while walking
+   - Show realistic strap positioning
+   - Maintain the exact same bag design and color
+   
+   SHOES/FOOTWEAR:
+   - Show them wearing the shoes on their FEET
+   - Match their current outfit style
+   - Ensure realistic foot positioning and sizing
+   
+   JEWELRY (necklace, bracelet, watch, ring):
+   - Place on appropriate body part (wrist, neck, finger)
+   - Show natural, comfortable positioning
+   - Maintain exact design and style
+   
+   SUNGLASSES:
+   - Position on their face/nose naturally
+   - Match their face shape
+   - Keep realistic positioning
+   
+   HAT/CAP:
+   - Place on their head naturally
+   - Match their head size and style
+   - Show realistic angle and fit
+
+4. PHOTO REALISM REQUIREMENTS:
+   - Keep EXACT same person (face, body type, skin tone, hair)
+   - Maintain EXACT same background and environment
+   - Preserve lighting conditions and shadows
+   - Keep the same pose and angle
+   - Ensure seamless integration - item should look like it was always there
+   - No visible seams, artifacts, or distortions
+   - Natural shadows and reflections on the item
+
+"""
+
+TRYON_SUFFIX_V1 = """5. STYLE MATCHING:
+   - Style preference: {style}
+   - Ensure the item matches their {style} aesthetic
+   - Coordinate with their existing outfit if applicable
+
+6. QUALITY STANDARDS:
+   - High resolution and sharp details
+   - Natural, professional photography look
+   - Realistic materials and textures
+   - Proper lighting on the item
+   - No AI artifacts or distortions
+
+Generate a photorealistic, seamless virtual try-on image that looks like a professional fashion photograph.
+"""
+
+REGISTRY.register(PromptTemplate(name="tryon", version="v1", prefix=TRYON_PREFIX_V1, suffix=TRYON_SUFFIX_V1))
+
+
+class ContextCacheExpired(RuntimeError):
+    """A request referenced a context cache the server no longer has; retry inline"""
+
+
+@dataclass
+class _Handle:
+    name: str
+    expires: float
+    template: PromptTemplate
+
+
+class ContextCache:
+    """
+    Uploads cacheable template prefixes once per client and model and tracks savings
+    """
+
+    def __init__(self, enabled=True, ttl_seconds=DEFAULT_CACHE_TTL_SECONDS, retry_seconds=CACHE_RETRY_SECONDS,
+                 min_tokens=MIN_CACHE_TOKENS):
+        self.enabled = enabled
+        self.ttl_seconds = ttl_seconds
+        self.retry_seconds = retry_seconds
+        self.min_tokens = min_tokens
+        self._lock = threading.Lock()
+        self._handles = {}
+        self._unavailable = {}
+        self._creating = set()
+        self.cached_requests = 0
+        self.inline_requests = 0
+        self.cached_tokens = 0
+        self.bytes_saved = 0
+        self.creates = 0
+        self.failures = 0
+        self.last_error = None
+
+    @classmethod
+    def from_env(cls):
+        """
+        Build from VTRYON_CONTEXT_CACHE (on/off), VTRYON_CONTEXT_CACHE_TTL (seconds)
+        and VTRYON_CONTEXT_CACHE_MIN_TOKENS
+        """
+        return cls(
+            enabled=os.getenv("VTRYON_CONTEXT_CACHE", "1").lower() not in ("0", "false", "no", "off"),
+            ttl_seconds=int(os.getenv("VTRYON_CONTEXT_CACHE_TTL", DEFAULT_CACHE_TTL_SECONDS)),
+            min_tokens=int(os.getenv("VTRYON_CONTEXT_CACHE_MIN_TOKENS", MIN_CACHE_TOKENS)),
+        )
+
+    def eligible(self, template):
+        """
+        Whether the template's prefix is worth uploading: cacheable and above the API's minimum size
+        """
+        return (self.enabled and template.cacheable
+                and estimate_tokens(template.prefix, input_images=0, output_images=0) >= self.min_tokens)
+
+    def handle(self, client, model, template):
+        """
+        Return a cached_content name for the template's prefix, or None to send it inline
+        """
+        if not self.eligible(template):
+            return None
+        key = (id(client), model, template.key)
+        now = time.monotonic()
+        with self._lock:
+            current = self._handles.get(key)
+            if current is not None and current.expires - CACHE_REFRESH_MARGIN_SECONDS > now:
+                return current.name
+            if self._unavailable.get(key, 0) > now:
+                return None
+            if key in self._creating:
+                # Another request is uploading this prefix; send this one inline rather than wait
+                return None
+            self._creating.add(key)
+        # The upload is a network call, so it runs outside the lock
+        try:
+            name = self._create(client, model, template)
+        except Exception as e:
+            with self._lock:
+                self._creating.discard(key)
+                self.failures += 1
+                self.last_error = str(e)
+                self._unavailable[key] = time.monotonic() + self.retry_seconds
+                self._handles.pop(key, None)
+            logger.warning("⚠️ Context caching unavailable for %s on %s, sending prompts inline: %s",
+                           template.key, model, e)
+            return None
+        with self._lock:
+            self._creating.discard(key)
+            self.creates += 1
+            self._handles[key] = _Handle(name, now + self.ttl_seconds, template)
+        logger.info("🗂️ Cached prompt prefix %s as %s", template.key, name)
+        return name
+
+    def _create(self, client, model, template):
+        from google.genai import types
+
+        cache = client.caches.create(
+            model=model,
+            config=types.CreateCachedContentConfig(
+                contents=[types.Content(role="user", parts=[types.Part.from_text(text=template.prefix)])],
+                ttl=f"{self.ttl_seconds}s",
+                display_name=f"vtryon-{template.key}",
+            ),
+        )
+        return cache.name
+
+    def recover(self, exc, handle):
+        """
+        If exc means the cache behind handle is gone, drop it and return True
+        """
+        from google.genai import errors
+
+        if handle is None or not isinstance(exc, errors.APIError):
+            return False
+        if exc.code not in (400, 403, 404) or "cache" not in (exc.message or "").lower():
+            return False
+        with self._lock:
+            for key, current in list(self._handles.items()):
+                if current.name == handle:
+                    del self._handles[key]
+        logger.warning("⚠️ Context cache %s was rejected, rebuilding: %s", handle, exc.message)
+        return True
+
+    def record(self, handle, template, usage_metadata):
+        """
+        Account one finished request that did (handle set) or did not use the cache
+        """
+        with self._lock:
+            if handle is None:
+                self.inline_requests += 1
+                return
+            tokens = getattr(usage_metadata, "cached_content_token_count", None) or 0
+            self.cached_requests += 1
+            self.cached_tokens += tokens
+            self.bytes_saved += len(template.prefix.encode())
+        if tokens:
+            METRICS.inc(CACHED_TOKENS_METRIC, tokens, template=template.key)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "active": len(self._handles),
+                "cached_requests": self.cached_requests,
+                "inline_requests": self.inline_requests,
+                "cached_tokens": self.cached_tokens,
+                "bytes_saved": self.bytes_saved,
+                "creates": self.creates,
+                "failures": self.failures,
+                "last_error": self.last_error,
+            }
+
+
+_context_cache = None
+_context_cache_lock = threading.Lock()
+
+
+def get_context_cache():
+    """
+    Return the process-wide ContextCache configured from the environment
+    """
+    global _context_cache
+    with _context_cache_lock:
+        if _context_cache is None:
+            _context_cache = ContextCache.from_env()
+        return _context_cache
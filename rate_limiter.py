@@ -0,0 +1,417 @@
+"""
+Process-wide rate limiting and retry policy for Gemini calls.
+
+A single RateLimiter is shared by every session, the async engine and the
+batch CLI. It tracks requests-per-minute and tokens-per-minute with two
+token buckets; callers reserve capacity before each request and wait their
+turn instead of failing. When the server answers 429 the limiter pauses all
+callers for the server's retry-after hint (or an exponential backoff with
+jitter), so concurrent sessions back off together instead of stampeding.
+"""
+import asyncio
+import logging
+import os
+import random
+import re
+import threading
+import time
+
+import cancellation
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RPM = 10
+DEFAULT_TPM = 1_000_000
+
+# Gemini bills each input or output image at a fixed 1290 tokens
+IMAGE_TOKENS = 1290
+
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_CAP_SECONDS = 60.0
+
+# Error classes returned by classify_error
+RATE_LIMIT = "rate_limit"
+RETRYABLE = "retryable"
+FATAL = "fatal"
+
+RETRYABLE_STATUS_CODES = {408, 500, 502, 503, 504}
+
+
+class FailoverError(Exception):
+    """
+    An attempt failed on one model or API key and the next attempt goes to another
+
+    Retry loops move straight on, without backoff or a limiter pause, since
+    the failure is not expected to repeat on the other model or key.
+    """
+
+    def __init__(self, error, model=None, next_model=None):
+        super().__init__(str(error))
+        self.error = error
+        self.model = model
+        self.next_model = next_model
+
+
+class RateLimitExceeded(Exception):
+    """Raised when a request is still rate limited after all retries"""
+
+    def __init__(self, message="Rate limit exceeded. Please try again later.", quota=False):
+        super().__init__(message)
+        self.quota = quota
+
+
+def classify_error(exc):
+    """
+    Classify an exception from the SDK as RATE_LIMIT, RETRYABLE or FATAL
+    """
+    # Imported lazily so importing this module stays cheap
+    import httpx
+    from google.genai import errors
+
+    from key_pool import KeysExhausted
+    from request_policy import CircuitOpenError
+
+    if isinstance(exc, (CircuitOpenError, KeysExhausted)):
+        # Fail fast while the backend is known to be down or no key has quota left
+        return FATAL
+    if isinstance(exc, RateLimitExceeded):
+        return RATE_LIMIT
+    if isinstance(exc, errors.APIError):
+        if exc.code == 429 or exc.status == "RESOURCE_EXHAUSTED":
+            return RATE_LIMIT
+        if exc.code in RETRYABLE_STATUS_CODES or isinstance(exc, errors.ServerError):
+            return RETRYABLE
+        return FATAL
+    if isinstance(exc, (httpx.TransportError, TimeoutError, ConnectionError)):
+        return RETRYABLE
+    if isinstance(exc, (ValueError, TypeError)):
+        return FATAL
+    # Unknown failures were always retried before; keep that behaviour
+    return RETRYABLE
+
+
+def is_quota_error(exc):
+    """
+    True if a rate limit error refers to an exhausted daily or billing quota
+
+    Gemini reports per-minute limits as quota failures too, so only daily
+    quota ids and billing messages count; those will not clear by retrying.
+    """
+    from google.genai import errors
+
+    if isinstance(exc, RateLimitExceeded):
+        return exc.quota
+    if isinstance(exc, errors.APIError):
+        for detail in _error_details(exc):
+            if detail.get("@type", "").endswith("QuotaFailure"):
+                for violation in detail.get("violations", []):
+                    if "PerDay" in violation.get("quotaId", ""):
+                        return True
+        message = (exc.message or "").lower()
+        return "billing" in message or "per day" in message
+    return False
+
+
+def _error_details(exc):
+    body = exc.details if isinstance(exc.details, dict) else {}
+    details = body.get("error", body).get("details", [])
+    return details if isinstance(details, list) else []
+
+
+def _parse_duration(value):
+    match = re.fullmatch(r"\s*([\d.]+)\s*s?\s*", str(value))
+    return float(match.group(1)) if match else None
+
+
+def retry_after_seconds(exc):
+    """
+    Return the server's retry hint for an error in seconds, or None
+    """
+    from google.genai import errors
+
+    if not isinstance(exc, errors.APIError):
+        return None
+    for detail in _error_details(exc):
+        if detail.get("@type", "").endswith("RetryInfo") and "retryDelay" in detail:
+            seconds = _parse_duration(detail["retryDelay"])
+            if seconds is not None:
+                return seconds
+    headers = getattr(exc.response, "headers", None)
+    if headers is not None and headers.get("retry-after"):
+        return _parse_duration(headers.get("retry-after"))
+    return None
+
+
+def backoff_seconds(attempt, base=BACKOFF_BASE_SECONDS, cap=BACKOFF_CAP_SECONDS):
+    """
+    Exponential backoff with full jitter for the given zero-based attempt
+    """
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def estimate_tokens(prompt, input_images=1, output_images=1):
+    """
+    Rough token cost of one try-on request for the TPM bucket
+    """
+    return len(prompt) // 4 + IMAGE_TOKENS * (input_images + output_images)
+
+
+class RateLimiter:
+    """
+    Requests-per-minute and tokens-per-minute limiter shared by all callers
+
+    Capacity is reserved up front: each reservation takes its cost out of
+    both buckets (which may go into debt) and returns how long the caller
+    must wait, so waiters are served in arrival order.
+    """
+
+    def __init__(self, rpm=DEFAULT_RPM, tpm=DEFAULT_TPM):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._lock = threading.Lock()
+        now = time.monotonic()
+        self._request_level = float(rpm)
+        self._token_level = float(tpm)
+        self._updated = now
+        self._paused_until = now
+        self._waiting = 0
+        self.granted = 0
+        self.throttled = 0
+        self.server_pauses = 0
+
+    @classmethod
+    def from_env(cls):
+        """
+        Build a limiter from VTRYON_RPM and VTRYON_TPM
+        """
+        return cls(
+            rpm=float(os.getenv("VTRYON_RPM", DEFAULT_RPM)),
+            tpm=float(os.getenv("VTRYON_TPM", DEFAULT_TPM)),
+        )
+
+    def _refill(self, now):
+        elapsed = now - self._updated
+        self._updated = now
+        self._request_level = min(self.rpm, self._request_level + elapsed * self.rpm / 60)
+        self._token_level = min(self.tpm, self._token_level + elapsed * self.tpm / 60)
+
+    def _delay_locked(self, now, tokens):
+        delay = max(0.0, self._paused_until - now)
+        if self._request_level < 1:
+            delay = max(delay, (1 - self._request_level) * 60 / self.rpm)
+        tokens = min(tokens, self.tpm)
+        if self._token_level < tokens:
+            delay = max(delay, (tokens - self._token_level) * 60 / self.tpm)
+        return delay
+
+    def reserve(self, tokens=0):
+        """
+        Take capacity for one request and return the seconds to wait before sending it
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            delay = self._delay_locked(now, tokens)
+            self._request_level -= 1
+            self._token_level -= min(tokens, self.tpm)
+            self.granted += 1
+            if delay > 0:
+                self.throttled += 1
+            return delay
+
+    def try_acquire(self, tokens=0):
+        """
+        Take capacity for one request only if it is free right now; returns whether it was taken
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if self._delay_locked(now, tokens) > 0:
+                return False
+            self._request_level -= 1
+            self._token_level -= min(tokens, self.tpm)
+            self.granted += 1
+            return True
+
+    def refund(self, tokens=0):
+        """
+        Give back capacity taken by try_acquire or acquire for a request that was not sent after all
+        """
+        with self._lock:
+            self._request_level = min(self.rpm, self._request_level + 1)
+            self._token_level = min(self.tpm, self._token_level + min(tokens, self.tpm))
+            self.granted -= 1
+
+    def acquire(self, tokens=0):
+        """
+        Block until a request of the given token cost may be sent
+
+        A cancelled job (see cancellation) stops waiting and gives the
+        capacity back.
+        """
+        delay = self.reserve(tokens)
+        if delay > 0:
+            with self._lock:
+                self._waiting += 1
+            try:
+                logger.info("⏳ Waiting %.1fs for rate limit capacity...", delay)
+                cancellation.sleep(delay)
+            except cancellation.Cancelled:
+                self.refund(tokens)
+                raise
+            finally:
+                with self._lock:
+                    self._waiting -= 1
+
+    async def acquire_async(self, tokens=0):
+        """
+        Async counterpart of acquire; a cancelled task gives the capacity back
+        """
+        delay = self.reserve(tokens)
+        if delay > 0:
+            with self._lock:
+                self._waiting += 1
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                self.refund(tokens)
+                raise
+            finally:
+                with self._lock:
+                    self._waiting -= 1
+
+    def settle(self, estimated_tokens, actual_tokens):
+        """
+        Correct the token bucket once the real usage of a request is known
+        """
+        if actual_tokens is None:
+            return
+        with self._lock:
+            self._token_level = min(self.tpm, self._token_level + estimated_tokens - actual_tokens)
+
+    def pause(self, seconds):
+        """
+        Hold back every caller for the given number of seconds (server asked us to)
+        """
+        with self._lock:
+            until = time.monotonic() + seconds
+            if until > self._paused_until:
+                self._paused_until = until
+                self.server_pauses += 1
+
+    def current_wait(self, tokens=0):
+        """
+        Seconds a new request of this cost would wait right now
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            return self._delay_locked(now, tokens)
+
+    @property
+    def queue_depth(self):
+        """
+        Number of callers currently waiting for capacity
+        """
+        with self._lock:
+            return self._waiting
+
+    def stats(self):
+        return {
+            "rpm": self.rpm,
+            "tpm": self.tpm,
+            "current_wait": self.current_wait(),
+            "queue_depth": self.queue_depth,
+            "granted": self.granted,
+            "throttled": self.throttled,
+            "server_pauses": self.server_pauses,
+        }
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """
+    Return the process-wide limiter, creating it from the environment on first use
+    """
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            from key_pool import get_key_pool
+
+            pool = get_key_pool()
+            # With several API keys the shared limiter admits their combined quota; each key's limiter does the rest
+            _limiter = RateLimiter(pool.total_rpm, pool.total_tpm) if pool.active else RateLimiter.from_env()
+        return _limiter
+
+
+def retry_delay(exc, attempt, limiter):
+    """
+    Decide how to handle a failed attempt; returns seconds to wait or raises
+    """
+    if isinstance(exc, FailoverError):
+        return 0.0
+    kind = classify_error(exc)
+    if kind == FATAL:
+        raise exc
+    if kind == RATE_LIMIT:
+        hint = retry_after_seconds(exc)
+        delay = hint + random.uniform(0, 1) if hint is not None else backoff_seconds(attempt + 2)
+        # Everyone sharing this limiter waits, not just this caller
+        limiter.pause(delay)
+        logger.warning("⚠️ Rate limit hit (%s). Pausing %.1fs...", "server hint" if hint is not None else "backoff", delay)
+        return 0.0
+    delay = backoff_seconds(attempt)
+    logger.warning("⚠️ Error occurred: %s. Retrying in %.1fs...", exc, delay)
+    return delay
+
+
+def raise_exhausted(exc):
+    """
+    Re-raise the last error of a retry loop, mapping rate limits to RateLimitExceeded
+    """
+    if isinstance(exc, FailoverError):
+        exc = exc.error
+    if classify_error(exc) == RATE_LIMIT:
+        if is_quota_error(exc):
+            raise RateLimitExceeded("API quota exceeded. Please check your API plan.", quota=True) from exc
+        raise RateLimitExceeded() from exc
+    raise exc
+
+
+def call_with_retries(fn, tokens=0, max_retries=3, limiter=None):
+    """
+    Call fn() under the rate limiter, retrying transient and rate limit errors
+    """
+    limiter = limiter or get_rate_limiter()
+    for attempt in range(max_retries):
+        limiter.acquire(tokens)
+        try:
+            return fn(attempt)
+        except Exception as e:
+            if attempt >= max_retries - 1:
+                raise_exhausted(e)
+            delay = retry_delay(e, attempt, limiter)
+            if delay:
+                cancellation.sleep(delay)
+
+
+async def call_with_retries_async(fn, tokens=0, max_retries=3, limiter=None):
+    """
+    Async counterpart of call_with_retries; fn(attempt) must return an awaitable
+    """
+    limiter = limiter or get_rate_limiter()
+    for attempt in range(max_retries):
+        await limiter.acquire_async(tokens)
+        try:
+            return await fn(attempt)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if attempt >= max_retries - 1:
+                raise_exhausted(e)
+            delay = retry_delay(e, attempt, limiter)
+            if delay:
+                await asyncio.sleep(delay)
@@ -0,0 +1,398 @@
+"""
+Request policy for generation calls: deadlines, hedging and a circuit breaker.
+
+Without a policy, a stalled stream is waited on indefinitely. Only an
+exception triggers a retry, so one stuck request can hold a user for
+minutes. RequestPolicy.stream() wraps one attempt (one streaming call)
+with:
+
+* a time-to-first-chunk timeout (ttfc_timeout): no first chunk in time
+  raises FirstChunkTimeout, and the retry loop moves on
+* a per-attempt deadline (attempt_deadline) for the whole stream, which
+  raises AttemptDeadlineExceeded; it is also passed to the HTTP client as
+  the request timeout, so the transport gives up too
+* hedging: if the first request has sent nothing back by the observed
+  hedge_percentile of time to first chunk, a second identical request is
+  sent, provided the rate limiter has spare capacity. Whichever produces
+  a chunk first wins, and the other is cancelled (its stream is closed at
+  the next chunk and its HTTP request times out)
+* a circuit breaker shared by all callers. When the error rate over the
+  recent window reaches error_rate_threshold, it opens, and calls fail
+  fast with CircuitOpenError for open_seconds. After that, a single probe
+  call is let through (half open): success closes the breaker and failure
+  opens it again.
+
+Timeouts subclass TimeoutError, so the retry policy treats them as
+retryable and the model registry counts them against the model. Every
+decision is counted in vtryon_policy_total{decision=...}.
+"""
+import contextvars
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+import cancellation
+from rate_limiter import RETRYABLE, classify_error
+from telemetry import METRICS, percentile
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTFC_TIMEOUT = 30.0
+DEFAULT_ATTEMPT_DEADLINE = 120.0
+DEFAULT_HEDGE_PERCENTILE = 95.0
+# Before enough first-chunk samples exist, hedge after this long
+DEFAULT_HEDGE_DELAY = 10.0
+MIN_HEDGE_SAMPLES = 20
+# Never hedge sooner than this, however fast first chunks usually are
+DEFAULT_MIN_HEDGE_DELAY = 1.0
+TTFC_WINDOW = 200
+
+DEFAULT_BREAKER_WINDOW = 20
+DEFAULT_BREAKER_MIN_CALLS = 10
+DEFAULT_BREAKER_ERROR_RATE = 0.5
+DEFAULT_BREAKER_OPEN_SECONDS = 30.0
+
+POLICY_METRIC = "vtryon_policy_total"
+
+# Breaker states
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class FirstChunkTimeout(TimeoutError):
+    """No chunk arrived within the time-to-first-chunk timeout"""
+
+
+class AttemptDeadlineExceeded(TimeoutError):
+    """The attempt did not finish streaming within its deadline"""
+
+
+class CircuitOpenError(Exception):
+    """The circuit breaker is open; the call was not sent"""
+
+    def __init__(self, retry_in):
+        super().__init__(f"Generation service is failing; not sending requests for {retry_in:.0f}s")
+        self.retry_in = retry_in
+
+
+def count_decision(decision, **labels):
+    METRICS.inc(POLICY_METRIC, decision=decision, **labels)
+
+
+class CircuitBreaker:
+    """
+    Error-rate circuit breaker over the last `window` calls
+    """
+
+    def __init__(self, window=DEFAULT_BREAKER_WINDOW, min_calls=DEFAULT_BREAKER_MIN_CALLS,
+                 error_rate_threshold=DEFAULT_BREAKER_ERROR_RATE, open_seconds=DEFAULT_BREAKER_OPEN_SECONDS):
+        self.min_calls = min_calls
+        self.error_rate_threshold = error_rate_threshold
+        self.open_seconds = open_seconds
+        self._lock = threading.Lock()
+        self._outcomes = deque(maxlen=window)
+        self.state = CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+        self.trips = 0
+        self.rejected = 0
+
+    def allow(self):
+        """
+        Admit one call or raise CircuitOpenError; in half-open state only one probe is admitted
+        """
+        with self._lock:
+            if self.state == OPEN:
+                remaining = self._opened_at + self.open_seconds - time.monotonic()
+                if remaining > 0:
+                    self.rejected += 1
+                    count_decision("breaker_rejected")
+                    raise CircuitOpenError(remaining)
+                self.state = HALF_OPEN
+                self._probing = False
+            if self.state == HALF_OPEN:
+                if self._probing:
+                    self.rejected += 1
+                    count_decision("breaker_rejected")
+                    raise CircuitOpenError(self.open_seconds)
+                self._probing = True
+                count_decision("breaker_probe")
+
+    def record(self, ok):
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probing = False
+                if ok:
+                    self.state = CLOSED
+                    self._outcomes.clear()
+                    count_decision("breaker_closed")
+                    logger.info("🟢 Circuit breaker closed: probe succeeded")
+                else:
+                    self._open_locked()
+                return
+            self._outcomes.append(ok)
+            if self.state == CLOSED and len(self._outcomes) >= self.min_calls and \
+                    self.error_rate >= self.error_rate_threshold:
+                self._open_locked()
+
+    def release(self):
+        """
+        A call admitted by allow() ended without an outcome (cancelled); let another probe through
+        """
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probing = False
+
+    def _open_locked(self):
+        self.state = OPEN
+        self._opened_at = time.monotonic()
+        self.trips += 1
+        count_decision("breaker_opened")
+        logger.warning("🔴 Circuit breaker open for %gs (error rate %.0f%%)",
+                       self.open_seconds, self.error_rate * 100)
+
+    @property
+    def error_rate(self):
+        if not self._outcomes:
+            return 0.0
+        return sum(1 for ok in self._outcomes if not ok) / len(self._outcomes)
+
+    def stats(self):
+        with self._lock:
+            return {"state": self.state, "error_rate": self.error_rate, "trips": self.trips,
+                    "rejected": self.rejected}
+
+
+class _Pump:
+    """One streaming request running on its own thread, feeding a shared queue"""
+
+    def __init__(self, index, open_stream, events):
+        self.index = index
+        self.cancelled = threading.Event()
+        self.started = time.monotonic()
+        self.first_chunk = None
+        self._open_stream = open_stream
+        self._events = events
+        # Copy the context so spans recorded on this thread keep the caller's trace id
+        context = contextvars.copy_context()
+        self.thread = threading.Thread(target=context.run, args=(self._run,), daemon=True,
+                                       name=f"tryon-stream-{index}")
+        self.thread.start()
+
+    def _run(self):
+        stream = None
+        try:
+            stream = self._open_stream()
+            for chunk in stream:
+                if self.cancelled.is_set():
+                    break
+                self._events.put((self, chunk, None))
+            else:
+                self._events.put((self, None, None))
+        except Exception as e:
+            if not self.cancelled.is_set():
+                self._events.put((self, None, e))
+        finally:
+            close = getattr(stream, "close", None)
+            if close is not None:
+                try:
+                    close()
+                except Exception:
+                    pass
+
+
+class RequestPolicy:
+    """
+    Deadlines, hedging and circuit breaking around one streaming attempt
+    """
+
+    def __init__(self, ttfc_timeout=DEFAULT_TTFC_TIMEOUT, attempt_deadline=DEFAULT_ATTEMPT_DEADLINE, hedge=True,
+                 hedge_percentile=DEFAULT_HEDGE_PERCENTILE, hedge_delay=DEFAULT_HEDGE_DELAY,
+                 min_hedge_delay=DEFAULT_MIN_HEDGE_DELAY, breaker=None):
+        self.ttfc_timeout = ttfc_timeout
+        self.attempt_deadline = attempt_deadline
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_delay = hedge_delay
+        self.min_hedge_delay = min_hedge_delay
+        self.breaker = breaker or CircuitBreaker()
+        self._lock = threading.Lock()
+        self._ttfc = deque(maxlen=TTFC_WINDOW)
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.timeouts = 0
+
+    @classmethod
+    def from_env(cls):
+        """
+        Build from VTRYON_TTFC_TIMEOUT, VTRYON_ATTEMPT_DEADLINE, VTRYON_HEDGE, VTRYON_HEDGE_PERCENTILE
+        and VTRYON_BREAKER_OPEN_SECONDS
+        """
+        return cls(
+            ttfc_timeout=float(os.getenv("VTRYON_TTFC_TIMEOUT", DEFAULT_TTFC_TIMEOUT)),
+            attempt_deadline=float(os.getenv("VTRYON_ATTEMPT_DEADLINE", DEFAULT_ATTEMPT_DEADLINE)),
+            hedge=os.getenv("VTRYON_HEDGE", "1").lower() not in ("0", "false", "no", "off"),
+            hedge_percentile=float(os.getenv("VTRYON_HEDGE_PERCENTILE", DEFAULT_HEDGE_PERCENTILE)),
+            breaker=CircuitBreaker(
+                open_seconds=float(os.getenv("VTRYON_BREAKER_OPEN_SECONDS", DEFAULT_BREAKER_OPEN_SECONDS))
+            ),
+        )
+
+    def hedge_after(self):
+        """
+        Seconds without a first chunk before sending the hedge request (None when hedging is off)
+        """
+        if not self.hedge:
+            return None
+        with self._lock:
+            samples = list(self._ttfc)
+        if len(samples) < MIN_HEDGE_SAMPLES:
+            delay = self.hedge_delay
+        else:
+            delay = percentile(samples, self.hedge_percentile)
+        return max(self.min_hedge_delay, delay)
+
+    def observe_first_chunk(self, seconds):
+        """
+        Add a time-to-first-chunk sample for the hedge percentile
+        """
+        with self._lock:
+            self._ttfc.append(seconds)
+
+    def timeout_error(self, first_chunk_seen):
+        """
+        Count a timed-out attempt and return the exception to raise for it
+        """
+        self.timeouts += 1
+        if first_chunk_seen:
+            count_decision("deadline_exceeded")
+            return AttemptDeadlineExceeded(f"Generation did not finish within {self.attempt_deadline:g}s")
+        count_decision("ttfc_timeout")
+        return FirstChunkTimeout(f"No response within {self.ttfc_timeout:g}s")
+
+    def finish(self, error=None):
+        """
+        Report how an attempt admitted by breaker.allow() ended: None for success
+
+        Only server errors and timeouts (RETRYABLE) count as failures.
+        Client errors (FATAL) say nothing about the backend's health, 429s
+        (RATE_LIMIT) are per-key quota that the rate limiter waits out, and
+        cancellation has no outcome; none of them counts towards the breaker.
+        """
+        if error is None:
+            self.breaker.record(True)
+        elif isinstance(error, Exception) and classify_error(error) == RETRYABLE:
+            self.breaker.record(False)
+        else:
+            self.breaker.release()
+
+    def stream(self, open_stream, can_hedge=None, hedge=True):
+        """
+        Yield chunks from open_stream() under the policy
+
+        open_stream must return a fresh iterator of response chunks each
+        time it is called; it is called again for the hedge request.
+        can_hedge() is asked right before hedging (e.g. for spare rate
+        limit capacity); the hedge is skipped when it returns False.
+        """
+        self.breaker.allow()
+        events = queue.Queue()
+        pumps = [_Pump(0, open_stream, events)]
+        start = time.monotonic()
+        deadline = start + self.attempt_deadline if self.attempt_deadline else None
+        ttfc_deadline = start + self.ttfc_timeout if self.ttfc_timeout else None
+        hedge_after = self.hedge_after() if hedge else None
+        hedge_at = start + hedge_after if hedge_after is not None else None
+        winner = None
+        error = None
+        try:
+            while True:
+                now = time.monotonic()
+                waits = [t for t in (deadline, hedge_at if winner is None else None,
+                                     ttfc_deadline if winner is None else None) if t is not None]
+                # Wake up at least every POLL_SECONDS so a cancelled job stops waiting
+                timeout = min(max(0.0, min(waits) - now), cancellation.POLL_SECONDS) if waits \
+                    else cancellation.POLL_SECONDS
+                try:
+                    pump, chunk, failure = events.get(timeout=timeout)
+                except queue.Empty:
+                    cancellation.check_cancelled()
+                    now = time.monotonic()
+                    if deadline is not None and now >= deadline:
+                        raise self.timeout_error(winner is not None)
+                    if winner is None and ttfc_deadline is not None and now >= ttfc_deadline:
+                        raise self.timeout_error(False)
+                    if winner is None and hedge_at is not None and now >= hedge_at:
+                        hedge_at = None
+                        if can_hedge is not None and not can_hedge():
+                            count_decision("hedge_skipped")
+                            continue
+                        self.hedges += 1
+                        count_decision("hedge_sent")
+                        logger.info("🪝 No first chunk after %.1fs, sending a hedge request", hedge_after)
+                        pumps.append(_Pump(1, open_stream, events))
+                    continue
+
+                if winner is not None and pump is not winner:
+                    continue
+                if failure is not None:
+                    others = [p for p in pumps if p is not pump and not p.cancelled.is_set()]
+                    if winner is None and others:
+                        # The other request may still succeed; let it carry on alone
+                        pump.cancelled.set()
+                        count_decision("hedge_error_absorbed")
+                        continue
+                    raise failure
+                if winner is None:
+                    winner = pump
+                    pump.first_chunk = time.monotonic() - pump.started
+                    self.observe_first_chunk(pump.first_chunk)
+                    for other in pumps:
+                        if other is not pump:
+                            other.cancelled.set()
+                    if len(pumps) > 1:
+                        if pump.index == 1:
+                            self.hedge_wins += 1
+                        count_decision("hedge_won" if pump.index == 1 else "primary_won")
+                if chunk is None:
+                    return
+                yield chunk
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            for pump in pumps:
+                pump.cancelled.set()
+            self.finish(error)
+
+    def stats(self):
+        with self._lock:
+            samples = list(self._ttfc)
+        return {
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "timeouts": self.timeouts,
+            "hedge_after": self.hedge_after(),
+            "ttfc_p50": percentile(samples, 50),
+            "ttfc_p95": percentile(samples, 95),
+            "breaker": self.breaker.stats(),
+        }
+
+
+_request_policy = None
+_request_policy_lock = threading.Lock()
+
+
+def get_request_policy():
+    """
+    Return the process-wide RequestPolicy configured from the environment
+    """
+    global _request_policy
+    with _request_policy_lock:
+        if _request_policy is None:
+            _request_policy = RequestPolicy.from_env()
+        return _request_policy
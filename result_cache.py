@@ -0,0 +1,198 @@
+"""
+Content-addressed on-disk cache for try-on results.
+
+Entries are keyed by a hash of everything that determines the model output
+(optimized image bytes, prompt text, model name and generation config) and
+hold the ``(text_response, generated_images)`` tuple returned by
+``visualize_item_on_body``. The cache is bounded in bytes with LRU eviction
+and every entry expires after a TTL.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+DEFAULT_CACHE_DIR = os.path.join(".cache", "results")
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+DEFAULT_TTL_SECONDS = 7 * 24 * 3600
+
+ENTRY_SUFFIX = ".entry"
+
+
+class ResultCache:
+    """
+    Size-bounded LRU cache of generation results stored as one file per entry.
+
+    Each file is a single JSON header line followed by the raw image bytes.
+    Recency is tracked with the file mtime so it survives restarts.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES, ttl_seconds=DEFAULT_TTL_SECONDS):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        # key -> (size, last_access)
+        self._index = {}
+        self._total_bytes = 0
+        self._load_index()
+
+    @classmethod
+    def from_env(cls):
+        """
+        Build a cache configured from VTRYON_CACHE_* environment variables
+        """
+        return cls(
+            cache_dir=os.getenv("VTRYON_CACHE_DIR", DEFAULT_CACHE_DIR),
+            max_bytes=int(float(os.getenv("VTRYON_CACHE_MAX_MB", DEFAULT_MAX_BYTES / (1024 * 1024))) * 1024 * 1024),
+            ttl_seconds=float(os.getenv("VTRYON_CACHE_TTL_SECONDS", DEFAULT_TTL_SECONDS)),
+        )
+
+    @staticmethod
+    def make_key(img_bytes, prompt, model, config):
+        """
+        Hash the request inputs into a stable hex key
+        """
+        h = hashlib.sha256()
+        config_json = config.model_dump_json(exclude_none=True) if config is not None else ""
+        for part in (model.encode(), prompt.encode(), config_json.encode()):
+            h.update(len(part).to_bytes(8, "big"))
+            h.update(part)
+        h.update(img_bytes)
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + ENTRY_SUFFIX)
+
+    def _load_index(self):
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(ENTRY_SUFFIX):
+                continue
+            try:
+                st = os.stat(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                continue
+            self._index[name[:-len(ENTRY_SUFFIX)]] = (st.st_size, st.st_mtime)
+            self._total_bytes += st.st_size
+
+    def _drop(self, key):
+        size, _ = self._index.pop(key, (0, 0))
+        self._total_bytes -= size
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def get(self, key, count=True):
+        """
+        Return (text_response, generated_images) or None on a miss
+
+        count=False leaves the hit and miss counters alone, for probes such
+        as near-duplicate lookups that are not requests of their own.
+        """
+        with self._lock:
+            if key not in self._index:
+                self.misses += count
+                return None
+            try:
+                with open(self._path(key), "rb") as f:
+                    header = json.loads(f.readline())
+                    if time.time() - header["created"] > self.ttl_seconds:
+                        self.expirations += 1
+                        self.misses += count
+                        self._drop(key)
+                        return None
+                    images = [f.read(size) for size in header["sizes"]]
+            except (OSError, ValueError, KeyError):
+                # Corrupt or concurrently removed entry
+                self.misses += count
+                self._drop(key)
+                return None
+
+            now = time.time()
+            try:
+                os.utime(self._path(key), (now, now))
+            except OSError:
+                pass
+            self._index[key] = (self._index[key][0], now)
+            self.hits += count
+            return header["text"], images
+
+    def put(self, key, text_response, generated_images):
+        """
+        Store a result, evicting least recently used entries if over budget
+        """
+        header = {
+            "created": time.time(),
+            "text": text_response,
+            "sizes": [len(img) for img in generated_images],
+        }
+        payload = json.dumps(header).encode() + b"\n"
+        size = len(payload) + sum(header["sizes"])
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(payload)
+                    for img in generated_images:
+                        f.write(img)
+                os.replace(tmp_path, self._path(key))
+            except OSError:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+                return
+
+            if key in self._index:
+                self._total_bytes -= self._index[key][0]
+            self._index[key] = (size, time.time())
+            self._total_bytes += size
+            self.stores += 1
+            self._evict()
+
+    def _evict(self):
+        if self._total_bytes <= self.max_bytes:
+            return
+        for key, _ in sorted(self._index.items(), key=lambda item: item[1][1]):
+            if self._total_bytes <= self.max_bytes:
+                break
+            self._drop(key)
+            self.evictions += 1
+
+    def clear(self):
+        """
+        Remove every entry from disk
+        """
+        with self._lock:
+            for key in list(self._index):
+                self._drop(key)
+
+    def stats(self):
+        """
+        Return hit/miss counters and current size
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._index),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "stores": self.stores,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
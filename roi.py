@@ -0,0 +1,250 @@
+"""
+Region-of-interest cropping around the person and the held item.
+
+A camera frame is mostly background, yet every request uploads all of it.
+This stage finds the region that matters (the person holding the item),
+sends only that crop to the model, and can paste the generated crop back
+into the original frame so the user still gets a full picture.
+
+Detection runs on a small grayscale copy of the frame and combines:
+
+* frontal faces (Haar cascade), each widened into an upper-body box with
+  room for the arms
+* full-body people (OpenCV's built-in HOG people detector)
+* foreground contours: pixels that differ clearly from the colour of the
+  frame border, which picks up the held item and people the detectors miss
+
+The detectors are skipped when the installed OpenCV build lacks the
+objdetect module or the cascade files; foreground contours still work.
+
+Foreground blobs that touch a detected person are merged into the person's
+box. The union is padded by ROI_MARGIN, and rejected if it covers almost
+the whole frame (nothing to save) or only a speck (likely noise).
+"""
+import io
+import logging
+import math
+import os
+from dataclasses import dataclass
+
+import cv2
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# off: send the whole frame; crop: send and return the crop; composite: paste the result back
+ROI_MODES = ("off", "crop", "composite")
+DEFAULT_ROI_MODE = os.getenv("VTRYON_ROI", "off").lower()
+
+DETECT_WIDTH = 320
+ROI_MARGIN = 0.08
+ROI_MAX_FRACTION = 0.8
+ROI_MIN_FRACTION = 0.04
+FOREGROUND_THRESHOLD = 28.0
+COMPOSITE_QUALITY = 92
+
+# Gemini tokenizes images in 768px tiles of 258 tokens; small images are one tile
+IMAGE_TILE = 768
+IMAGE_TILE_TOKENS = 258
+SMALL_IMAGE_SIDE = 384
+
+_FACE_CASCADE = None
+_HOG = None
+
+
+@dataclass
+class Region:
+    """Detected crop box in frame pixels, with what found it"""
+    box: tuple
+    frame_size: tuple
+    sources: tuple = ()
+
+    @property
+    def size(self):
+        return self.box[2] - self.box[0], self.box[3] - self.box[1]
+
+    @property
+    def fraction(self):
+        width, height = self.size
+        return width * height / (self.frame_size[0] * self.frame_size[1])
+
+
+def estimate_image_tokens(width, height):
+    """
+    Input tokens Gemini bills for an image of this size (258 per 768px tile)
+    """
+    if width <= SMALL_IMAGE_SIDE and height <= SMALL_IMAGE_SIDE:
+        return IMAGE_TILE_TOKENS
+    return math.ceil(width / IMAGE_TILE) * math.ceil(height / IMAGE_TILE) * IMAGE_TILE_TOKENS
+
+
+def _face_cascade():
+    global _FACE_CASCADE
+    if _FACE_CASCADE is None and not hasattr(cv2, "CascadeClassifier"):
+        _FACE_CASCADE = False
+    if _FACE_CASCADE is None:
+        data_dir = getattr(getattr(cv2, "data", None), "haarcascades", "")
+        path = os.path.join(data_dir, "haarcascade_frontalface_default.xml")
+        cascade = cv2.CascadeClassifier(path) if os.path.exists(path) else None
+        # False marks "not available in this OpenCV build" so the lookup is not repeated
+        _FACE_CASCADE = cascade if cascade is not None and not cascade.empty() else False
+    return _FACE_CASCADE or None
+
+
+def _hog():
+    global _HOG
+    if _HOG is None:
+        if hasattr(cv2, "HOGDescriptor"):
+            _HOG = cv2.HOGDescriptor()
+            _HOG.setSVMDetector(cv2.HOGDescriptor_getDefaultPeopleDetector())
+        else:
+            _HOG = False
+    return _HOG or None
+
+
+def _person_boxes(gray):
+    """Person boxes from faces and HOG, with the name of each detector that fired"""
+    height = gray.shape[0]
+    boxes, sources = [], []
+    cascade = _face_cascade()
+    if cascade is not None:
+        for x, y, w, h in cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(16, 16)):
+            # Upper body with arms out to either side: about 4.5 faces wide, down to the frame bottom
+            boxes.append((x - 1.75 * w, y - 0.6 * h, x + 2.75 * w, height))
+        if boxes:
+            sources.append("face")
+    hog = _hog()
+    found = []
+    if hog is not None:
+        rects, weights = hog.detectMultiScale(gray, winStride=(8, 8), padding=(8, 8), scale=1.05)
+        found = [(x, y, x + w, y + h) for (x, y, w, h), weight in zip(rects, np.ravel(weights)) if weight > 0.5]
+    if found:
+        boxes.extend(found)
+        sources.append("hog")
+    return boxes, sources
+
+
+def _foreground_boxes(small):
+    """Boxes of blobs whose colour differs from the (lighting-corrected) frame border"""
+    lab = cv2.cvtColor(small, cv2.COLOR_RGB2LAB).astype(np.float32)
+    frame_height, frame_width = small.shape[:2]
+    ys, xs = np.mgrid[0:frame_height, 0:frame_width].astype(np.float32)
+    border = np.zeros((frame_height, frame_width), dtype=bool)
+    border[:4], border[-4:], border[:, :4], border[:, -4:] = True, True, True, True
+    # Fit the border colour as a plane over the frame so uneven lighting is not foreground
+    design = np.stack([np.ones_like(xs), xs / frame_width, ys / frame_height], axis=-1)
+    coeffs, *_ = np.linalg.lstsq(design[border], lab[border], rcond=None)
+    distance = np.linalg.norm(lab - design @ coeffs, axis=2)
+    mask = (distance > FOREGROUND_THRESHOLD).astype(np.uint8) * 255
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
+    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel, iterations=2)
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    min_area = frame_height * frame_width * 0.01
+    boxes = []
+    for contour in contours:
+        if cv2.contourArea(contour) >= min_area:
+            x, y, w, h = cv2.boundingRect(contour)
+            # A band across the whole width is scenery (floor, table, window), not a subject
+            if w < frame_width * 0.95:
+                boxes.append((x, y, x + w, y + h))
+    return boxes
+
+
+def _union(boxes):
+    return (min(b[0] for b in boxes), min(b[1] for b in boxes), max(b[2] for b in boxes), max(b[3] for b in boxes))
+
+
+def _touches(a, b, slack):
+    return a[0] - slack <= b[2] and b[0] - slack <= a[2] and a[1] - slack <= b[3] and b[1] - slack <= a[3]
+
+
+def detect_region(photo):
+    """
+    Find the person-and-item region of a PIL image; returns a Region or None to keep the whole frame
+    """
+    frame_width, frame_height = photo.size
+    scale = min(1.0, DETECT_WIDTH / frame_width)
+    small = photo if photo.mode == "RGB" else photo.convert("RGB")
+    small = np.asarray(small.resize((max(1, int(frame_width * scale)), max(1, int(frame_height * scale))),
+                                    Image.Resampling.BILINEAR))
+    gray = cv2.cvtColor(small, cv2.COLOR_RGB2GRAY)
+
+    people, sources = _person_boxes(gray)
+    foreground = _foreground_boxes(small)
+    if people:
+        person = _union(people)
+        slack = 0.05 * gray.shape[1]
+        # A held item usually sticks out of the body box; absorb blobs touching it
+        boxes = [person] + [box for box in foreground if _touches(person, box, slack)]
+        if len(boxes) > 1:
+            sources.append("foreground")
+    elif foreground:
+        boxes = foreground
+        sources = ["foreground"]
+    else:
+        return None
+
+    x0, y0, x1, y1 = _union(boxes)
+    pad_x, pad_y = (x1 - x0) * ROI_MARGIN, (y1 - y0) * ROI_MARGIN
+    box = (
+        max(0, int((x0 - pad_x) / scale)),
+        max(0, int((y0 - pad_y) / scale)),
+        min(frame_width, int(math.ceil((x1 + pad_x) / scale))),
+        min(frame_height, int(math.ceil((y1 + pad_y) / scale))),
+    )
+    region = Region(box=box, frame_size=(frame_width, frame_height), sources=tuple(sources))
+    if not ROI_MIN_FRACTION <= region.fraction <= ROI_MAX_FRACTION:
+        logger.debug("🔲 ROI %s covers %.0f%% of the frame, sending the whole frame", box, region.fraction * 100)
+        return None
+    return region
+
+
+def crop_to_region(photo, region):
+    """
+    The part of the photo inside the region
+    """
+    return photo.crop(region.box)
+
+
+def _feather_mask(size, region, feather):
+    """Alpha ramp along the box edges, except where the box meets the frame edge"""
+    width, height = size
+    x0, y0, x1, y1 = region.box
+    frame_width, frame_height = region.frame_size
+    xs = np.arange(width, dtype=np.float32)
+    ys = np.arange(height, dtype=np.float32)
+    ramp_x = np.ones(width, dtype=np.float32)
+    ramp_y = np.ones(height, dtype=np.float32)
+    if x0 > 0:
+        ramp_x = np.minimum(ramp_x, (xs + 1) / feather)
+    if x1 < frame_width:
+        ramp_x = np.minimum(ramp_x, (width - xs) / feather)
+    if y0 > 0:
+        ramp_y = np.minimum(ramp_y, (ys + 1) / feather)
+    if y1 < frame_height:
+        ramp_y = np.minimum(ramp_y, (height - ys) / feather)
+    alpha = np.clip(np.outer(ramp_y, ramp_x), 0.0, 1.0)
+    # A 2-D uint8 array is already mode "L"
+    return Image.fromarray((alpha * 255).astype(np.uint8))
+
+
+def composite(frame, region, generated):
+    """
+    Paste a generated crop (encoded bytes) back into the frame; returns JPEG bytes
+    """
+    result = Image.open(io.BytesIO(generated))
+    result.load()
+    if result.mode != "RGB":
+        result = result.convert("RGB")
+    size = region.size
+    if result.size != size:
+        # The model may return a different resolution; it keeps the aspect ratio of the crop
+        result = result.resize(size, Image.Resampling.LANCZOS)
+    canvas = frame.convert("RGB") if frame.mode != "RGB" else frame.copy()
+    feather = max(2, int(min(size) * 0.03))
+    canvas.paste(result, region.box[:2], _feather_mask(size, region, feather))
+    buffer = io.BytesIO()
+    canvas.save(buffer, format="JPEG", quality=COMPOSITE_QUALITY)
+    return buffer.getvalue()
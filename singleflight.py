@@ -0,0 +1,209 @@
+"""
+Process-wide single-flight coalescing of identical in-flight generations.
+
+When two sessions (or a double-click) submit the same photo, style and
+prompt while the first request is still running, the second caller joins
+the generation already in flight instead of sending another request. Keys
+are the same request fingerprint the result cache uses, so once a flight
+finishes, later callers are answered from the cache instead.
+
+Sync callers share a streaming flight: the generation runs on its own
+thread, and every waiter receives all events from the beginning, then
+follows live. A failure is raised in every waiter. When the last waiter
+leaves (closes its generator, or Streamlit stops the script), the flight
+is cancelled: it stops at the next chunk and makes no further attempts.
+The generation runs in its own cancellation scope (see cancellation) tied
+to that, so a flight waiting on the rate limiter or a backoff stops too,
+while one waiter's job being cancelled only makes that waiter leave.
+
+Async callers share one asyncio task per key. Each waiter awaits it
+through ``asyncio.shield``, and the task is cancelled only when the last
+waiter is cancelled.
+"""
+import asyncio
+import contextvars
+import logging
+import threading
+
+import cancellation
+from telemetry import METRICS
+
+logger = logging.getLogger(__name__)
+
+COALESCED_METRIC = "vtryon_coalesced_total"
+
+
+class _Flight:
+    """One shared streaming generation and the events it has produced so far"""
+
+    def __init__(self, key):
+        self.key = key
+        self.events = []
+        self.done = False
+        self.error = None
+        self.waiters = 0
+        self.cancelled = threading.Event()
+        self.cond = threading.Condition()
+
+
+class _AsyncFlight:
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Registry of in-flight generations keyed by request fingerprint
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._async_flights = {}
+        self.started = 0
+        self.joined = 0
+        self.cancelled = 0
+
+    def stream(self, key, make_events):
+        """
+        Yield the events of the generation for key, starting make_events() if none is in flight
+
+        make_events is a zero-argument callable returning an iterator of
+        events; it runs on a background thread in a copy of the caller's
+        context so trace ids carry over.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = _Flight(key)
+                self.started += 1
+                context = contextvars.copy_context()
+                threading.Thread(target=context.run, args=(self._produce_in_scope, flight, make_events),
+                                 name=f"singleflight-{key[:8]}", daemon=True).start()
+            else:
+                self.joined += 1
+                METRICS.inc(COALESCED_METRIC, mode="stream")
+                logger.info("🔗 Joining in-flight generation %s", key[:12])
+            flight.waiters += 1
+
+        try:
+            seen = 0
+            while True:
+                with flight.cond:
+                    while seen >= len(flight.events) and not flight.done:
+                        # Wake up now and then so a cancelled job stops waiting
+                        flight.cond.wait(cancellation.POLL_SECONDS)
+                        cancellation.check_cancelled()
+                    new_events = flight.events[seen:]
+                    seen = len(flight.events)
+                    done, error = flight.done, flight.error
+                yield from new_events
+                if done:
+                    if error is not None:
+                        raise error
+                    return
+        finally:
+            self._leave(flight)
+
+    def _produce_in_scope(self, flight, make_events):
+        # Cancelled with the flight, not with whichever waiter started it
+        with cancellation.cancel_scope(flight.cancelled):
+            self._produce(flight, make_events)
+
+    def _produce(self, flight, make_events):
+        events = make_events()
+        try:
+            for event in events:
+                if flight.cancelled.is_set():
+                    break
+                with flight.cond:
+                    flight.events.append(event)
+                    flight.cond.notify_all()
+        except BaseException as e:
+            flight.error = e
+        finally:
+            close = getattr(events, "close", None)
+            if close is not None:
+                close()
+            with self._lock:
+                if self._flights.get(flight.key) is flight:
+                    del self._flights[flight.key]
+            with flight.cond:
+                flight.done = True
+                flight.cond.notify_all()
+
+    def _leave(self, flight):
+        with self._lock:
+            flight.waiters -= 1
+            if flight.waiters > 0 or flight.done:
+                return
+            # Last waiter gone: nobody wants this result any more
+            flight.cancelled.set()
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+            self.cancelled += 1
+        logger.info("🛑 Cancelled in-flight generation %s (no waiters left)", flight.key[:12])
+
+    async def run_async(self, key, make_coro):
+        """
+        Await the shared result for key, starting make_coro() as a task if none is in flight
+        """
+        loop = asyncio.get_running_loop()
+        # Tasks belong to one event loop, so flights are per loop
+        flight_key = (id(loop), key)
+        with self._lock:
+            flight = self._async_flights.get(flight_key)
+            if flight is None or flight.task.done():
+                task = loop.create_task(make_coro())
+                flight = self._async_flights[flight_key] = _AsyncFlight(task)
+                task.add_done_callback(lambda _: self._forget_async(flight_key, flight))
+                self.started += 1
+            else:
+                self.joined += 1
+                METRICS.inc(COALESCED_METRIC, mode="async")
+                logger.info("🔗 Joining in-flight generation %s", key[:12])
+            flight.waiters += 1
+
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            with self._lock:
+                flight.waiters -= 1
+                last = flight.waiters == 0 and not flight.task.done()
+                if last:
+                    self.cancelled += 1
+            if last:
+                flight.task.cancel()
+
+    def _forget_async(self, flight_key, flight):
+        with self._lock:
+            if self._async_flights.get(flight_key) is flight:
+                del self._async_flights[flight_key]
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._flights) + len(self._async_flights)
+
+    def stats(self):
+        return {
+            "in_flight": self.in_flight(),
+            "started": self.started,
+            "joined": self.joined,
+            "cancelled": self.cancelled,
+        }
+
+
+_single_flight = None
+_single_flight_lock = threading.Lock()
+
+
+def get_single_flight():
+    """
+    Return the process-wide SingleFlight registry
+    """
+    global _single_flight
+    with _single_flight_lock:
+        if _single_flight is None:
+            _single_flight = SingleFlight()
+        return _single_flight
@@ -0,0 +1,369 @@
+"""
+Per-stage latency tracing, metrics and logging for the try-on pipeline.
+
+Every try-on runs inside a trace; each pipeline stage (decode, resize,
+encode, send, first chunk, stream, output decode, render) is recorded as a
+span labelled with the model, the attempt number and the payload size.
+Spans feed two exports:
+
+* Prometheus-style histograms, counters and gauges held in memory, served as text
+  by start_metrics_server() (``/metrics``) along with a JSON summary of
+  p50/p95/p99 per stage and the retry rate (``/metrics/summary``).
+* One JSON line per span appended to VTRYON_TRACE_FILE, if set, for
+  offline analysis of individual slow requests.
+
+Log output goes through the standard ``logging`` module; configure_logging()
+sets it up from VTRYON_LOG_LEVEL.
+"""
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds; wide enough for multi-second generations
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 40.0, 80.0)
+
+# Recent samples kept per series for exact percentiles in the summary
+RESERVOIR_SIZE = 2048
+
+STAGE_METRIC = "vtryon_stage_seconds"
+ATTEMPT_METRIC = "vtryon_attempts_total"
+REQUEST_METRIC = "vtryon_requests_total"
+
+# Payload size classes used as a label, so series count stays bounded
+SIZE_CLASSES = ((64 * 1024, "lt64k"), (256 * 1024, "lt256k"), (1024 * 1024, "lt1m"), (4 * 1024 * 1024, "lt4m"))
+
+_trace_id = contextvars.ContextVar("vtryon_trace_id", default=None)
+
+
+def configure_logging(level=None):
+    """
+    Send pipeline logs to stderr at VTRYON_LOG_LEVEL (default INFO)
+    """
+    level = (level or os.getenv("VTRYON_LOG_LEVEL", "INFO")).upper()
+    logging.basicConfig(level=level, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+
+def size_class(num_bytes):
+    if num_bytes is None:
+        return ""
+    for limit, label in SIZE_CLASSES:
+        if num_bytes < limit:
+            return label
+    return "ge4m"
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+class Histogram:
+    """Cumulative bucket counts plus a reservoir of recent samples"""
+
+    def __init__(self, buckets=STAGE_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=RESERVOIR_SIZE)
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+
+
+class Metrics:
+    """
+    Thread-safe registry of labelled histograms, counters and gauge collectors
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+        self._collectors = []
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def add_collector(self, collect):
+        """
+        Register collect(), called at scrape time, returning (name, labels dict, value) gauge samples
+        """
+        with self._lock:
+            if collect not in self._collectors:
+                self._collectors.append(collect)
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    def counter_total(self, name, **match):
+        """
+        Sum of a counter over every series whose labels include ``match``
+        """
+        wanted = {(k, str(v)) for k, v in match.items()}
+        with self._lock:
+            return sum(value for (n, labels), value in self._counters.items()
+                       if n == name and wanted <= set(labels))
+
+    def prometheus_text(self):
+        """
+        Render all series in the Prometheus text exposition format
+        """
+        lines = []
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+            collectors = list(self._collectors)
+        gauges = sorted((self._key(name, labels), value) for collect in collectors for name, labels, value in collect())
+        seen = set()
+        for (name, labels), histogram in histograms:
+            if name not in seen:
+                lines.append(f"# TYPE {name} histogram")
+                seen.add(name)
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', repr(bound)),))} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {histogram.count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum}")
+            lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+        for (name, labels), value in counters:
+            if name not in seen:
+                lines.append(f"# TYPE {name} counter")
+                seen.add(name)
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+        for (name, labels), value in gauges:
+            if name not in seen:
+                lines.append(f"# TYPE {name} gauge")
+                seen.add(name)
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """
+        p50/p95/p99 in milliseconds per stage, plus request and retry counts
+        """
+        by_stage = {}
+        with self._lock:
+            for (name, labels), histogram in self._histograms.items():
+                if name == STAGE_METRIC:
+                    stage = dict(labels).get("stage", "")
+                    by_stage.setdefault(stage, []).extend(histogram.recent)
+        stages = {}
+        for stage, values in sorted(by_stage.items()):
+            stages[stage] = {
+                "count": len(values),
+                **{f"p{p}_ms": percentile(values, p) * 1000 for p in (50, 95, 99)},
+            }
+        requests = self.counter_total(REQUEST_METRIC)
+        retries = self.counter_total(ATTEMPT_METRIC, outcome="retry")
+        return {
+            "stages": stages,
+            "requests": requests,
+            "retries": retries,
+            "rate_limited": self.counter_total(ATTEMPT_METRIC, reason="rate_limit"),
+            "retry_rate": retries / requests if requests else 0.0,
+        }
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+class TraceWriter:
+    """
+    Appends one JSON object per finished span to a file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    def write(self, record):
+        line = json.dumps(record, default=str) + "\n"
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+
+METRICS = Metrics()
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_trace_writer():
+    """
+    Return the JSONL span writer configured by VTRYON_TRACE_FILE, or None
+    """
+    global _writer
+    path = os.getenv("VTRYON_TRACE_FILE")
+    if not path:
+        return None
+    with _writer_lock:
+        if _writer is None or _writer.path != path:
+            _writer = TraceWriter(path)
+        return _writer
+
+
+@contextlib.contextmanager
+def trace(trace_id=None):
+    """
+    Group the spans recorded inside this block under one trace id
+    """
+    token = _trace_id.set(trace_id or uuid.uuid4().hex[:16])
+    try:
+        yield _trace_id.get()
+    finally:
+        try:
+            _trace_id.reset(token)
+        except ValueError:
+            # Closed from another context (e.g. a generator finalized elsewhere)
+            pass
+
+
+def current_trace_id():
+    return _trace_id.get()
+
+
+def record_stage(stage, seconds, model=None, attempt=None, payload_bytes=None, **extra):
+    """
+    Record a stage duration measured by the caller
+    """
+    METRICS.observe(STAGE_METRIC, seconds, stage=stage, model=model, attempt=attempt,
+                    size=size_class(payload_bytes) or None)
+    writer = get_trace_writer()
+    if writer is not None:
+        record = {"ts": time.time(), "trace": _trace_id.get(), "stage": stage, "ms": round(seconds * 1000, 3),
+                  "model": model, "attempt": attempt, "bytes": payload_bytes}
+        record.update(extra)
+        writer.write({k: v for k, v in record.items() if v is not None})
+
+
+class Span:
+    """Labels of an open span; set() adds labels known only once the work is done"""
+
+    def __init__(self, stage, labels):
+        self.stage = stage
+        self.labels = labels
+
+    def set(self, **labels):
+        self.labels.update(labels)
+
+
+@contextlib.contextmanager
+def span(stage, **labels):
+    """
+    Time the enclosed block as one pipeline stage
+
+    Recognised labels are model, attempt and payload_bytes; anything else
+    only goes to the JSONL trace.
+    """
+    current = Span(stage, labels)
+    start = time.perf_counter()
+    try:
+        yield current
+    except BaseException as e:
+        current.labels["error"] = type(e).__name__
+        raise
+    finally:
+        record_stage(stage, time.perf_counter() - start, **current.labels)
+
+
+def count_attempt(outcome, model=None, reason=None):
+    """
+    Count one model call attempt: outcome ok, retry or failed; reason rate_limit or error
+    """
+    METRICS.inc(ATTEMPT_METRIC, outcome=outcome, model=model, reason=reason)
+
+
+def count_request(result, model=None):
+    """
+    Count one try-on request by result: generated, cache_hit, near_duplicate or error
+    """
+    METRICS.inc(REQUEST_METRIC, result=result, model=model)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/metrics":
+            body, content_type = METRICS.prometheus_text().encode(), "text/plain; version=0.0.4"
+        elif self.path.rstrip("/") == "/metrics/summary":
+            body, content_type = json.dumps(METRICS.summary(), indent=2).encode(), "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port=None, host="127.0.0.1"):
+    """
+    Serve /metrics and /metrics/summary on VTRYON_METRICS_PORT; returns the port or None
+
+    Safe to call repeatedly; only the first call starts a server.
+    """
+    global _server
+    port = port if port is not None else os.getenv("VTRYON_METRICS_PORT")
+    if not port:
+        return None
+    with _server_lock:
+        if _server is None:
+            try:
+                _server = ThreadingHTTPServer((host, int(port)), _MetricsHandler)
+            except OSError as e:
+                logger.warning("⚠️ Metrics server not started on port %s: %s", port, e)
+                return None
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, name="vtryon-metrics", daemon=True).start()
+            logger.info("📈 Metrics on http://%s:%s/metrics", host, _server.server_address[1])
+        return _server.server_address[1]
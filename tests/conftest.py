@@ -0,0 +1,67 @@
+"""
+Shared fixtures: a fast in-process fake backend and fresh process-wide singletons per test.
+"""
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import job_queue
+import key_pool
+import model_registry
+import prompts
+import rate_limiter
+import request_policy
+import singleflight
+from fake_gemini import FakeClient, FakeConfig
+
+
+def fast_config(**overrides):
+    """
+    FakeConfig with millisecond delays and a small output image
+    """
+    values = {"ttfc_ms": 5.0, "ttfc_sigma": 0.0, "text_chunks": 2, "chunk_interval_ms": 1.0,
+              "image_delay_ms": 2.0, "image_size": 64, "seed": 0}
+    values.update(overrides)
+    return FakeConfig(**values)
+
+
+def photo_bytes(seed=0, size=(96, 128), fmt="JPEG"):
+    """
+    Encoded camera-like test photo; the same seed gives the same bytes
+    """
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:size[1], 0:size[0]]
+    base = np.stack([x / size[0] * 255, y / size[1] * 255, np.full(x.shape, 128.0)], axis=-1)
+    frame = np.clip(base + rng.normal(0, 8, base.shape), 0, 255).astype(np.uint8)
+    buf = io.BytesIO()
+    Image.fromarray(frame).save(buf, format=fmt)
+    return buf.getvalue()
+
+
+@pytest.fixture(autouse=True)
+def isolated_env(monkeypatch, tmp_path):
+    """
+    Point every process-wide singleton at throwaway state, rebuilt on first use in each test
+    """
+    for name in ("GEMINI_API_KEY", "GEMINI_API_KEYS", "VTRYON_PROMPT_VERSION", "VTRYON_FAKE_GEMINI"):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setenv("VTRYON_MODELS", model_registry.DEFAULT_MODEL)
+    monkeypatch.setenv("VTRYON_MODEL_REGISTRY", str(tmp_path / "models.json"))
+    monkeypatch.setenv("VTRYON_RPM", "100000")
+    monkeypatch.setenv("VTRYON_TPM", "1000000000")
+    for module, name in ((rate_limiter, "_limiter"), (key_pool, "_key_pool"), (model_registry, "_model_registry"),
+                         (request_policy, "_request_policy"), (prompts, "_context_cache"),
+                         (singleflight, "_single_flight"), (job_queue, "_job_queue")):
+        monkeypatch.setattr(module, name, None)
+
+
+@pytest.fixture
+def fake_client():
+    return FakeClient(fast_config())
+
+
+@pytest.fixture
+def photo():
+    return photo_bytes()
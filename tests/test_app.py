@@ -0,0 +1,65 @@
+import os
+import time
+
+import pytest
+
+from benchmarks.bench_sessions import VISUALIZE_LABEL, burst_shots, capture_burst, find_button
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def app_env(monkeypatch, tmp_path):
+    monkeypatch.setenv("GEMINI_API_KEY", "test-key")
+    monkeypatch.setenv("VTRYON_FAKE_GEMINI", "1")
+    for name, value in (("TTFC_MS", "5"), ("TTFC_SIGMA", "0"), ("CHUNK_INTERVAL_MS", "1"),
+                        ("IMAGE_DELAY_MS", "2"), ("IMAGE_SIZE", "64")):
+        monkeypatch.setenv(f"VTRYON_FAKE_{name}", value)
+    monkeypatch.setenv("VTRYON_CACHE_DIR", str(tmp_path / "results"))
+    monkeypatch.setenv("VTRYON_BLOB_DIR", str(tmp_path / "history"))
+    monkeypatch.setenv("VTRYON_SIMILAR_INDEX", str(tmp_path / "phash.jsonl"))
+
+
+def test_reruns_are_timed_per_page_and_fragment(app_env):
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=60)
+    at.run()
+    at.run()
+    assert not at.exception
+    rerun_times = at.session_state.rerun_times_ms
+    assert len(rerun_times["page"]) == 2
+    # The status panel is its own fragment and is timed separately
+    assert rerun_times["status"]
+
+
+def test_burst_capture_to_download(app_env):
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=60)
+    at.run()
+    assert not at.exception
+    next(s for s in at.sidebar.selectbox if s.label == "Capture Mode:").select("burst")
+    at.sidebar.checkbox[0].check()
+    at.run()
+    assert not at.exception
+
+    # AppTest cannot take camera shots; seed the state the page builds from them
+    burst, best_frame = capture_burst(burst_shots(5))
+    at.session_state["burst"] = burst
+    at.session_state["best_frame"] = best_frame
+    at.run()
+    assert not at.error
+    at.sidebar.text_area[0].input("Test: show the item worn.")
+    find_button(at, VISUALIZE_LABEL).click()
+    at.run()
+    deadline = time.monotonic() + 30
+    while "tryon_job" in at.session_state and time.monotonic() < deadline:
+        time.sleep(0.05)
+        at.run()
+    assert not at.exception
+    assert any(s.value.startswith("✅") for s in at.success)
+    assert at.get("download_button")
+    # Only digests of the outputs are kept in session state
+    assert "outputs" not in at.session_state.last_result
+    assert at.session_state.last_result["image_digests"]
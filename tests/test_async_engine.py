@@ -0,0 +1,86 @@
+import asyncio
+
+import pytest
+from PIL import Image
+
+import async_engine
+import request_policy
+from async_engine import collect, fan_out, generate_async, variants_for_styles
+from conftest import fast_config
+from fake_gemini import FakeClient
+from rate_limiter import get_rate_limiter
+from request_policy import CircuitBreaker, CircuitOpenError, RequestPolicy
+from result_cache import ResultCache
+
+
+def test_variants_for_styles():
+    variants = variants_for_styles(["casual", "formal"], ["", "Just the hat"])
+    assert [v.label for v in variants] == ["casual", "formal", "Custom 2"]
+    assert variants[-1].custom_prompt == "Just the hat"
+
+
+def test_fan_out_renders_every_variant(fake_client):
+    photo = Image.new("RGB", (640, 480), "white")
+    results = asyncio.run(collect(fake_client, photo, variants_for_styles(["casual", "formal", "sporty"])))
+    assert sorted(r.variant.label for r in results) == ["casual", "formal", "sporty"]
+    assert all(r.error is None and r.images for r in results)
+    assert fake_client.backend.requests == 3
+
+
+def test_identical_variants_share_one_call():
+    client = FakeClient(fast_config(ttfc_ms=50))
+    photo = Image.new("RGB", (640, 480), "white")
+    variants = variants_for_styles(["casual", "casual"])
+
+    async def run(coalesce):
+        return [r async for r in fan_out(client, photo, variants, coalesce=coalesce)]
+
+    assert all(r.images for r in asyncio.run(run(True)))
+    assert client.backend.requests == 1
+    asyncio.run(run(False))
+    assert client.backend.requests == 3
+
+
+def test_failures_become_results():
+    client = FakeClient(fast_config(error_rate=1.0))
+    photo = Image.new("RGB", (640, 480), "white")
+    results = asyncio.run(collect(client, photo, variants_for_styles(["casual"]), max_retries=1))
+    assert results[0].error is not None and not results[0].images
+
+
+def test_cached_result_skips_the_call(fake_client, photo, tmp_path):
+    cache = ResultCache(str(tmp_path))
+    first = asyncio.run(generate_async(fake_client, photo, "prompt", cache=cache))
+    second = asyncio.run(generate_async(fake_client, photo, "prompt", cache=cache))
+    assert first[2] is False and second[2] is True
+    assert second[:2] == first[:2]
+    assert fake_client.backend.requests == 1
+
+
+def test_model_choice_runs_off_the_event_loop(monkeypatch, fake_client, photo):
+    loop_threads = []
+    registry = async_engine.get_model_registry()
+    choose = registry.choose
+
+    def recording_choose(*args, **kwargs):
+        try:
+            asyncio.get_running_loop()
+            loop_threads.append(True)
+        except RuntimeError:
+            loop_threads.append(False)
+        return choose(*args, **kwargs)
+
+    monkeypatch.setattr(registry, "choose", recording_choose)
+    asyncio.run(generate_async(fake_client, photo, "prompt", coalesce=False))
+    assert loop_threads and not any(loop_threads)
+
+
+def test_open_breaker_gives_capacity_back(monkeypatch, fake_client, photo):
+    policy = RequestPolicy(breaker=CircuitBreaker(window=1, min_calls=1))
+    policy.breaker.allow()
+    policy.breaker.record(False)
+    monkeypatch.setattr(request_policy, "_request_policy", policy)
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(generate_async(fake_client, photo, "prompt", coalesce=False))
+    assert get_rate_limiter().granted == 0
+    assert fake_client.backend.requests == 0
@@ -0,0 +1,70 @@
+import json
+import os
+
+from batch_tryon import BatchRunner, guess_image_extension, load_items, prompt_tag, read_journal
+from conftest import fast_config, photo_bytes
+from fake_gemini import FakeClient, render_payload
+
+
+def test_prompt_tag_is_collision_safe():
+    shared = "Show the item worn at a wedding, outdoors in the afternoon sun with "
+    a, b = prompt_tag(shared + "a hat"), prompt_tag(shared + "a scarf")
+    assert a != b
+    assert a.startswith("show-the-item-worn-at-a-wedding-outdoors")
+    assert prompt_tag(shared + "a hat") == a
+
+
+def test_load_items_from_manifest(tmp_path):
+    manifest = tmp_path / "manifest.jsonl"
+    manifest.write_text("\n".join(json.dumps(row) for row in (
+        {"path": "a.jpg"},
+        {"path": "b.jpg", "style": "formal", "prompt": "Custom"},
+    )))
+    items = load_items(str(manifest), ["casual", "sporty"], "")
+    assert [item["id"] for item in items] == ["a.jpg::casual", "a.jpg::sporty",
+                                             f"b.jpg::formal::{prompt_tag('Custom')}"]
+    assert items[0]["path"] == os.path.join(str(tmp_path), "a.jpg")
+
+
+def test_same_name_with_another_extension_is_its_own_item(tmp_path):
+    shoot = tmp_path / "shoot"
+    shoot.mkdir()
+    (shoot / "a.jpg").write_bytes(photo_bytes(1))
+    (shoot / "a.png").write_bytes(photo_bytes(2, fmt="PNG"))
+    items = load_items(str(tmp_path), ["casual"], "")
+    assert [item["id"] for item in items] == ["shoot/a.jpg::casual", "shoot/a.png::casual"]
+    out = tmp_path / "out"
+    summary = BatchRunner(FakeClient(fast_config()), str(out), workers=1).run(items)
+    assert (summary["succeeded"], summary["skipped"]) == (2, 0)
+    assert len([name for name in os.listdir(out / "shoot") if name.endswith(".png")]) == 2
+
+
+def test_guess_image_extension():
+    assert guess_image_extension(render_payload(64, "png")) == ".png"
+    assert guess_image_extension(render_payload(64, "jpeg")) == ".jpg"
+    assert guess_image_extension(b"????") == ".bin"
+
+
+def test_read_journal_skips_torn_lines(tmp_path):
+    path = tmp_path / "journal.jsonl"
+    path.write_text('{"id": "a", "status": "ok"}\n{"id": "b", "status": "error"}\n{"id": "c", "sta')
+    assert read_journal(str(path)) == {"a"}
+
+
+def test_run_writes_outputs_and_resumes(tmp_path):
+    source = tmp_path / "photos"
+    source.mkdir()
+    for i in range(2):
+        (source / f"p{i}.jpg").write_bytes(photo_bytes(i))
+    client = FakeClient(fast_config())
+    items = load_items(str(source), ["casual"], "Just the hat") + load_items(str(source), ["casual"], "Just the scarf")
+    out = tmp_path / "out"
+    summary = BatchRunner(client, str(out), workers=1, concurrency=2).run(items)
+    assert (summary["succeeded"], summary["failed"]) == (4, 0)
+    # Two prompts on the same photo and style write separate files
+    assert len([name for name in os.listdir(out) if name.endswith(".png")]) == 4
+    assert client.backend.requests == 4
+
+    again = BatchRunner(client, str(out), workers=1).run(items)
+    assert again["skipped"] == 4
+    assert client.backend.requests == 4
@@ -0,0 +1,38 @@
+import threading
+import time
+
+import pytest
+
+import cancellation
+
+
+def test_sleep_outside_scope_is_plain_sleep():
+    start = time.monotonic()
+    cancellation.sleep(0.01)
+    assert time.monotonic() - start >= 0.01
+    assert not cancellation.cancelled()
+    cancellation.check_cancelled()
+
+
+def test_sleep_stops_early_when_cancelled():
+    event = threading.Event()
+    threading.Timer(0.05, event.set).start()
+    start = time.monotonic()
+    with cancellation.cancel_scope(event), pytest.raises(cancellation.Cancelled):
+        cancellation.sleep(5)
+    assert time.monotonic() - start < 1
+
+
+def test_scope_is_reset_on_exit():
+    event = threading.Event()
+    event.set()
+    with cancellation.cancel_scope(event):
+        assert cancellation.cancelled()
+        with pytest.raises(cancellation.Cancelled):
+            cancellation.check_cancelled()
+    assert not cancellation.cancelled()
+
+
+def test_cancelled_is_not_an_exception():
+    # Retry loops catch Exception; cancellation must pass through them
+    assert not issubclass(cancellation.Cancelled, Exception)
@@ -0,0 +1,43 @@
+import pytest
+from google.genai import errors
+
+from conftest import fast_config
+from fake_gemini import FakeClient, FakeConfig, FakeGeminiServer, render_payload
+from gemini_client import create_client
+from tryon import stream_try_on
+
+
+def test_config_from_env(monkeypatch):
+    monkeypatch.setenv("VTRYON_FAKE_TTFC_MS", "800")
+    monkeypatch.setenv("VTRYON_FAKE_IMAGE_FORMAT", "webp")
+    config = FakeConfig.from_env(seed=3)
+    assert (config.ttfc_ms, config.image_format, config.seed) == (800, "webp", 3)
+    assert config.scaled(0.5).ttfc_ms == 400
+
+
+def test_stream_ends_with_the_image():
+    client = FakeClient(fast_config())
+    chunks = list(client.models.generate_content_stream(model="gemini-2.5-flash-image-preview", contents=["hi"]))
+    parts = [part for chunk in chunks for part in chunk.candidates[0].content.parts]
+    assert [part.text for part in parts[:-1]] == ["Fake try-on description part 1. ",
+                                                 "Fake try-on description part 2. "]
+    assert parts[-1].inline_data.data == render_payload(64)
+    assert client.backend.stats()["requests"] == 1
+
+
+@pytest.mark.parametrize("overrides, code", [({"rate_limit_rate": 1.0}, 429), ({"error_rate": 1.0}, 503),
+                                             ({"failing_models": "broken-image"}, 503)])
+def test_injected_failures_use_sdk_errors(overrides, code):
+    client = FakeClient(fast_config(**overrides))
+    model = overrides.get("failing_models", "gemini-2.5-flash-image-preview")
+    with pytest.raises(errors.APIError) as raised:
+        list(client.models.generate_content_stream(model=model, contents=["hi"]))
+    assert raised.value.code == code
+
+
+def test_real_sdk_against_the_local_server(monkeypatch, photo):
+    with FakeGeminiServer(fast_config()) as server:
+        monkeypatch.setenv("VTRYON_GEMINI_BASE_URL", server.url)
+        events = list(stream_try_on(create_client("test-key"), photo, "prompt", coalesce=False))
+    assert events[-1].kind == "done"
+    assert events[-1].images == [render_payload(64)]
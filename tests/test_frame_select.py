@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from benchmarks.bench_frame_select import synthetic_burst
+from frame_select import (BestFrameSelector, FrameScorer, decode_frame, encode_frame, read_frames,
+                          select_best_frame)
+
+
+def test_picks_the_clean_frame():
+    burst, clean_index = synthetic_burst()
+    selector = select_best_frame(burst)
+    assert selector.best_score.index == clean_index
+    rejected = selector.rejected()
+    assert rejected.get("dark") and rejected.get("moving")
+
+
+def test_dark_frames_are_rejected():
+    result = FrameScorer().score(np.full((120, 160, 3), 10, np.uint8))
+    assert result.reason == "dark" and not result.accepted
+
+
+def test_browser_shots_round_trip():
+    burst, clean_index = synthetic_burst(frames=10)
+    # Separate shots are different poses, so motion between them is not held against them
+    selector = BestFrameSelector(FrameScorer(max_motion=float("inf")))
+    for frame in burst:
+        selector.feed(decode_frame(encode_frame(frame)))
+    assert selector.best_score.index == clean_index
+    assert decode_frame(encode_frame(burst[0])).shape == burst[0].shape
+
+
+def test_decode_frame_rejects_garbage():
+    with pytest.raises(ValueError):
+        decode_frame(b"not an image")
+
+
+def test_read_frames_from_a_video_file(tmp_path):
+    import cv2
+
+    burst, _ = synthetic_burst(width=320, height=240, frames=8)
+    path = str(tmp_path / "clip.mp4")
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), 30, (320, 240))
+    for frame in burst:
+        writer.write(frame)
+    writer.release()
+    frames = list(read_frames(path, max_frames=5, max_seconds=None, warmup=0))
+    assert len(frames) == 5
+    assert frames[0].shape == (240, 320, 3)
+
+
+@pytest.mark.parametrize("max_motion", [0, -1.0, float("nan")])
+def test_max_motion_must_be_positive(max_motion):
+    with pytest.raises(ValueError, match="max_motion"):
+        FrameScorer(max_motion=max_motion)
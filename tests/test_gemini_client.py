@@ -0,0 +1,37 @@
+import asyncio
+
+import pytest
+
+import gemini_client
+from fake_gemini import FakeClient
+from gemini_client import create_client, get_client, iterate_async, run_coroutine
+
+
+def test_fake_backend_is_selected_by_env(monkeypatch):
+    monkeypatch.setenv("VTRYON_FAKE_GEMINI", "1")
+    monkeypatch.setattr(gemini_client, "_clients", {})
+    assert isinstance(create_client("key"), FakeClient)
+    client = get_client("key")
+    assert get_client("key") is client
+    assert get_client("other") is not client
+
+
+def test_run_coroutine_on_the_background_loop():
+    async def answer():
+        await asyncio.sleep(0)
+        return 42
+
+    assert run_coroutine(answer(), timeout=5) == 42
+
+
+def test_iterate_async_yields_items_and_errors():
+    async def items():
+        yield 1
+        yield 2
+        raise RuntimeError("boom")
+
+    seen = []
+    with pytest.raises(RuntimeError, match="boom"):
+        for item in iterate_async(items()):
+            seen.append(item)
+    assert seen == [1, 2]
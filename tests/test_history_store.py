@@ -0,0 +1,71 @@
+import os
+
+from fake_gemini import render_payload
+from history_store import BlobStore, HistoryStore, MemoryBudget, blob_digest
+
+
+def test_blobs_are_content_addressed(tmp_path):
+    store = BlobStore(str(tmp_path))
+    digest = store.put(b"payload")
+    assert digest == blob_digest(b"payload")
+    assert store.put(b"payload") == digest
+    assert store.get(digest) == b"payload"
+    assert store.total_bytes == len(b"payload")
+
+
+def test_history_keeps_thumbnails_and_reloads_payloads(tmp_path):
+    image, original = render_payload(128, "png"), render_payload(64, "jpeg")
+    history = HistoryStore(BlobStore(str(tmp_path)), MemoryBudget())
+    entry_id = history.add("casual", "text", [image], original)
+    entry = history.latest
+    assert entry.entry_id == entry_id and entry.thumbnail
+    assert history.load_images(entry_id) == [image]
+    assert history.load_original(entry_id).size == (64, 85)
+
+
+def test_session_budget_bounds_entries_and_reloaded_payloads(tmp_path):
+    history = HistoryStore(BlobStore(str(tmp_path)), MemoryBudget(), session_budget=800)
+    ids = [history.add("s", "", [bytes([i]) * 80], b"o", thumbnail=b"t") for i in range(3)]
+    for entry_id in ids:
+        history.load_images(entry_id)
+    usage = history.memory_usage()
+    assert usage["entries"] == 3
+    assert usage["total_bytes"] <= 800
+    assert history.hot_bytes <= 800 - usage["metadata_bytes"]
+
+
+def test_oldest_entries_are_dropped(tmp_path):
+    history = HistoryStore(BlobStore(str(tmp_path)), MemoryBudget(), max_entries=2)
+    ids = [history.add("s", f"text {i}", [bytes([i])], b"o", thumbnail=b"t") for i in range(3)]
+    assert [entry.entry_id for entry in history.entries()] == ids[:0:-1]
+    # Entries alone over the session budget drop the oldest too
+    small = HistoryStore(BlobStore(str(tmp_path)), MemoryBudget(), session_budget=500)
+    for i in range(5):
+        small.add("s", "x" * 100, [bytes([i])], b"o", thumbnail=b"t")
+    assert len(small) == 1
+    assert small.memory_usage()["metadata_bytes"] <= 500
+
+
+def test_entries_with_pruned_blobs_are_dropped(tmp_path):
+    blobs = BlobStore(str(tmp_path))
+    history = HistoryStore(blobs, MemoryBudget())
+    old = history.add("s", "", [b"a" * 100], b"old", thumbnail=b"t")
+    kept = history.add("s", "", [b"b" * 100], b"kept", thumbnail=b"t")
+    for digest in history.get(old).digests:
+        os.utime(os.path.join(str(tmp_path), digest[:2], digest), (0, 0))
+    blobs.max_bytes = blobs.total_bytes + 50
+    newest = history.add("s", "", [b"c" * 100], b"new", thumbnail=b"t")
+    assert [entry.entry_id for entry in history.entries()] == [newest, kept]
+    assert history.memory_usage()["entries"] == 2
+
+
+def test_global_budget_trims_the_largest_session(tmp_path):
+    blobs = BlobStore(str(tmp_path))
+    budget = MemoryBudget(global_budget=150)
+    big = HistoryStore(blobs, budget)
+    small = HistoryStore(blobs, budget)
+    for i in range(2):
+        big.load_images(big.add("s", "", [bytes([i]) * 100], b"o", thumbnail=b"t"))
+    small.load_images(small.add("s", "", [b"s" * 40], b"o", thumbnail=b"t"))
+    assert big.hot_bytes + small.hot_bytes <= 150
+    assert small.hot_bytes == 40
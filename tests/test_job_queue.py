@@ -0,0 +1,110 @@
+import threading
+import time
+
+import cancellation
+from job_queue import CANCELLED, DONE, FAILED, QUEUED, RUNNING, JobQueue
+from tryon import StreamEvent
+
+
+def events(text="hi", image=b"img"):
+    def run():
+        yield StreamEvent("text", text=text)
+        yield StreamEvent("image", image=image)
+        yield StreamEvent("done", text=text, images=[image])
+    return run
+
+
+def blocker(release):
+    def run():
+        release.wait(5)
+        yield StreamEvent("done")
+    return run
+
+
+def test_job_runs_to_done():
+    queue = JobQueue(workers=1)
+    job = queue.wait(queue.submit("alice", events()), timeout=5)
+    assert job.state == DONE
+    assert job.text == "hi"
+    assert job.images == [b"img"]
+    assert queue.stats()["completed"] == 1
+
+
+def test_failure_is_recorded():
+    def boom():
+        raise RuntimeError("boom")
+
+    queue = JobQueue(workers=1)
+    job = queue.wait(queue.submit("alice", boom), timeout=5)
+    assert job.state == FAILED
+    assert str(job.error) == "boom"
+
+
+def test_owners_take_turns_and_positions_follow_dispatch_order():
+    queue = JobQueue(workers=1)
+    release = threading.Event()
+    queue.submit("busy", blocker(release))
+    time.sleep(0.05)
+    a1 = queue.submit("alice", events())
+    a2 = queue.submit("alice", events())
+    a3 = queue.submit("alice", events())
+    b1 = queue.submit("bob", events())
+    # alice, bob, alice, alice
+    assert [queue.position(job_id) for job_id in (a1, a2, a3, b1)] == [0, 2, 3, 1]
+    release.set()
+    for job_id in (a1, a2, a3, b1):
+        queue.wait(job_id, timeout=5)
+    order = sorted((queue.get(job_id) for job_id in (a1, a2, a3, b1)), key=lambda job: job.started)
+    assert [job.job_id for job in order] == [a1, b1, a2, a3]
+
+
+def test_priority_runs_first():
+    queue = JobQueue(workers=1)
+    release = threading.Event()
+    queue.submit("busy", blocker(release))
+    time.sleep(0.05)
+    low = queue.submit("alice", events())
+    high = queue.submit("bob", events(), priority=5)
+    assert queue.position(high) == 0
+    assert queue.position(low) == 1
+    release.set()
+
+
+def test_cancel_queued_job():
+    queue = JobQueue(workers=1)
+    release = threading.Event()
+    queue.submit("busy", blocker(release))
+    time.sleep(0.05)
+    job_id = queue.submit("alice", events())
+    assert queue.get(job_id).state == QUEUED
+    assert not queue.cancel(job_id, owner="mallory")
+    assert queue.cancel(job_id, owner="alice")
+    assert queue.get(job_id).state == CANCELLED
+    release.set()
+
+
+def test_cancel_stops_a_job_while_it_waits():
+    def waiting():
+        cancellation.sleep(30)
+        yield StreamEvent("done")
+
+    queue = JobQueue(workers=1)
+    job_id = queue.submit("alice", waiting)
+    deadline = time.monotonic() + 5
+    while queue.get(job_id).state != RUNNING and time.monotonic() < deadline:
+        time.sleep(0.01)
+    start = time.monotonic()
+    assert queue.cancel(job_id)
+    job = queue.wait(job_id, timeout=5)
+    assert job.state == CANCELLED
+    assert time.monotonic() - start < 1
+
+
+def test_finished_jobs_are_pruned():
+    queue = JobQueue(workers=1, max_retained=1)
+    first = queue.submit("alice", events())
+    queue.wait(first, timeout=5)
+    second = queue.submit("alice", events())
+    queue.wait(second, timeout=5)
+    assert queue.get(first) is None
+    assert queue.get(second).state == DONE
@@ -0,0 +1,80 @@
+import time
+
+import pytest
+from google.genai import errors
+
+from key_pool import KeyPool, KeysExhausted, parse_keys
+
+
+def rate_limit_error(retry_after="30s", per_day=False):
+    details = [{"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": retry_after}]
+    if per_day:
+        details.append({"@type": "type.googleapis.com/google.rpc.QuotaFailure",
+                        "violations": [{"quotaId": "GenerateRequestsPerDayPerProject"}]})
+    return errors.APIError(429, {"error": {"code": 429, "status": "RESOURCE_EXHAUSTED", "message": "",
+                                           "details": details}})
+
+
+def test_parse_keys():
+    keys = parse_keys("team-a=AIzaAAAA@60, AIzaBBBB", rpm=10)
+    assert [(k.label, k.api_key, k.rpm) for k in keys] == [("team-a", "AIzaAAAA", 60.0), ("key-…BBBB", "AIzaBBBB", 10)]
+
+
+def test_choose_balances_by_weight():
+    pool = KeyPool(parse_keys("big=a@20,small=b@10"))
+    big, small = pool.keys
+    counts = {big.label: 0, small.label: 0}
+    for _ in range(15):
+        key = pool.choose()
+        pool.begin(key)
+        counts[key.label] += 1
+    assert counts == {"big": 10, "small": 5}
+
+
+def test_rate_limited_key_is_quarantined():
+    pool = KeyPool(parse_keys("a=a,b=b"))
+    a, b = pool.keys
+    pool.begin(a)
+    pool.finish(a, rate_limit_error("30s"))
+    assert a.in_flight == 0
+    assert a.quarantined_until > time.monotonic() + 25
+    assert pool.choose() is b
+    assert pool.choose(exclude={b}) is None
+
+
+def test_short_quarantine_is_waited_for():
+    pool = KeyPool(parse_keys("a=a"), max_wait_seconds=10)
+    key = pool.keys[0]
+    pool.quarantine(key, rate_limit_error("2s"))
+    assert pool.choose() is key
+
+
+def test_long_quarantine_fails_fast():
+    pool = KeyPool(parse_keys("a=a,b=b"), max_wait_seconds=1)
+    for key in pool.keys:
+        pool.quarantine(key, rate_limit_error("30s"))
+    with pytest.raises(KeysExhausted) as info:
+        pool.choose()
+    assert info.value.retry_in > 25
+    assert not info.value.quota
+
+
+def test_exhausted_quota_on_every_key():
+    pool = KeyPool(parse_keys("a=a,b=b"), quota_quarantine_seconds=600)
+    for key in pool.keys:
+        pool.quarantine(key, rate_limit_error(per_day=True))
+    with pytest.raises(KeysExhausted) as info:
+        pool.choose()
+    assert info.value.quota
+
+
+def test_release_and_stats():
+    pool = KeyPool(parse_keys("a=a@10"))
+    key = pool.keys[0]
+    pool.begin(key, tokens=100)
+    pool.release(key)
+    row = pool.stats()[0]
+    assert row["in_flight"] == 0
+    assert row["requests_last_minute"] == 1
+    assert row["tokens_last_minute"] == 100
+    assert pool.utilization() == pytest.approx(0.1)
@@ -0,0 +1,61 @@
+import time
+
+from conftest import fast_config
+from fake_gemini import FakeClient
+from model_registry import ModelRegistry, is_model_fault
+from rate_limiter import FATAL, RATE_LIMIT, RETRYABLE
+
+
+def test_discovery_is_cached_on_disk(tmp_path):
+    path = str(tmp_path / "models.json")
+    client = FakeClient(fast_config())
+    registry = ModelRegistry(path=path, ttl_seconds=3600)
+    names = registry.image_models(client)
+    assert names[0] == "gemini-2.5-flash-image-preview"
+    assert "gemini-2.5-flash" not in names
+    # A new process reads the list from disk instead of listing again
+    assert ModelRegistry(path=path, ttl_seconds=3600).image_models(None) == names
+
+
+def test_discovery_failure_falls_back_to_preferred(tmp_path):
+    class Broken:
+        class models:
+            @staticmethod
+            def list():
+                raise ConnectionError("offline")
+
+    registry = ModelRegistry(path=str(tmp_path / "models.json"), preferred=("preferred-image",))
+    assert registry.image_models(Broken()) == ["preferred-image"]
+
+
+def test_failing_model_is_degraded_and_skipped():
+    models = ["a-image", "b-image"]
+    registry = ModelRegistry(preferred=models, pinned=models, failure_threshold=2, cooldown_seconds=0.05,
+                             explore_every=0)
+    assert registry.choose() == "a-image"
+    for _ in range(2):
+        registry.record("a-image", ok=False, error="503")
+    assert not registry.healthy("a-image")
+    assert registry.choose() == "b-image"
+    assert registry.choose(exclude={"b-image"}) == "a-image"
+    time.sleep(0.06)
+    assert registry.healthy("a-image")
+
+
+def test_fastest_healthy_model_wins():
+    models = ["slow-image", "fast-image"]
+    registry = ModelRegistry(preferred=models, pinned=models, explore_every=0)
+    registry.record("slow-image", ok=True, latency=5.0)
+    registry.record("fast-image", ok=True, latency=1.0)
+    assert registry.choose() == "fast-image"
+
+
+def test_is_model_fault():
+    class Gone(Exception):
+        code = 404
+
+    assert is_model_fault(RETRYABLE, Exception())
+    # Quotas are per key, not per model
+    assert not is_model_fault(RATE_LIMIT, Exception())
+    assert not is_model_fault(FATAL, ValueError())
+    assert is_model_fault(FATAL, Gone())
@@ -0,0 +1,38 @@
+import io
+
+import pytest
+from PIL import Image
+
+from fake_gemini import render_payload
+from output_images import GeneratedImage, decode_outputs, sniff_format
+
+
+def test_sniff_format():
+    assert sniff_format(render_payload(64, "png")) == "png"
+    assert sniff_format(render_payload(64, "jpeg")) == "jpeg"
+    assert sniff_format(render_payload(64, "webp")) == "webp"
+    assert sniff_format(b"garbage") is None
+
+
+def test_original_download_is_the_payload():
+    data = render_payload(64, "png")
+    download = GeneratedImage(data).download()
+    assert download.data is data
+    assert (download.mime_type, download.extension) == ("image/png", "png")
+
+
+def test_transcoded_download_is_memoized():
+    output = GeneratedImage(render_payload(64, "png"))
+    first = output.download("jpeg", quality=80)
+    assert sniff_format(first.data) == "jpeg"
+    assert output.download("jpeg", quality=80) is first
+    with pytest.raises(ValueError):
+        output.download("tiff")
+
+
+def test_display_is_bounded():
+    output = decode_outputs([render_payload(256, "png")])[0]
+    preview = Image.open(io.BytesIO(output.display(max_side=100)))
+    assert max(preview.size) <= 100
+    # Small enough already: shown as is
+    assert output.display(max_side=4096) is output.data
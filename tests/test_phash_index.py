@@ -0,0 +1,67 @@
+from benchmarks.bench_phash import frame_bytes
+from phash_index import PerceptualIndex, hash_image_bytes
+
+
+def test_recapture_hashes_close_and_other_photos_far():
+    original = hash_image_bytes(frame_bytes(1))
+    recapture = hash_image_bytes(frame_bytes(1, shift=4, quality=70))
+    other = hash_image_bytes(frame_bytes(2))
+    assert bin(original ^ recapture).count("1") <= 4
+    assert bin(original ^ other).count("1") > 4
+
+
+def test_lookup_is_per_context(tmp_path):
+    index = PerceptualIndex(str(tmp_path / "index.jsonl"))
+    index.add(0b1011, "ctx", "key-1")
+    assert index.lookup(0b1010, "ctx").key == "key-1"
+    assert index.lookup(0b1010, "other") is None
+    assert index.lookup(0b1011 ^ 0xFFFF, "ctx") is None
+
+
+def test_find_counts_hits_only_with_data(tmp_path):
+    index = PerceptualIndex(str(tmp_path / "index.jsonl"))
+    index.add(0b1011, "ctx", "key-1")
+    match, data = index.find(0b1011, "ctx", {"key-1": "result"}.get)
+    assert (match.key, data) == ("key-1", "result")
+    assert (index.hits, index.misses) == (1, 0)
+
+
+def test_find_drops_stale_entries_and_keeps_searching(tmp_path):
+    path = str(tmp_path / "index.jsonl")
+    index = PerceptualIndex(path)
+    index.add(0b0000, "ctx", "evicted")
+    index.add(0b0011, "ctx", "cached")
+    match, data = index.find(0b0000, "ctx", {"cached": "result"}.get)
+    assert (match.key, match.distance, data) == ("cached", 2, "result")
+    assert len(index) == 1
+    # The removal is persisted as a tombstone
+    assert len(PerceptualIndex(path)) == 1
+
+
+def test_find_miss(tmp_path):
+    index = PerceptualIndex(str(tmp_path / "index.jsonl"))
+    index.add(0b1, "ctx", "gone")
+    assert index.find(0b1, "ctx", lambda key: None) == (None, None)
+    assert (index.hits, index.misses, len(index)) == (0, 1, 0)
+
+
+def test_index_survives_restart(tmp_path):
+    path = str(tmp_path / "index.jsonl")
+    PerceptualIndex(path).add(42, "ctx", "key")
+    assert PerceptualIndex(path).lookup(42, "ctx").key == "key"
+    # Another hash method ignores these entries
+    assert PerceptualIndex(path, method="dhash").lookup(42, "ctx") is None
+
+
+def test_malformed_lines_are_skipped(tmp_path):
+    path = tmp_path / "index.jsonl"
+    PerceptualIndex(str(path)).add(42, "ctx", "key")
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"hash": "2a", "context": "ctx"}\n')
+        f.write('{"key": "bad", "hash": "not-hex", "context": "ctx"}\n')
+        f.write('{"key": "null", "hash": null, "context": "ctx"}\n')
+        f.write('["not", "an", "entry"]\n')
+        f.write('{"key": "torn", "ha')
+    index = PerceptualIndex(str(path))
+    assert len(index) == 1
+    assert index.lookup(42, "ctx").key == "key"
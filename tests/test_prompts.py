@@ -0,0 +1,93 @@
+import hashlib
+import threading
+
+import pytest
+
+from conftest import fast_config
+from fake_gemini import FakeClient
+from prompts import REGISTRY, ContextCache, PromptTemplate
+
+# sha256 of the original inline try-on prompt (an f-string on style_preference); every
+# result cache key depends on it, so the template must still render it byte for byte
+ORIGINAL_PROMPT_SHA256 = "d2526f1e10efb387ec8f33d1c0902bd0962e0607170854423b50e45339bcee95"
+
+LONG_PREFIX = "Describe the garment in great detail. " * 160
+
+
+def test_v1_renders_the_original_prompt():
+    template = REGISTRY.get("tryon", "v1")
+    original = template.prefix + template.suffix.replace("{style}", "{style_preference}")
+    assert hashlib.sha256(original.encode()).hexdigest() == ORIGINAL_PROMPT_SHA256
+    assert template.render("casual").count("casual") == 2
+
+
+def test_match_splits_rendered_prompts():
+    template = REGISTRY.get("tryon", "v1")
+    assert REGISTRY.match(template.render("formal")) == (template, template.render_suffix("formal"))
+    assert REGISTRY.match("A custom prompt") is None
+
+
+def test_unknown_version():
+    with pytest.raises(KeyError):
+        REGISTRY.get("tryon", "v999")
+
+
+def test_short_prefix_is_sent_inline():
+    client = FakeClient(fast_config())
+    cache = ContextCache()
+    template = REGISTRY.get("tryon", "v1")
+    # The v1 prefix is far below the API's minimum cacheable size
+    assert not cache.eligible(template)
+    assert cache.handle(client, "model", template) is None
+    assert cache.creates == 0
+
+
+def test_long_prefix_is_cached_once():
+    client = FakeClient(fast_config())
+    cache = ContextCache()
+    template = PromptTemplate("long", "v1", LONG_PREFIX, "{style}")
+    assert cache.eligible(template)
+    name = cache.handle(client, "model", template)
+    assert name is not None
+    assert cache.handle(client, "model", template) == name
+    assert cache.creates == 1
+
+
+def test_create_runs_outside_the_lock():
+    client = FakeClient(fast_config())
+    cache = ContextCache()
+    template = PromptTemplate("long", "v1", LONG_PREFIX, "{style}")
+    entered, release = threading.Event(), threading.Event()
+    real_create = cache._create
+
+    def slow_create(*args):
+        entered.set()
+        release.wait(5)
+        return real_create(*args)
+
+    cache._create = slow_create
+    results = []
+    thread = threading.Thread(target=lambda: results.append(cache.handle(client, "model", template)))
+    thread.start()
+    assert entered.wait(5)
+    # While the upload runs, other requests neither block nor start a second upload
+    assert cache._lock.acquire(timeout=1)
+    cache._lock.release()
+    assert cache.handle(client, "model", template) is None
+    assert cache.stats()["creates"] == 0
+    release.set()
+    thread.join(5)
+    assert results[0] is not None
+    assert cache.creates == 1
+
+
+def test_failed_create_falls_back_inline():
+    # The fake backend rejects caches below its minimum, like the real API
+    client = FakeClient(fast_config(cache_min_tokens=10 ** 6))
+    cache = ContextCache(min_tokens=0)
+    template = PromptTemplate("long", "v1", LONG_PREFIX, "{style}")
+    assert cache.handle(client, "model", template) is None
+    assert cache.failures == 1
+    # Not retried until retry_seconds have passed
+    assert cache.handle(client, "model", template) is None
+    assert cache.failures == 1
@@ -0,0 +1,156 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from google.genai import errors
+
+import cancellation
+from key_pool import KeysExhausted
+from rate_limiter import (
+    FATAL,
+    RATE_LIMIT,
+    RETRYABLE,
+    RateLimiter,
+    RateLimitExceeded,
+    call_with_retries,
+    classify_error,
+    estimate_tokens,
+    is_quota_error,
+    raise_exhausted,
+    retry_after_seconds,
+)
+from request_policy import CircuitOpenError
+
+
+def api_error(code, status, message="", details=None):
+    body = {"error": {"code": code, "status": status, "message": message, "details": details or []}}
+    return errors.APIError(code, body)
+
+
+def test_classify_error():
+    assert classify_error(api_error(429, "RESOURCE_EXHAUSTED")) == RATE_LIMIT
+    assert classify_error(api_error(503, "UNAVAILABLE")) == RETRYABLE
+    assert classify_error(api_error(400, "INVALID_ARGUMENT")) == FATAL
+    assert classify_error(TimeoutError()) == RETRYABLE
+    assert classify_error(ValueError()) == FATAL
+    assert classify_error(RateLimitExceeded()) == RATE_LIMIT
+    # Known-down backend and keys fail fast instead of being retried
+    assert classify_error(CircuitOpenError(5)) == FATAL
+    assert classify_error(KeysExhausted(30)) == FATAL
+
+
+def test_retry_hint_and_quota():
+    hinted = api_error(429, "RESOURCE_EXHAUSTED", details=[
+        {"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": "7s"}])
+    assert retry_after_seconds(hinted) == 7.0
+    daily = api_error(429, "RESOURCE_EXHAUSTED", details=[
+        {"@type": "type.googleapis.com/google.rpc.QuotaFailure",
+         "violations": [{"quotaId": "GenerateRequestsPerDayPerProject"}]}])
+    assert is_quota_error(daily)
+    assert not is_quota_error(hinted)
+
+
+def test_reserve_queues_callers_in_order():
+    limiter = RateLimiter(rpm=60, tpm=10 ** 9)
+    waits = [limiter.reserve() for _ in range(62)]
+    assert waits[:60] == [0.0] * 60
+    # One request per second once the bucket is empty
+    assert waits[60] == pytest.approx(1.0, abs=0.05)
+    assert waits[61] == pytest.approx(2.0, abs=0.05)
+    assert limiter.throttled == 2
+
+
+def test_try_acquire_and_refund():
+    limiter = RateLimiter(rpm=1, tpm=10 ** 9)
+    assert limiter.try_acquire()
+    assert not limiter.try_acquire()
+    limiter.refund()
+    assert limiter.try_acquire()
+    assert limiter.granted == 1
+
+
+def test_pause_holds_back_everyone():
+    limiter = RateLimiter(rpm=1000, tpm=10 ** 9)
+    limiter.pause(5)
+    assert limiter.current_wait() == pytest.approx(5, abs=0.1)
+    assert limiter.server_pauses == 1
+
+
+def test_acquire_gives_capacity_back_when_cancelled():
+    limiter = RateLimiter(rpm=1, tpm=10 ** 9)
+    limiter.reserve()
+    event = threading.Event()
+    threading.Timer(0.05, event.set).start()
+    start = time.monotonic()
+    with cancellation.cancel_scope(event), pytest.raises(cancellation.Cancelled):
+        limiter.acquire()
+    assert time.monotonic() - start < 1
+    assert limiter.queue_depth == 0
+    # Only the first reservation is still held
+    assert limiter.granted == 1
+
+
+def test_acquire_async_gives_capacity_back_when_cancelled():
+    limiter = RateLimiter(rpm=1, tpm=10 ** 9)
+    limiter.reserve()
+
+    async def cancel_waiter():
+        task = asyncio.create_task(limiter.acquire_async())
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_waiter())
+    assert limiter.queue_depth == 0
+    assert limiter.granted == 1
+
+
+def test_settle_corrects_token_bucket():
+    limiter = RateLimiter(rpm=1000, tpm=10_000)
+    limiter.reserve(tokens=8_000)
+    limiter.settle(8_000, 2_000)
+    assert limiter.current_wait(tokens=8_000) == 0.0
+
+
+def test_call_with_retries_retries_transient_errors(monkeypatch):
+    monkeypatch.setattr("rate_limiter.backoff_seconds", lambda attempt, **_: 0.0)
+    calls = []
+
+    def flaky(attempt):
+        calls.append(attempt)
+        if attempt < 2:
+            raise api_error(503, "UNAVAILABLE")
+        return "ok"
+
+    assert call_with_retries(flaky, max_retries=3, limiter=RateLimiter(1000, 10 ** 9)) == "ok"
+    assert calls == [0, 1, 2]
+
+
+def test_call_with_retries_maps_exhausted_rate_limits():
+    def limited(attempt):
+        raise api_error(429, "RESOURCE_EXHAUSTED", details=[
+            {"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": "0s"}])
+
+    with pytest.raises(RateLimitExceeded):
+        call_with_retries(limited, max_retries=1, limiter=RateLimiter(1000, 10 ** 9))
+
+
+def test_fatal_errors_are_not_retried():
+    with pytest.raises(ValueError):
+        raise_exhausted(ValueError("bad image"))
+    calls = []
+
+    def bad(attempt):
+        calls.append(attempt)
+        raise ValueError("bad image")
+
+    with pytest.raises(ValueError):
+        call_with_retries(bad, max_retries=3, limiter=RateLimiter(1000, 10 ** 9))
+    assert calls == [0]
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("x" * 400) == 100 + 2 * 1290
+    assert estimate_tokens("x" * 400, input_images=0, output_images=0) == 100
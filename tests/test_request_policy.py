@@ -0,0 +1,121 @@
+import time
+
+import pytest
+from google.genai import errors
+
+from request_policy import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    CircuitBreaker,
+    CircuitOpenError,
+    FirstChunkTimeout,
+    RequestPolicy,
+)
+
+
+def test_breaker_opens_at_error_rate_and_probes_after_cooldown():
+    breaker = CircuitBreaker(window=4, min_calls=4, error_rate_threshold=0.5, open_seconds=0.05)
+    for ok in (True, False, True, False):
+        breaker.allow()
+        breaker.record(ok)
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+    time.sleep(0.06)
+    breaker.allow()
+    assert breaker.state == HALF_OPEN
+    # Only one probe at a time
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+    breaker.record(True)
+    assert breaker.state == CLOSED
+
+
+def test_failed_probe_reopens():
+    breaker = CircuitBreaker(window=2, min_calls=2, open_seconds=0.01)
+    for _ in range(2):
+        breaker.record(False)
+    time.sleep(0.02)
+    breaker.allow()
+    breaker.record(False)
+    assert breaker.state == OPEN
+    assert breaker.trips == 2
+
+
+def test_released_probe_lets_another_through():
+    breaker = CircuitBreaker(window=2, min_calls=2, open_seconds=0.01)
+    for _ in range(2):
+        breaker.record(False)
+    time.sleep(0.02)
+    breaker.allow()
+    breaker.release()
+    breaker.allow()
+
+
+def test_client_errors_do_not_count_against_the_backend():
+    policy = RequestPolicy(breaker=CircuitBreaker(window=2, min_calls=2))
+    for _ in range(3):
+        policy.breaker.allow()
+        policy.finish(ValueError("bad image"))
+    assert policy.breaker.state == CLOSED
+
+
+def test_rate_limits_alone_never_open_the_breaker():
+    policy = RequestPolicy(breaker=CircuitBreaker(window=4, min_calls=2, error_rate_threshold=0.5))
+    rate_limited = errors.APIError(429, {"error": {"code": 429, "status": "RESOURCE_EXHAUSTED", "message": ""}})
+    for _ in range(10):
+        policy.breaker.allow()
+        policy.finish(rate_limited)
+    assert policy.breaker.state == CLOSED
+    assert policy.breaker.error_rate == 0
+
+
+def test_stream_passes_chunks_through():
+    policy = RequestPolicy(hedge=False)
+    assert list(policy.stream(lambda: iter([1, 2, 3]))) == [1, 2, 3]
+    assert policy.stats()["breaker"]["state"] == CLOSED
+
+
+def test_first_chunk_timeout():
+    policy = RequestPolicy(ttfc_timeout=0.05, hedge=False)
+
+    def stalled():
+        time.sleep(1)
+        yield 1
+
+    with pytest.raises(FirstChunkTimeout):
+        list(policy.stream(stalled))
+    assert policy.timeouts == 1
+
+
+def test_hedge_wins_when_primary_stalls():
+    policy = RequestPolicy(hedge_delay=0.05, min_hedge_delay=0.05)
+    opened = []
+
+    def open_stream():
+        opened.append(1)
+        if len(opened) == 1:
+            time.sleep(1)
+        yield "chunk"
+
+    assert list(policy.stream(open_stream)) == ["chunk"]
+    assert policy.hedges == 1
+    assert policy.hedge_wins == 1
+
+
+def test_hedge_skipped_without_capacity():
+    policy = RequestPolicy(hedge_delay=0.02, min_hedge_delay=0.02)
+    asked = []
+
+    def slow():
+        time.sleep(0.1)
+        yield "chunk"
+
+    def can_hedge():
+        asked.append(1)
+        return False
+
+    assert list(policy.stream(slow, can_hedge=can_hedge)) == ["chunk"]
+    assert asked == [1]
+    assert policy.hedges == 0
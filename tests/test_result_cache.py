@@ -0,0 +1,56 @@
+import os
+import time
+
+from result_cache import ResultCache
+
+
+def test_put_and_get(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    key = ResultCache.make_key(b"photo", "prompt", "model", None)
+    assert cache.get(key) is None
+    cache.put(key, "text", [b"one", b"two"])
+    assert cache.get(key) == ("text", [b"one", b"two"])
+    assert (cache.hits, cache.misses, cache.stores) == (1, 1, 1)
+
+
+def test_key_covers_every_input():
+    base = ResultCache.make_key(b"photo", "prompt", "model", None)
+    assert ResultCache.make_key(b"photo2", "prompt", "model", None) != base
+    assert ResultCache.make_key(b"photo", "prompt2", "model", None) != base
+    assert ResultCache.make_key(b"photo", "prompt", "model2", None) != base
+
+
+def test_index_survives_restart(tmp_path):
+    ResultCache(str(tmp_path)).put("k", "text", [b"data"])
+    assert ResultCache(str(tmp_path)).get("k") == ("text", [b"data"])
+
+
+def test_lru_eviction(tmp_path):
+    cache = ResultCache(str(tmp_path), max_bytes=300)
+    cache.put("old", "", [b"x" * 80])
+    # Distinct mtimes so recency is unambiguous
+    time.sleep(0.01)
+    cache.put("new", "", [b"y" * 80])
+    time.sleep(0.01)
+    cache.get("old")
+    cache.put("third", "", [b"z" * 80])
+    assert cache.get("new") is None
+    assert cache.get("old") is not None
+    assert cache.evictions >= 1
+
+
+def test_expired_entries_miss(tmp_path):
+    cache = ResultCache(str(tmp_path), ttl_seconds=0)
+    cache.put("k", "text", [b"data"])
+    time.sleep(0.01)
+    assert cache.get("k") is None
+    assert cache.expirations == 1
+    assert not os.path.exists(cache._path("k"))
+
+
+def test_uncounted_probe_leaves_hit_rate_alone(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    cache.put("k", "text", [b"img"])
+    assert cache.get("k", count=False) == ("text", [b"img"])
+    assert cache.get("missing", count=False) is None
+    assert (cache.hits, cache.misses) == (0, 0)
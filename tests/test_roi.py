@@ -0,0 +1,36 @@
+import io
+
+import pytest
+from PIL import Image
+
+from benchmarks.bench_roi import synthetic_subject_frame
+from fake_gemini import render_payload
+from roi import Region, composite, crop_to_region, detect_region, estimate_image_tokens
+
+
+def test_detects_the_subject():
+    frame = Image.open(io.BytesIO(synthetic_subject_frame(1280, 720)))
+    region = detect_region(frame)
+    assert region is not None
+    assert 0.04 <= region.fraction <= 0.8
+    assert crop_to_region(frame, region).size == region.size
+
+
+def test_blank_frame_keeps_the_whole_frame():
+    assert detect_region(Image.new("RGB", (640, 480), (200, 200, 200))) is None
+
+
+# Pillow deprecates passing mode= to fromarray
+@pytest.mark.filterwarnings("error::DeprecationWarning")
+def test_composite_pastes_back_into_the_frame():
+    frame = Image.new("RGB", (400, 300), "white")
+    region = Region(box=(100, 50, 300, 250), frame_size=frame.size)
+    result = Image.open(io.BytesIO(composite(frame, region, render_payload(64, "png"))))
+    assert result.size == frame.size
+    assert result.getpixel((5, 5)) == (255, 255, 255)
+    assert result.getpixel((200, 150)) != (255, 255, 255)
+
+
+def test_estimate_image_tokens():
+    assert estimate_image_tokens(300, 300) == 258
+    assert estimate_image_tokens(1536, 768) == 2 * 258
@@ -0,0 +1,100 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import cancellation
+from singleflight import SingleFlight
+
+
+def slow_events(started, release, items=("a", "b", "c")):
+    def make():
+        started.append(1)
+        release.wait(5)
+        yield from items
+    return make
+
+
+def test_concurrent_callers_share_one_generation():
+    flight = SingleFlight()
+    started, release = [], threading.Event()
+    results = [None, None]
+
+    def consume(i):
+        results[i] = list(flight.stream("key", slow_events(started, release)))
+
+    threads = [threading.Thread(target=consume, args=(i,)) for i in range(2)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert results == [["a", "b", "c"], ["a", "b", "c"]]
+    assert len(started) == 1
+    assert flight.stats()["joined"] == 1
+    assert flight.in_flight() == 0
+
+
+def test_errors_reach_every_waiter():
+    flight = SingleFlight()
+
+    def failing():
+        yield "partial"
+        raise RuntimeError("boom")
+
+    events = []
+    with pytest.raises(RuntimeError, match="boom"):
+        for event in flight.stream("key", failing):
+            events.append(event)
+    assert events == ["partial"]
+
+
+def test_last_waiter_leaving_cancels_the_flight():
+    flight = SingleFlight()
+    produced = []
+
+    def endless():
+        while True:
+            produced.append(1)
+            yield len(produced)
+            time.sleep(0.01)
+
+    stream = flight.stream("key", endless)
+    next(stream)
+    stream.close()
+    assert flight.stats()["cancelled"] == 1
+    time.sleep(0.05)
+    count = len(produced)
+    time.sleep(0.05)
+    assert len(produced) <= count + 1
+
+
+def test_cancelled_job_stops_waiting_on_a_shared_flight():
+    flight = SingleFlight()
+    release = threading.Event()
+    event = threading.Event()
+    threading.Timer(0.05, event.set).start()
+    start = time.monotonic()
+    with cancellation.cancel_scope(event), pytest.raises(cancellation.Cancelled):
+        list(flight.stream("key", slow_events([], release)))
+    assert time.monotonic() - start < 2
+    release.set()
+
+
+def test_async_callers_share_one_task():
+    flight = SingleFlight()
+    calls = []
+
+    async def produce():
+        calls.append(1)
+        await asyncio.sleep(0.02)
+        return "result"
+
+    async def main():
+        return await asyncio.gather(*(flight.run_async("key", produce) for _ in range(3)))
+
+    assert asyncio.run(main()) == ["result"] * 3
+    assert calls == [1]
+    assert flight.in_flight() == 0
@@ -0,0 +1,40 @@
+import json
+
+import pytest
+
+from telemetry import METRICS, Metrics, current_trace_id, percentile, size_class, span, trace
+
+
+def test_counters_and_prometheus_text():
+    metrics = Metrics()
+    metrics.inc("vtryon_test_total", outcome="ok")
+    metrics.inc("vtryon_test_total", 2, outcome="error")
+    metrics.observe("vtryon_test_seconds", 0.02, stage="send")
+    assert metrics.counter_total("vtryon_test_total") == 3
+    assert metrics.counter_total("vtryon_test_total", outcome="error") == 2
+    text = metrics.prometheus_text()
+    assert 'vtryon_test_total{outcome="ok"} 1' in text
+    assert "vtryon_test_seconds_bucket" in text
+
+
+def test_span_records_stage_and_error(monkeypatch, tmp_path):
+    path = tmp_path / "trace.jsonl"
+    monkeypatch.setenv("VTRYON_TRACE_FILE", str(path))
+    with trace("trace-1"):
+        assert current_trace_id() == "trace-1"
+        with span("encode", payload_bytes=1000) as encode_span:
+            encode_span.set(format="jpeg")
+        with pytest.raises(RuntimeError), span("send"):
+            raise RuntimeError("boom")
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [(r["stage"], r["trace"]) for r in records] == [("encode", "trace-1"), ("send", "trace-1")]
+    assert records[0]["format"] == "jpeg"
+    assert records[1]["error"] == "RuntimeError"
+    assert METRICS.summary()["stages"]["encode"]["count"] >= 1
+
+
+def test_percentile_and_size_class():
+    assert percentile([4, 1, 3, 2, 5], 50) == 3
+    assert percentile([], 95) is None
+    assert size_class(1000) == "lt64k"
+    assert size_class(10 * 2 ** 20) == "ge4m"
@@ -0,0 +1,180 @@
+import io
+import threading
+
+import pytest
+from PIL import Image
+
+import gemini_client
+import request_policy
+from conftest import fast_config, photo_bytes
+from fake_gemini import FakeClient
+from key_pool import get_key_pool
+from model_registry import get_model_registry
+from phash_index import PerceptualIndex
+from rate_limiter import RateLimitExceeded, get_rate_limiter
+from request_policy import CircuitBreaker, CircuitOpenError, RequestPolicy
+from result_cache import ResultCache
+from tryon import (
+    build_prompt,
+    generate_try_on,
+    prepare_request,
+    resolve_upload_format,
+    stream_try_on,
+    visualize_item_on_body,
+)
+
+
+@pytest.mark.parametrize("value, expected", [("WebP", "webp"), ("JPG", "jpeg"), (" png ", "png"), ("avif", "jpeg"),
+                                             ("", "jpeg")])
+def test_resolve_upload_format(value, expected):
+    assert resolve_upload_format(value) == expected
+
+
+def test_generates_text_and_image(fake_client, photo):
+    events = list(stream_try_on(fake_client, photo, "prompt"))
+    assert [event.kind for event in events] == ["text", "text", "image", "done"]
+    done = events[-1]
+    assert done.text.startswith("Fake try-on description")
+    assert done.images == [events[2].image]
+    assert done.timings["total"] >= done.timings["ttfb"] > 0
+
+
+def test_visualize_item_on_body(fake_client):
+    photo = Image.new("RGB", (1600, 1200), "white")
+    text, images = visualize_item_on_body(fake_client, photo, "casual")
+    assert text and len(images) == 1
+    img_bytes, mime_type, prompt = prepare_request(photo, "casual")
+    assert mime_type == "image/jpeg"
+    assert max(Image.open(io.BytesIO(img_bytes)).size) <= 1024
+    assert prompt == build_prompt("casual")
+
+
+def test_identical_request_is_served_from_cache(fake_client, photo, tmp_path):
+    cache = ResultCache(str(tmp_path))
+    first = generate_try_on(fake_client, photo, "prompt", cache=cache)
+    events = list(stream_try_on(fake_client, photo, "prompt", cache=cache))
+    assert events[-1].from_cache
+    assert (events[-1].text, events[-1].images) == first
+    assert fake_client.backend.requests == 1
+
+
+def test_near_duplicate_capture_reuses_result(fake_client, tmp_path):
+    from benchmarks.bench_phash import frame_bytes
+
+    cache = ResultCache(str(tmp_path / "results"))
+    index = PerceptualIndex(str(tmp_path / "index.jsonl"))
+    list(stream_try_on(fake_client, frame_bytes(3), "prompt", cache=cache, similar_index=index))
+    recapture = list(stream_try_on(fake_client, frame_bytes(3, shift=4, quality=70), "prompt", cache=cache,
+                                   similar_index=index))
+    assert recapture[-1].similar_distance is not None
+    assert fake_client.backend.requests == 1
+    # One miss for the exact key of each capture; the near-duplicate probe is not counted
+    assert (cache.hits, cache.misses) == (0, 2)
+    fresh = list(stream_try_on(fake_client, frame_bytes(3, shift=4, quality=70), "prompt", cache=cache,
+                               similar_index=index, reuse_similar=False))
+    assert fresh[-1].similar_distance is None
+    assert fake_client.backend.requests == 2
+
+
+@pytest.mark.parametrize("coalesce, expected", [(True, 1), (False, 3)])
+def test_concurrent_identical_requests_coalesce(photo, coalesce, expected):
+    client = FakeClient(fast_config(ttfc_ms=100))
+    results = []
+
+    def run():
+        results.append(generate_try_on(client, photo, "prompt", coalesce=coalesce))
+
+    threads = [threading.Thread(target=run) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    assert len(results) == 3 and all(images for _, images in results)
+    assert client.backend.requests == expected
+
+
+def test_fails_over_to_a_healthy_model(monkeypatch, photo):
+    monkeypatch.setenv("VTRYON_MODELS", "broken-image,backup-image")
+    client = FakeClient(fast_config(failing_models="broken-image"))
+    events = list(stream_try_on(client, photo, "prompt", coalesce=False))
+    assert [event.kind for event in events][0] == "retry"
+    assert events[-1].model == "backup-image"
+    assert events[-1].images
+
+
+def test_rate_limit_waits_instead_of_failing_over(monkeypatch, photo):
+    monkeypatch.setenv("VTRYON_MODELS", "first-image,backup-image")
+    client = FakeClient(fast_config(rate_limit_rate=1.0, retry_after_s=0.0))
+    with pytest.raises(RateLimitExceeded):
+        list(stream_try_on(client, photo, "prompt", max_retries=2, coalesce=False))
+    assert client.backend.rate_limited == 2
+    # The server hint paused the shared limiter, and neither model was blamed
+    assert get_rate_limiter().server_pauses == 1
+    registry = get_model_registry()
+    assert registry.healthy("first-image") and registry.healthy("backup-image")
+    assert [row["failures"] for row in registry.stats()] == [0, 0]
+
+
+def use_keys(monkeypatch, keys, config):
+    monkeypatch.setenv("GEMINI_API_KEYS", keys)
+    clients = {}
+    monkeypatch.setattr(gemini_client, "_clients", clients)
+    for entry in keys.split(","):
+        api_key = entry.split("=")[1].split("@")[0]
+        clients[api_key] = FakeClient(config)
+    # Hedge almost at once so the primary request is still waiting for its first chunk
+    monkeypatch.setattr(request_policy, "_request_policy", RequestPolicy(hedge_delay=0.05, min_hedge_delay=0.05))
+    return get_key_pool()
+
+
+def test_hedge_counts_against_its_key_and_releases_it(monkeypatch, photo):
+    pool = use_keys(monkeypatch, "a=key-a@1000,b=key-b@1000", fast_config(ttfc_ms=200))
+    events = list(stream_try_on(None, photo, "prompt", coalesce=False))
+    assert events[-1].images
+    assert request_policy.get_request_policy().hedges == 1
+    used = [key for key in pool.keys if key.requests]
+    assert len(used) == 1
+    # Primary and hedge both went out on the chosen key
+    assert used[0].requests == 2
+    assert used[0].limiter.granted == 2
+    assert get_rate_limiter().granted == 2
+    assert all(key.in_flight == 0 for key in pool.keys)
+
+
+def test_hedge_refused_by_key_gives_shared_capacity_back(monkeypatch, photo):
+    pool = use_keys(monkeypatch, "a=key-a@1,b=key-b@1", fast_config(ttfc_ms=200))
+    events = list(stream_try_on(None, photo, "prompt", coalesce=False))
+    assert events[-1].images
+    assert request_policy.get_request_policy().hedges == 0
+    assert sum(key.requests for key in pool.keys) == 1
+    assert get_rate_limiter().granted == 1
+    assert all(key.in_flight == 0 for key in pool.keys)
+
+
+def open_breaker(monkeypatch):
+    policy = RequestPolicy(breaker=CircuitBreaker(window=1, min_calls=1))
+    policy.breaker.allow()
+    policy.breaker.record(False)
+    monkeypatch.setattr(request_policy, "_request_policy", policy)
+
+
+def test_open_breaker_gives_capacity_back(monkeypatch, photo):
+    pool = use_keys(monkeypatch, "a=key-a@1000", fast_config())
+    open_breaker(monkeypatch)
+    with pytest.raises(CircuitOpenError):
+        list(stream_try_on(None, photo, "prompt", coalesce=False))
+    assert get_rate_limiter().granted == 0
+    assert pool.keys[0].limiter.granted == 0
+    assert pool.keys[0].in_flight == 0
+
+
+def test_custom_prompt_replaces_template():
+    assert build_prompt("casual", "  Just the hat  ") == "  Just the hat  "
+    assert "casual" in build_prompt("casual")
+
+
+def test_varied_photos_produce_distinct_requests(fake_client, tmp_path):
+    cache = ResultCache(str(tmp_path))
+    generate_try_on(fake_client, photo_bytes(1), "prompt", cache=cache)
+    generate_try_on(fake_client, photo_bytes(2), "prompt", cache=cache)
+    assert fake_client.backend.requests == 2
@@ -0,0 +1,619 @@
+"""
+Core virtual try-on pipeline shared by the Streamlit app and other tools.
+
+Kept free of Streamlit calls so it can be imported headless.
+"""
+from PIL import Image
+import contextlib
+import functools
+import io
+import logging
+import mimetypes
+import os
+import time
+from dataclasses import dataclass, field, replace
+
+import cancellation
+from key_pool import get_key_pool
+from model_registry import DEFAULT_MODEL, get_model_registry, is_model_fault
+from prompts import DEFAULT_TEMPLATE, REGISTRY, ContextCacheExpired, get_context_cache
+from result_cache import ResultCache
+from roi import DEFAULT_ROI_MODE, ROI_MODES, composite, crop_to_region, detect_region
+from singleflight import get_single_flight
+from request_policy import CircuitOpenError, get_request_policy
+from rate_limiter import FATAL, RATE_LIMIT, classify_error, estimate_tokens, get_rate_limiter, raise_exhausted, retry_delay
+from telemetry import count_attempt, count_request, record_stage, span
+
+logger = logging.getLogger(__name__)
+
+# Default image model; also the model name in result cache keys, whichever model actually serves
+MODEL_NAME = DEFAULT_MODEL
+
+# Longest side sent to the model. Gemini tiles image input at 768px and the
+# image model renders around 1024px, so larger uploads only cost bandwidth.
+DEFAULT_TARGET_SIZE = int(os.getenv("VTRYON_TARGET_SIZE", 1024))
+
+# Fraction of the target size a reduced JPEG decode may come out at
+DRAFT_TOLERANCE = 0.9
+
+# Upload encodings: name -> (PIL format, mime type, default quality)
+UPLOAD_FORMATS = {
+    "jpeg": ("JPEG", "image/jpeg", 90),
+    "webp": ("WEBP", "image/webp", 85),
+    "png": ("PNG", "image/png", None),
+}
+UPLOAD_FORMAT_ALIASES = {"jpg": "jpeg"}
+
+
+def resolve_upload_format(value):
+    """
+    Normalise a configured upload format; unknown values fall back to JPEG instead of failing every request
+    """
+    name = (value or "").strip().lower()
+    name = UPLOAD_FORMAT_ALIASES.get(name, name)
+    if name not in UPLOAD_FORMATS:
+        logger.warning("⚠️ Unknown upload format %r; using jpeg (choose from %s)", value, ", ".join(UPLOAD_FORMATS))
+        return "jpeg"
+    return name
+
+
+DEFAULT_UPLOAD_FORMAT = resolve_upload_format(os.getenv("VTRYON_UPLOAD_FORMAT", "jpeg"))
+
+# Helper function to optimize image for better AI processing
+def optimize_image_for_ai(photo, max_size=None):
+    """
+    Optimize image for better AI image generation results
+
+    For a JPEG that has not been decoded yet, the decoder is asked for a
+    reduced-size version (DCT scaling) so the full frame is never decoded.
+    The result may then be up to DRAFT_TOLERANCE under max_size, which
+    skips the resampling pass entirely (e.g. 1920px -> 960px for 1024).
+    """
+    max_size = max_size or DEFAULT_TARGET_SIZE
+
+    # Decode JPEGs at 1/2, 1/4 or 1/8 scale when that still covers the target
+    if photo.format == 'JPEG' and max(photo.size) > max_size:
+        scale = max_size * DRAFT_TOLERANCE / max(photo.size)
+        photo.draft('RGB', (int(photo.size[0] * scale), int(photo.size[1] * scale)))
+
+    # Decode here (a no-op if already loaded) so it is timed apart from resizing
+    with span("decode", width=photo.size[0], height=photo.size[1]):
+        photo.load()
+
+    with span("resize") as resize_span:
+        # Convert to RGB if needed
+        if photo.mode != 'RGB':
+            photo = photo.convert('RGB')
+
+        # Resize if too large
+        if max(photo.size) > max_size:
+            ratio = max_size / max(photo.size)
+            new_size = (int(photo.size[0] * ratio), int(photo.size[1] * ratio))
+            old_size = photo.size
+            # reducing_gap box-reduces by an integer factor before the LANCZOS pass
+            photo = photo.resize(new_size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+            logger.info("📐 Resized image from %s to %s for optimization", old_size, new_size)
+        resize_span.set(width=photo.size[0], height=photo.size[1])
+
+    return photo
+
+# Helper function to encode the optimized photo for upload
+def encode_image(photo, upload_format=None, quality=None):
+    """
+    Encode a PIL image to the bytes sent to the model
+
+    Returns (img_bytes, mime_type) for the chosen format in UPLOAD_FORMATS.
+    """
+    upload_format = (upload_format or DEFAULT_UPLOAD_FORMAT).lower()
+    if upload_format not in UPLOAD_FORMATS:
+        raise ValueError(f"Unknown upload format {upload_format!r}; choose from {', '.join(UPLOAD_FORMATS)}")
+    pil_format, mime_type, default_quality = UPLOAD_FORMATS[upload_format]
+
+    img_byte_arr = io.BytesIO()
+    if pil_format == 'PNG':
+        photo.save(img_byte_arr, format='PNG', compress_level=1)
+    else:
+        photo.save(img_byte_arr, format=pil_format, quality=quality or default_quality)
+    return img_byte_arr.getvalue(), mime_type
+
+# Helper function to resolve the prompt text for a request
+def build_prompt(style_preference, custom_prompt=""):
+    """
+    Return the custom prompt if provided, otherwise the enhanced default
+    """
+    if custom_prompt and custom_prompt.strip():
+        return custom_prompt
+
+    # Enhanced prompt for better image generation, compiled once in the registry
+    return REGISTRY.get(DEFAULT_TEMPLATE).render(style_preference)
+
+# Helper function to build the generation config
+def build_generate_config():
+    """
+    Enhanced configuration for better image quality
+    """
+    # Imported lazily: google.genai takes most of a second to import
+    from google.genai import types
+
+    return types.GenerateContentConfig(
+        response_modalities=["IMAGE", "TEXT"],
+        temperature=0.7,  # Balance between creativity and accuracy
+    )
+
+# Helper function to bound how long the HTTP client waits on one request
+def with_timeout(config, seconds):
+    """
+    Copy of a generation config whose HTTP request times out after seconds (unchanged if falsy)
+    """
+    if not seconds:
+        return config
+    from google.genai import types
+
+    return config.model_copy(update={"http_options": types.HttpOptions(timeout=int(seconds * 1000))})
+
+# Helper function to assemble the request contents
+def build_contents(img_bytes, prompt, mime_type="image/png"):
+    """
+    Build the multimodal user turn sent to the model
+    """
+    from google.genai import types
+
+    return [
+        types.Content(
+            role="user",
+            parts=[
+                types.Part.from_bytes(data=img_bytes, mime_type=mime_type),
+                types.Part.from_text(text=prompt),
+            ],
+        ),
+    ]
+
+@dataclass
+class ModelRequest:
+    """
+    Contents and config for one call; cache_handle is set when the prompt
+    prefix is referenced through a server-side context cache
+    """
+    contents: list
+    config: object
+    cache_handle: str = None
+    template: object = None
+
+# Helper function to assemble one call, using the cached prompt prefix when possible
+def build_request(client, img_bytes, prompt, mime_type, config, context_cache=None, model=MODEL_NAME):
+    """
+    Return a ModelRequest for the prompt
+
+    Prompts rendered from a cacheable registry template send only their
+    suffix and reference the prefix by cache name; anything else (custom
+    prompts, caching unavailable) is sent inline as before.
+    """
+    match = REGISTRY.match(prompt)
+    if match is not None:
+        template, suffix = match
+        handle = (context_cache or get_context_cache()).handle(client, model, template)
+        if handle is not None:
+            return ModelRequest(build_contents(img_bytes, suffix, mime_type),
+                                config.model_copy(update={"cached_content": handle}), handle, template)
+        return ModelRequest(build_contents(img_bytes, prompt, mime_type), config, template=template)
+    return ModelRequest(build_contents(img_bytes, prompt, mime_type), config)
+
+# Helper function to pull text and images out of a streamed chunk
+def parse_chunk(chunk):
+    """
+    Return (text, image_bytes, mime_type) for a streamed chunk; missing parts are None
+    """
+    if (
+        chunk.candidates is None
+        or chunk.candidates[0].content is None
+        or chunk.candidates[0].content.parts is None
+    ):
+        return None, None, None
+
+    part = chunk.candidates[0].content.parts[0]
+    if part.inline_data and part.inline_data.data:
+        return None, part.inline_data.data, part.inline_data.mime_type
+    if hasattr(chunk, 'text') and chunk.text:
+        return chunk.text, None, None
+    return None, None, None
+
+@dataclass
+class StreamEvent:
+    """
+    One step of a streamed generation
+
+    kind is "text" (a text delta in ``text``), "image" (a finished image in
+    ``image``), "retry" (the previous attempt failed; discard its partial
+    output) or "done" (``text``/``images`` hold the full result and
+    ``timings`` the latency breakdown). similar_distance is set when the
+    result was reused from a near-duplicate earlier capture. model names
+    the model that produced a generated result.
+    """
+    kind: str
+    text: str = ""
+    image: bytes = None
+    mime_type: str = None
+    images: list = field(default_factory=list)
+    attempt: int = 0
+    timings: dict = field(default_factory=dict)
+    from_cache: bool = False
+    similar_distance: int = None
+    model: str = None
+
+
+def _replay_cached(cached, similar_distance=None):
+    text_response, generated_images = cached
+    if text_response:
+        yield StreamEvent("text", text=text_response, from_cache=True, similar_distance=similar_distance)
+    for data_buffer in generated_images:
+        yield StreamEvent("image", image=data_buffer, from_cache=True, similar_distance=similar_distance)
+    yield StreamEvent("done", text=text_response, images=generated_images, from_cache=True,
+                      similar_distance=similar_distance,
+                      timings={"ttfb": 0.0, "first_image": 0.0, "total": 0.0})
+
+# Stream one prepared request to the model with retry logic
+def stream_try_on(client, img_bytes, prompt, max_retries=3, cache=None, limiter=None, mime_type="image/png",
+                  similar_index=None, reuse_similar=True, coalesce=True):
+    """
+    Yield StreamEvent objects as text deltas and images arrive from Gemini
+
+    Timings in the final event are seconds since the request was sent:
+    ttfb (first chunk), first_image and total.
+    If a ResultCache is given, identical requests are answered from disk.
+    With a PerceptualIndex as well, a near-duplicate of an earlier photo
+    (same prompt and model) replays that photo's result; pass
+    reuse_similar=False to force a fresh generation.
+    Concurrent identical requests share one generation (see singleflight)
+    unless coalesce=False.
+    Requests wait for capacity on the shared RateLimiter before being sent.
+    Each attempt goes to the model the ModelRegistry picks; a failed attempt
+    fails over to the next healthy model that has not been tried yet.
+    """
+    model = MODEL_NAME
+    generate_content_config = build_generate_config()
+
+    cache_key = None
+    if cache is not None:
+        cache_key = cache.make_key(img_bytes, prompt, model, generate_content_config)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            logger.info("⚡ Cache hit for request %s", cache_key[:12])
+            count_request("cache_hit", model=model)
+            yield from _replay_cached(cached)
+            return
+
+    photo_hash = context = None
+    if cache is not None and similar_index is not None:
+        photo_hash = similar_index.hash_bytes(img_bytes)
+        context = similar_index.context_key(prompt, model, generate_content_config)
+        # The probe is not a cache lookup of its own, so it must not move the hit/miss counters
+        fetch = functools.partial(cache.get, count=False)
+        match, cached = similar_index.find(photo_hash, context, fetch) if reuse_similar else (None, None)
+        if cached is not None:
+            logger.info("♻️ Near-duplicate capture (distance %d), reusing %s", match.distance, match.key[:12])
+            count_request("near_duplicate", model=model)
+            yield from _replay_cached(cached, similar_distance=match.distance)
+            return
+
+    limiter = limiter or get_rate_limiter()
+
+    def generate():
+        return _generate_stream(client, img_bytes, prompt, mime_type, generate_content_config, max_retries, limiter,
+                                cache, cache_key, similar_index, photo_hash, context)
+
+    if not coalesce:
+        yield from generate()
+        return
+    flight_key = cache_key or ResultCache.make_key(img_bytes, prompt, model, generate_content_config)
+    yield from get_single_flight().stream(flight_key, generate)
+
+# Run the model call with retries, streaming events as they arrive
+def _generate_stream(client, img_bytes, prompt, mime_type, generate_content_config, max_retries, limiter,
+                     cache, cache_key, similar_index, photo_hash, context):
+    registry = get_model_registry()
+    model = registry.choose(client)
+    tried = set()
+    tokens = estimate_tokens(prompt)
+    context_cache = get_context_cache()
+    policy = get_request_policy()
+    # With several API keys each attempt goes to the least loaded one (see key_pool)
+    pool = get_key_pool()
+    key = pool.choose(tokens) if pool.active else None
+    tried_keys = set()
+
+    # Retry logic for better reliability
+    for attempt in range(max_retries):
+        cancellation.check_cancelled()
+        labels = {"model": model, "attempt": attempt, "payload_bytes": len(img_bytes)}
+        with span("rate_limit_wait", **labels):
+            limiter.acquire(tokens)
+            if key is not None:
+                try:
+                    key.limiter.acquire(tokens)
+                except cancellation.Cancelled:
+                    limiter.refund(tokens)
+                    raise
+        attempt_client = key.client if key is not None else client
+        logger.info("🔄 Generating virtual try-on image... (Attempt %d/%d)", attempt + 1, max_retries)
+
+        generated_images = []
+        text_response = ""
+        total_tokens = None
+        usage = None
+        timings = {"ttfb": None, "first_image": None, "total": None}
+        request = build_request(attempt_client, img_bytes, prompt, mime_type, generate_content_config, context_cache,
+                                model)
+        # The transport gives up at the attempt deadline too, so abandoned requests do not linger
+        config = with_timeout(request.config, policy.attempt_deadline)
+
+        def open_stream(model=model, request=request, config=config, labels=labels, attempt_client=attempt_client):
+            # The sync SDK sends lazily, so most of the upload shows up in first_chunk
+            with span("send", **labels, cached_prefix=request.cache_handle is not None):
+                return attempt_client.models.generate_content_stream(
+                    model=model,
+                    contents=request.contents,
+                    config=config,
+                )
+
+        # Keys a hedge request was counted against this attempt
+        hedged = []
+
+        def can_hedge(key=key, hedged=hedged):
+            # The shared limiter first, so a refusal there takes nothing from the key
+            if not limiter.try_acquire(tokens):
+                return False
+            if key is None:
+                return True
+            # The hedge goes out on the same key, so it needs capacity there too
+            if not key.limiter.try_acquire(tokens):
+                limiter.refund(tokens)
+                return False
+            pool.begin(key, tokens)
+            hedged.append(key)
+            return True
+
+        if key is not None:
+            pool.begin(key, tokens)
+        start = time.perf_counter()
+        try:
+            # Deadlines, hedging and the circuit breaker (see request_policy)
+            chunks = policy.stream(open_stream, can_hedge=can_hedge)
+            with contextlib.closing(chunks) as stream:
+                for chunk in stream:
+                    if timings["ttfb"] is None:
+                        timings["ttfb"] = time.perf_counter() - start
+                        record_stage("first_chunk", timings["ttfb"], **labels)
+                    if chunk.usage_metadata and chunk.usage_metadata.total_token_count:
+                        total_tokens = chunk.usage_metadata.total_token_count
+                        usage = chunk.usage_metadata
+
+                    text, data_buffer, chunk_mime_type = parse_chunk(chunk)
+
+                    # Check for image data
+                    if data_buffer:
+                        if timings["first_image"] is None:
+                            timings["first_image"] = time.perf_counter() - start
+                        file_extension = mimetypes.guess_extension(chunk_mime_type)
+                        logger.info("✅ Received image data: %d bytes, mime: %s, ext: %s",
+                                    len(data_buffer), chunk_mime_type, file_extension)
+                        generated_images.append(data_buffer)
+                        yield StreamEvent("image", image=data_buffer, mime_type=chunk_mime_type, attempt=attempt)
+                    elif text:
+                        # Text response
+                        text_response += text
+                        logger.debug(text)
+                        yield StreamEvent("text", text=text, attempt=attempt)
+        except CircuitOpenError:
+            # Nothing was sent: give the capacity taken for this attempt back
+            limiter.refund(tokens)
+            if key is not None:
+                key.limiter.refund(tokens)
+                pool.release(key)
+            count_request("rejected", model=model)
+            raise
+        except Exception as e:
+            if context_cache.recover(e, request.cache_handle):
+                # The next attempt re-uploads the prefix or sends it inline
+                e = ContextCacheExpired(str(e))
+            kind = classify_error(e)
+            reason = "rate_limit" if kind == RATE_LIMIT else "error"
+            next_key = None
+            if key is not None:
+                pool.finish(key, e)
+                if kind == RATE_LIMIT:
+                    # Quotas are per key: another key with quota left can take the same model
+                    tried_keys.add(key)
+                    next_key = pool.choose(tokens, exclude=tried_keys)
+            next_model = None
+            if next_key is None and is_model_fault(kind, e) and not isinstance(e, ContextCacheExpired):
+                registry.record(model, ok=False, error=e)
+                tried.add(model)
+                next_model = registry.choose(client, exclude=tried)
+            if attempt >= max_retries - 1 or (kind == FATAL and next_model is None):
+                count_attempt("failed", model=model, reason=reason)
+                count_request("error", model=model)
+            if attempt >= max_retries - 1:
+                raise_exhausted(e)
+            if next_key is not None:
+                pool.switch(key, next_key, e)
+                count_attempt("failover", model=model, reason=reason)
+                key = next_key
+                yield StreamEvent("retry", attempt=attempt + 1)
+                continue
+            if next_model is not None:
+                # Another model is untried this request: switch to it straight away
+                registry.failover(model, next_model, e)
+                count_attempt("failover", model=model, reason=reason)
+                model = next_model
+                key = pool.choose(tokens) if pool.active else None
+                yield StreamEvent("retry", attempt=attempt + 1)
+                continue
+            delay = retry_delay(e, attempt, limiter)
+            count_attempt("retry", model=model, reason=reason)
+            yield StreamEvent("retry", attempt=attempt + 1)
+            if delay:
+                cancellation.sleep(delay)
+            model = registry.choose(client)
+            key = pool.choose(tokens) if pool.active else None
+            continue
+        except BaseException:
+            # Closed mid-stream (cancelled): the request ends without an outcome
+            if key is not None:
+                pool.release(key)
+            raise
+        finally:
+            # Whichever of the two requests lost was cancelled without an outcome
+            for hedged_key in hedged:
+                pool.release(hedged_key)
+
+        limiter.settle(tokens, total_tokens)
+        if key is not None:
+            key.limiter.settle(tokens, total_tokens)
+            pool.finish(key, tokens=total_tokens or tokens)
+        if request.template is not None:
+            context_cache.record(request.cache_handle, request.template, usage)
+        timings["total"] = time.perf_counter() - start
+        registry.record(model, ok=True, latency=timings["total"])
+        record_stage("stream", timings["total"] - (timings["ttfb"] or 0), **labels,
+                     output_bytes=sum(len(data) for data in generated_images))
+        count_attempt("ok", model=model)
+        count_request("generated", model=model)
+        logger.info("⏱️ TTFB %.2fs · first image %.2fs · total %.2fs",
+                    timings['ttfb'] or 0, timings['first_image'] or 0, timings['total'])
+        if cache is not None and generated_images:
+            cache.put(cache_key, text_response, generated_images)
+            if photo_hash is not None:
+                similar_index.add(photo_hash, context, cache_key)
+        yield StreamEvent("done", text=text_response, images=generated_images, attempt=attempt, timings=timings,
+                          model=model)
+        return
+
+    yield StreamEvent("done")
+
+# Send one prepared request to the model and wait for the full result
+def generate_try_on(client, img_bytes, prompt, max_retries=3, cache=None, limiter=None, mime_type="image/png",
+                    coalesce=True):
+    """
+    Run the Gemini request for already-encoded image bytes and a resolved prompt
+
+    Returns (text_response, generated_images) once the stream has finished.
+    Identical concurrent requests share one call unless coalesce=False.
+    """
+    for event in stream_try_on(client, img_bytes, prompt, max_retries=max_retries, cache=cache,
+                               limiter=limiter, mime_type=mime_type, coalesce=coalesce):
+        if event.kind == "done":
+            return event.text, event.images
+    return "", []
+
+# Helper function to preprocess the photo and resolve the prompt
+def prepare_request(photo, style_preference, custom_prompt="", upload_format=None, quality=None, max_size=None):
+    """
+    Return (img_bytes, mime_type, prompt) ready to send to the model
+    """
+    # Optimize image for better generation
+    photo = optimize_image_for_ai(photo, max_size=max_size)
+
+    # Convert PIL Image to bytes
+    with span("encode", format=upload_format or DEFAULT_UPLOAD_FORMAT) as encode_span:
+        img_bytes, mime_type = encode_image(photo, upload_format, quality)
+        encode_span.set(payload_bytes=len(img_bytes))
+
+    # Use custom prompt if provided, otherwise use enhanced default
+    prompt = build_prompt(style_preference, custom_prompt)
+    if custom_prompt and custom_prompt.strip():
+        logger.info("🎨 Using CUSTOM prompt:\n%s", prompt)
+    else:
+        logger.info("🎨 Using ENHANCED prompt with style: %s", style_preference)
+
+    return img_bytes, mime_type, prompt
+
+# Helper function to crop the photo to the person and held item before upload
+def apply_roi(photo, roi_mode=None, max_size=None):
+    """
+    Crop the photo to the detected person-and-item region
+
+    Returns (model_photo, frame, region). With roi_mode "off", or when no
+    useful region is found, region is None and model_photo is the photo
+    to send unchanged; otherwise frame is the optimized full frame and
+    model_photo the crop of it.
+    """
+    roi_mode = (roi_mode or DEFAULT_ROI_MODE).lower()
+    if roi_mode not in ROI_MODES:
+        raise ValueError(f"Unknown ROI mode {roi_mode!r}; choose from {', '.join(ROI_MODES)}")
+    if roi_mode == "off":
+        return photo, None, None
+
+    frame = optimize_image_for_ai(photo, max_size=max_size)
+    with span("roi_detect", width=frame.size[0], height=frame.size[1]) as roi_span:
+        region = detect_region(frame)
+        roi_span.set(fraction=round(region.fraction, 3) if region is not None else 1.0)
+    if region is None:
+        return frame, frame, None
+    logger.info("🔲 Cropping to %s (%.0f%% of the frame, found by %s)",
+                region.box, region.fraction * 100, "+".join(region.sources))
+    return crop_to_region(frame, region), frame, region
+
+# Paste generated crops back into the full frame as events stream past
+def _composite_events(events, frame, region):
+    composited = {}
+
+    def paste(data):
+        # The done event repeats the streamed images; composite each only once
+        if id(data) not in composited:
+            with span("composite", payload_bytes=len(data)):
+                composited[id(data)] = (data, composite(frame, region, data))
+        return composited[id(data)][1]
+
+    try:
+        for event in events:
+            if event.kind == "image":
+                event = replace(event, image=paste(event.image), mime_type="image/jpeg")
+            elif event.kind == "done" and event.images:
+                event = replace(event, images=[paste(data) for data in event.images])
+            yield event
+    finally:
+        events.close()
+
+# Stream the visualization of an item on body from a single photo
+def stream_item_on_body(client, photo, style_preference, custom_prompt="", max_retries=3, cache=None, limiter=None,
+                        upload_format=None, quality=None, max_size=None, similar_index=None, reuse_similar=True,
+                        roi_mode=None, coalesce=True):
+    """
+    Generator form of visualize_item_on_body yielding StreamEvent objects
+
+    roi_mode (default VTRYON_ROI) "crop" sends and returns only the detected
+    person-and-item region; "composite" also pastes the result back into
+    the full frame.
+    """
+    photo, frame, region = apply_roi(photo, roi_mode, max_size)
+    img_bytes, mime_type, prompt = prepare_request(
+        photo, style_preference, custom_prompt, upload_format, quality, max_size
+    )
+    events = stream_try_on(
+        client, img_bytes, prompt, max_retries=max_retries, cache=cache, limiter=limiter, mime_type=mime_type,
+        similar_index=similar_index, reuse_similar=reuse_similar, coalesce=coalesce
+    )
+    if region is not None and (roi_mode or DEFAULT_ROI_MODE).lower() == "composite":
+        events = _composite_events(events, frame, region)
+    yield from events
+
+# Visualize item on body from single photo with retry logic
+def visualize_item_on_body(client, photo, style_preference, custom_prompt="", max_retries=3, cache=None, limiter=None,
+                           upload_format=None, quality=None, max_size=None, roi_mode=None, coalesce=True):
+    """
+    Generate virtual try-on visualization with enhanced image quality
+
+    Identical concurrent requests share one call unless coalesce=False.
+    """
+    photo, frame, region = apply_roi(photo, roi_mode, max_size)
+    img_bytes, mime_type, prompt = prepare_request(
+        photo, style_preference, custom_prompt, upload_format, quality, max_size
+    )
+    text_response, generated_images = generate_try_on(
+        client, img_bytes, prompt, max_retries=max_retries, cache=cache, limiter=limiter, mime_type=mime_type,
+        coalesce=coalesce
+    )
+    if region is not None and (roi_mode or DEFAULT_ROI_MODE).lower() == "composite":
+        with span("composite", payload_bytes=sum(len(data) for data in generated_images)):
+            generated_images = [composite(frame, region, data) for data in generated_images]
+    return text_response, generated_images